@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from db_config import DBConfig
+from report_metrics import METRICS
+
+KEYWORD_CACHE_SIZE = int(os.getenv('KEYWORD_CACHE_SIZE', '10000'))
+# Also keep results in the KeywordExtractionCache table so they survive restarts
+KEYWORD_CACHE_PERSIST = os.getenv('KEYWORD_CACHE_PERSIST', 'false').lower() == 'true'
+# Bump when keyword post-processing changes so cached results are recomputed
+CACHE_FORMAT_VERSION = 2
+
+
+def description_hash(cleaned_description):
+    """Content address for a description that has already been cleaned for NLP"""
+    return hashlib.sha256(cleaned_description.encode('utf-8')).hexdigest()
+
+
+def pipeline_fingerprint(nlp):
+    """Identify the exact pipeline (model, versions, components) that produced a result"""
+    import spacy
+    import medspacy
+
+    meta = nlp.meta
+    parts = [
+        meta.get('name', ''),
+        meta.get('version', ''),
+        spacy.__version__,
+        getattr(medspacy, '__version__', ''),
+        ",".join(nlp.pipe_names),
+        str(CACHE_FORMAT_VERSION),
+    ]
+    return hashlib.sha256("|".join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+class LRUCache:
+    """Small thread-safe LRU map shared by every processor in the process"""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+_MEMORY_TIER = LRUCache(KEYWORD_CACHE_SIZE)
+_PURGED_VERSIONS = set()
+_PURGE_LOCK = threading.Lock()
+
+
+class KeywordCache:
+    """
+    Content-addressed cache from cleaned-description hash to extracted
+    (keyword, entity label) pairs.
+    The in-process LRU tier is checked first, then the optional Postgres tier.
+    Entries are keyed by pipeline version, so upgrading the model or medspacy
+    automatically stops old results from being served.
+    """
+    def __init__(self, pipeline_version, cursor=None, schema=None, persist=KEYWORD_CACHE_PERSIST):
+        self.pipeline_version = pipeline_version
+        self.cursor = cursor if persist else None
+        self.schema = schema or DBConfig.SCHEMA
+        self.memory = _MEMORY_TIER
+        self.hits = 0
+        self.misses = 0
+        # One cache can serve several NLP executor threads
+        self.stats_lock = threading.Lock()
+
+    def get_many(self, hashes):
+        """Return {hash: entity set} for every hash found in either tier"""
+        unique = set(hashes)
+        found = {}
+        missing = []
+        for h in unique:
+            entities = self.memory.get((self.pipeline_version, h))
+            if entities is None:
+                missing.append(h)
+            else:
+                found[h] = entities
+
+        if missing and self.cursor is not None:
+            self.cursor.execute(f"""
+                SELECT "DescriptionHash", "Keywords"
+                FROM "{self.schema}"."KeywordExtractionCache"
+                WHERE "PipelineVersion" = %s
+                  AND "DescriptionHash" = ANY(%s)
+            """, (self.pipeline_version, missing))
+            for row in self.cursor.fetchall():
+                entities = frozenset((text, label) for text, label in row['Keywords'])
+                found[row['DescriptionHash']] = entities
+                self.memory.put((self.pipeline_version, row['DescriptionHash']), entities)
+
+        with self.stats_lock:
+            self.hits += len(found)
+            self.misses += len(unique) - len(found)
+        METRICS.inc('keyword_cache_lookups_total', len(found), result='hit')
+        METRICS.inc('keyword_cache_lookups_total', len(unique) - len(found), result='miss')
+        return found
+
+    def get(self, h):
+        return self.get_many([h]).get(h)
+
+    def put_many(self, results):
+        """Store {hash: entity set}; the Postgres write joins the caller's transaction"""
+        if not results:
+            return
+        for h, entities in results.items():
+            self.memory.put((self.pipeline_version, h), frozenset(entities))
+
+        if self.cursor is not None:
+            execute_values(self.cursor, f"""
+                INSERT INTO "{self.schema}"."KeywordExtractionCache" ("PipelineVersion", "DescriptionHash", "Keywords")
+                VALUES %s
+                ON CONFLICT ("PipelineVersion", "DescriptionHash") DO NOTHING
+            """, [
+                (self.pipeline_version, h, json.dumps([list(e) for e in sorted(entities)]))
+                for h, entities in results.items()
+            ], page_size=len(results))
+
+    def put(self, h, entities):
+        self.put_many({h: entities})
+
+    def purge_stale(self):
+        """
+        Drop persisted entries written by any other pipeline version (once per process).
+        Runs on its own short connection, so a rollback of the caller's transaction
+        cannot undo it; the version is only marked purged once the delete has committed.
+        """
+        if self.cursor is None:
+            return 0
+        with _PURGE_LOCK:
+            if self.pipeline_version in _PURGED_VERSIONS:
+                return 0
+            conn = psycopg2.connect(**DBConfig.get_connection_params())
+            try:
+                with conn, conn.cursor() as cursor:
+                    cursor.execute(f"""
+                        DELETE FROM "{self.schema}"."KeywordExtractionCache"
+                        WHERE "PipelineVersion" <> %s
+                    """, (self.pipeline_version,))
+                    deleted = cursor.rowcount
+            finally:
+                conn.close()
+            _PURGED_VERSIONS.add(self.pipeline_version)
+            return deleted
@@ -2,7 +2,7 @@ import argparse
 import json
 import os
 import uuid
-from datetime import datetime, date, time
+from datetime import datetime, date, time, timedelta
 
 import psycopg2
 from psycopg2.extras import RealDictCursor
@@ -10,9 +10,37 @@ from dotenv import load_dotenv
 from gpudb import GPUdb
 
 from db_config import DBConfig
+from kinetica_writer import create_writer, in_expression, KINETICA_DELETE_BATCH_SIZE
 
 load_dotenv()
 
+ANALYSIS_TABLES = [
+    "medication_features",
+    "side_effects_by_medication",
+    "side_effects_by_patient",
+    "top_side_effects",
+]
+# Readers query views named after ANALYSIS_TABLES. Each full rebuild loads
+# versioned tables <table>_v<UTC timestamp>_<random>; the views are then re-pointed at them.
+# The live and previous version suffixes are kept in VERSIONS_TABLE.
+VERSIONS_TABLE = "analysis_table_versions"
+VERSIONS_KEY = "side_effect_analysis"
+# Plain tables from before the views are renamed to <table>_legacy on the first swap
+LEGACY_SUFFIX = "_legacy"
+# Copies left by the earlier rename-based swap
+OLD_SWAP_SUFFIXES = ["_staging", "_prev", "_swap"]
+
+# Materialized side-effect summaries in Postgres (see sqlscript/schema.sql)
+SIDE_EFFECT_ROLLUPS = [
+    "SideEffectsByMedicationRollup",
+    "SideEffectsByPatientRollup",
+    "TopSideEffectsRollup",
+]
+
+SYNC_JOB_NAME = "kinetica_side_effect_sync"
+# Re-read changes this many seconds before the stored watermark so late commits are not missed
+SYNC_OVERLAP_SECONDS = int(os.getenv("KINETICA_SYNC_OVERLAP_SECONDS", "300"))
+
 
 class KineticaConfig:
     HOST = os.getenv("KINETICA_HOST", "https://cluster1450.saas.kinetica.com/cluster1450/gpudb-0")
@@ -64,28 +92,125 @@ def qualify(name: str) -> str:
     return f"{schema}.{name}" if schema else name
 
 
-def drop_tables(db: GPUdb):
-    """Drop analysis tables if they exist (fresh rebuild)."""
-    for tbl in [
-        "medication_features",
-        "side_effects_by_medication",
-        "side_effects_by_patient",
-        "top_side_effects",
-    ]:
+def drop_tables(db: GPUdb, suffix=""):
+    """Drop analysis tables (or their suffixed copies) if they exist."""
+    for tbl in ANALYSIS_TABLES:
         try:
-            db.execute_sql(f"DROP TABLE IF EXISTS {qualify(tbl)};")
-            print(f"Dropped {qualify(tbl)}")
+            db.execute_sql(f"DROP TABLE IF EXISTS {qualify(tbl + suffix)};")
+            print(f"Dropped {qualify(tbl + suffix)}")
         except Exception as exc:
-            print(f"Drop failed for {qualify(tbl)}: {exc}")
+            print(f"Drop failed for {qualify(tbl + suffix)}: {exc}")
+
+
+def table_exists(db: GPUdb, name: str) -> bool:
+    return bool(db.has_table(table_name=name)["table_exists"])
+
+
+def new_version_suffix():
+    # The random part keeps two rebuilds started in the same second apart
+    return "_v" + datetime.utcnow().strftime("%Y%m%d%H%M%S") + "_" + uuid.uuid4().hex[:8]
+
+
+def load_versions(db: GPUdb):
+    """(live suffix, previous suffix) of the analysis tables, or (None, None) before the first swap."""
+    if not table_exists(db, qualify(VERSIONS_TABLE)):
+        return None, None
+    response = db.get_records(
+        table_name=qualify(VERSIONS_TABLE),
+        offset=0,
+        limit=1,
+        encoding="json",
+        options={"expression": f"name = '{VERSIONS_KEY}'"},
+    )
+    if not response["records_json"]:
+        return None, None
+    row = json.loads(response["records_json"][0])
+    return row["live_suffix"], (row["previous_suffix"] or None)
+
+
+def save_versions(db: GPUdb, live_suffix, previous_suffix):
+    run_sql(db, f"""
+    CREATE TABLE IF NOT EXISTS {qualify(VERSIONS_TABLE)} (
+        name STRING PRIMARY KEY,
+        live_suffix STRING,
+        previous_suffix STRING,
+        swapped_at STRING
+    );
+    """)
+    get_writer(db).insert(qualify(VERSIONS_TABLE), [{
+        "name": VERSIONS_KEY,
+        "live_suffix": live_suffix,
+        "previous_suffix": previous_suffix or "",
+        "swapped_at": datetime.utcnow().isoformat(),
+    }], update_on_existing_pk=True)
+
+
+def point_views(db: GPUdb, suffix):
+    """Re-point every analysis view at the tables with suffix (each CREATE OR REPLACE VIEW is atomic)."""
+    for tbl in ANALYSIS_TABLES:
+        db.execute_sql(f"CREATE OR REPLACE VIEW {qualify(tbl)} AS SELECT * FROM {qualify(tbl + suffix)};")
+
+
+def live_suffix(db: GPUdb):
+    """Suffix of the tables the views read (empty while the analysis tables are still plain tables)."""
+    live, _ = load_versions(db)
+    return live if live is not None else ""
+
+
+def migrate_plain_tables(db: GPUdb):
+    """
+    First swap only: rename the plain analysis tables to <table>_legacy so
+    their names are free for the views. Readers get table-not-found between
+    each rename and the CREATE VIEW that follows it; later swaps have no gap.
+    """
+    for tbl in ANALYSIS_TABLES:
+        if table_exists(db, qualify(tbl)):
+            db.execute_sql(f"ALTER TABLE {qualify(tbl)} RENAME TO {tbl}{LEGACY_SUFFIX};")
+    for suffix in OLD_SWAP_SUFFIXES:
+        drop_tables(db, suffix)
+
+
+def publish_version(db: GPUdb, suffix):
+    """
+    Put the tables with suffix live by re-pointing the views at them. The
+    version they replace is kept for rollback_tables; the one before it is
+    dropped. Readers see the old tables or the new ones, never a gap.
+    """
+    missing = [tbl for tbl in ANALYSIS_TABLES if not table_exists(db, qualify(tbl + suffix))]
+    if missing:
+        raise RuntimeError(f"Tables for version {suffix} missing, nothing swapped: {', '.join(missing)}")
+
+    live, previous = load_versions(db)
+    if live is None:
+        migrate_plain_tables(db)
+        live = LEGACY_SUFFIX if table_exists(db, qualify(ANALYSIS_TABLES[0] + LEGACY_SUFFIX)) else None
+
+    point_views(db, suffix)
+    save_versions(db, suffix, live)
+    if previous and previous not in (suffix, live):
+        drop_tables(db, previous)
+    print(f"Views now read version {suffix}; previous version {live or '(none)'} kept for rollback")
+
 
+def rollback_tables(db: GPUdb):
+    """Point the views back at the previous version (running it again rolls forward)."""
+    live, previous = load_versions(db)
+    missing = [tbl for tbl in ANALYSIS_TABLES if not previous or not table_exists(db, qualify(tbl + previous))]
+    if missing:
+        raise RuntimeError(f"No previous version of {', '.join(missing)}; nothing rolled back")
 
-def ensure_tables(db: GPUdb):
-    """Create analysis tables if missing."""
+    point_views(db, previous)
+    save_versions(db, previous, live)
+    print(f"Rolled back {len(ANALYSIS_TABLES)} views to version {previous}")
+
+
+def ensure_tables(db: GPUdb, suffix=""):
+    """Create analysis tables (or their suffixed copies) if missing."""
     schema = KineticaConfig.SCHEMA
     ddl = [
         f'CREATE SCHEMA IF NOT EXISTS {schema};' if schema else None,
         f"""
-        CREATE TABLE IF NOT EXISTS {qualify("medication_features")} (
+        CREATE TABLE IF NOT EXISTS {qualify("medication_features" + suffix)} (
             prescribed_medication_id STRING PRIMARY KEY,
             prescription_id STRING,
             patient_id STRING,
@@ -101,7 +226,7 @@ def ensure_tables(db: GPUdb):
         );
         """,
         f"""
-        CREATE TABLE IF NOT EXISTS {qualify("side_effects_by_medication")} (
+        CREATE TABLE IF NOT EXISTS {qualify("side_effects_by_medication" + suffix)} (
             medication_id STRING,
             medication_name STRING,
             side_effect_name STRING,
@@ -112,7 +237,7 @@ def ensure_tables(db: GPUdb):
         );
         """,
         f"""
-        CREATE TABLE IF NOT EXISTS {qualify("side_effects_by_patient")} (
+        CREATE TABLE IF NOT EXISTS {qualify("side_effects_by_patient" + suffix)} (
             patient_id STRING,
             patient_name STRING,
             patient_username STRING,
@@ -123,7 +248,7 @@ def ensure_tables(db: GPUdb):
         );
         """,
         f"""
-        CREATE TABLE IF NOT EXISTS {qualify("top_side_effects")} (
+        CREATE TABLE IF NOT EXISTS {qualify("top_side_effects" + suffix)} (
             side_effect_name STRING,
             total_reports LONG,
             top_medication STRING,
@@ -134,10 +259,10 @@ def ensure_tables(db: GPUdb):
     run_sql(db, [stmt for stmt in ddl if stmt])
 
 
-def fetch_features(pg_conn, limit=50):
+def fetch_features(pg_conn, limit=50, patient_ids=None):
     """
     Pull a feature set from Postgres. Features include a lookback to previous rows
-    (days_since_prev) per patient+medication.
+    (days_since_prev) per patient+medication. patient_ids restricts it to those patients.
     """
     def normalize_feature_row(row):
         """Coerce DB types (UUID/Decimal/date) into Kinetica-friendly primitives."""
@@ -199,19 +324,68 @@ def fetch_features(pg_conn, limit=50):
     FROM "{schema}"."PrescribedMedication" pm
     JOIN "{schema}"."Prescription" p ON pm."PrescriptionId" = p."PrescriptionId"
     WHERE p."IsDeleted" = FALSE AND pm."IsDeleted" = FALSE
+      AND (%(patients)s::uuid[] IS NULL OR p."PatientId" = ANY(%(patients)s::uuid[]))
     ORDER BY pm."PrescribedDate" DESC
     """
     if limit:
         sql += f" LIMIT {int(limit)}"
     with pg_conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(sql)
+        cur.execute(sql, {"patients": patient_ids})
         rows = cur.fetchall()
     return [normalize_feature_row(r) for r in rows]
 
 
-def fetch_side_effects_by_med(pg_conn):
+def normalize_med_row(r):
+    return {
+        "medication_id": str(r.get("medication_id") or ""),
+        "medication_name": r.get("medication_name") or "",
+        "side_effect_name": r.get("side_effect_name") or "",
+        "severity": r.get("severity") or "",
+        "report_count": int(r.get("report_count") or 0),
+        "patient_count": int(r.get("patient_count") or 0),
+        "last_reported": (r.get("last_reported") or ""),
+    }
+
+
+def normalize_patient_row(r):
+    return {
+        "patient_id": str(r.get("patient_id") or ""),
+        "patient_name": r.get("patient_name") or "",
+        "patient_username": r.get("patient_username") or "",
+        "report_count": int(r.get("report_count") or 0),
+        "unique_side_effects": int(r.get("unique_side_effects") or 0),
+        "last_reported": (r.get("last_reported") or ""),
+        "medications": r.get("medications") or "",
+    }
+
+
+def normalize_top_row(r):
+    return {
+        "side_effect_name": r.get("side_effect_name") or "",
+        "total_reports": int(r.get("total_reports") or 0),
+        "top_medication": r.get("top_medication") or "",
+        "top_medication_report_count": int(r.get("top_medication_report_count") or 0),
+    }
+
+
+def fetch_side_effects_by_med(pg_conn, medication_ids=None, use_rollups=False):
     schema = DBConfig.SCHEMA
-    sql = f"""
+    if use_rollups:
+        sql = f"""
+    SELECT
+        "MedicationId" AS medication_id,
+        "MedicationName" AS medication_name,
+        "SideEffectName" AS side_effect_name,
+        "Severity" AS severity,
+        "ReportCount" AS report_count,
+        "PatientCount" AS patient_count,
+        "LastReported" AS last_reported
+    FROM "{schema}"."SideEffectsByMedicationRollup"
+    WHERE %(medications)s::uuid[] IS NULL OR "MedicationId" = ANY(%(medications)s::uuid[])
+    ORDER BY report_count DESC;
+    """
+    else:
+        sql = f"""
     SELECT
         pm."MedicationId" AS medication_id,
         pm."MedicationNameSnapshot" AS medication_name,
@@ -221,34 +395,37 @@ def fetch_side_effects_by_med(pg_conn):
         COUNT(DISTINCT pr."PatientId") AS patient_count,
         MAX(se."OnsetDate") AS last_reported
     FROM "{schema}"."PatientSideEffect" se
-    JOIN "{schema}"."PrescribedMedication" pm ON se."PrescribedMedicationID" = pm."PrescribedMedicationId"
+    JOIN "{schema}"."PrescribedMedication" pm ON se."PrescribedMedicationId" = pm."PrescribedMedicationId"
     JOIN "{schema}"."Prescription" pr ON pm."PrescriptionId" = pr."PrescriptionId"
     WHERE se."IsDeleted" = FALSE AND pm."IsDeleted" = FALSE AND pr."IsDeleted" = FALSE
+      AND (%(medications)s::uuid[] IS NULL OR pm."MedicationId" = ANY(%(medications)s::uuid[]))
     GROUP BY pm."MedicationId", pm."MedicationNameSnapshot", se."SideEffectName", se."Severity"
     ORDER BY report_count DESC;
     """
     with pg_conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(sql)
+        cur.execute(sql, {"medications": medication_ids})
         rows = cur.fetchall()
-    out = []
-    for r in rows:
-        out.append(
-            {
-                "medication_id": str(r.get("medication_id") or ""),
-                "medication_name": r.get("medication_name") or "",
-                "side_effect_name": r.get("side_effect_name") or "",
-                "severity": r.get("severity") or "",
-                "report_count": int(r.get("report_count") or 0),
-                "patient_count": int(r.get("patient_count") or 0),
-                "last_reported": (r.get("last_reported") or ""),
-            }
-        )
-    return out
+    return [normalize_med_row(r) for r in rows]
 
 
-def fetch_side_effects_by_patient(pg_conn):
+def fetch_side_effects_by_patient(pg_conn, patient_ids=None, use_rollups=False):
     schema = DBConfig.SCHEMA
-    sql = f"""
+    if use_rollups:
+        sql = f"""
+    SELECT
+        "PatientId" AS patient_id,
+        "PatientName" AS patient_name,
+        "PatientUsername" AS patient_username,
+        "ReportCount" AS report_count,
+        "UniqueSideEffects" AS unique_side_effects,
+        "LastReported" AS last_reported,
+        "Medications" AS medications
+    FROM "{schema}"."SideEffectsByPatientRollup"
+    WHERE %(patients)s::uuid[] IS NULL OR "PatientId" = ANY(%(patients)s::uuid[])
+    ORDER BY report_count DESC;
+    """
+    else:
+        sql = f"""
     SELECT
         pr."PatientId" AS patient_id,
         CONCAT(u."FirstName", ' ', u."LastName") AS patient_name,
@@ -258,44 +435,45 @@ def fetch_side_effects_by_patient(pg_conn):
         MAX(se."OnsetDate") AS last_reported,
         STRING_AGG(DISTINCT pm."MedicationNameSnapshot", ', ' ORDER BY pm."MedicationNameSnapshot") AS medications
     FROM "{schema}"."PatientSideEffect" se
-    JOIN "{schema}"."PrescribedMedication" pm ON se."PrescribedMedicationID" = pm."PrescribedMedicationId"
+    JOIN "{schema}"."PrescribedMedication" pm ON se."PrescribedMedicationId" = pm."PrescribedMedicationId"
     JOIN "{schema}"."Prescription" pr ON pm."PrescriptionId" = pr."PrescriptionId"
     JOIN "{schema}"."User" u ON pr."PatientId" = u."UserId"
         WHERE se."IsDeleted" = FALSE AND pm."IsDeleted" = FALSE AND pr."IsDeleted" = FALSE
+          AND (%(patients)s::uuid[] IS NULL OR pr."PatientId" = ANY(%(patients)s::uuid[]))
     GROUP BY pr."PatientId", u."FirstName", u."LastName", u."Username"
     ORDER BY report_count DESC;
     """
     with pg_conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(sql)
+        cur.execute(sql, {"patients": patient_ids})
         rows = cur.fetchall()
-    out = []
-    for r in rows:
-        out.append(
-            {
-                "patient_id": str(r.get("patient_id") or ""),
-                "patient_name": r.get("patient_name") or "",
-                "patient_username": r.get("patient_username") or "",
-                "report_count": int(r.get("report_count") or 0),
-                "unique_side_effects": int(r.get("unique_side_effects") or 0),
-                "last_reported": (r.get("last_reported") or ""),
-                "medications": r.get("medications") or "",
-            }
-        )
-    return out
+    return [normalize_patient_row(r) for r in rows]
 
 
-def fetch_top_side_effects(pg_conn):
+def fetch_top_side_effects(pg_conn, side_effect_names=None, use_rollups=False):
     schema = DBConfig.SCHEMA
-    sql = f"""
+    if use_rollups:
+        sql = f"""
+    SELECT
+        "SideEffectName" AS side_effect_name,
+        "TotalReports" AS total_reports,
+        "TopMedication" AS top_medication,
+        "TopMedicationReportCount" AS top_medication_report_count
+    FROM "{schema}"."TopSideEffectsRollup"
+    WHERE %(names)s::text[] IS NULL OR "SideEffectName" = ANY(%(names)s::text[])
+    ORDER BY total_reports DESC;
+    """
+    else:
+        sql = f"""
     WITH counted AS (
         SELECT
             se."SideEffectName" AS side_effect_name,
             pm."MedicationNameSnapshot" AS medication_name,
             COUNT(*) AS cnt
         FROM "{schema}"."PatientSideEffect" se
-        JOIN "{schema}"."PrescribedMedication" pm ON se."PrescribedMedicationID" = pm."PrescribedMedicationId"
+        JOIN "{schema}"."PrescribedMedication" pm ON se."PrescribedMedicationId" = pm."PrescribedMedicationId"
         JOIN "{schema}"."Prescription" pr ON pm."PrescriptionId" = pr."PrescriptionId"
         WHERE se."IsDeleted" = FALSE AND pm."IsDeleted" = FALSE AND pr."IsDeleted" = FALSE
+          AND (%(names)s::text[] IS NULL OR se."SideEffectName" = ANY(%(names)s::text[]))
         GROUP BY se."SideEffectName", pm."MedicationNameSnapshot"
     ),
     ranked AS (
@@ -317,22 +495,149 @@ def fetch_top_side_effects(pg_conn):
     ORDER BY total_reports DESC;
     """
     with pg_conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(sql)
+        cur.execute(sql, {"names": side_effect_names})
         rows = cur.fetchall()
-    out = []
-    for r in rows:
-        out.append(
-            {
-                "side_effect_name": r.get("side_effect_name") or "",
-                "total_reports": int(r.get("total_reports") or 0),
-                "top_medication": r.get("top_medication") or "",
-                "top_medication_report_count": int(r.get("top_medication_report_count") or 0),
-            }
-        )
-    return out
+    return [normalize_top_row(r) for r in rows]
+
+
+def refresh_side_effect_rollups(pg_conn, concurrently=True):
+    """
+    Recompute the side-effect materialized views. CONCURRENTLY keeps them
+    readable by dashboards during the refresh (it relies on their unique indexes).
+    """
+    schema = DBConfig.SCHEMA
+    mode = " CONCURRENTLY" if concurrently else ""
+    with pg_conn.cursor() as cur:
+        for view in SIDE_EFFECT_ROLLUPS:
+            cur.execute(f'REFRESH MATERIALIZED VIEW{mode} "{schema}"."{view}";')
+    pg_conn.commit()
+    print(f"Refreshed {len(SIDE_EFFECT_ROLLUPS)} side-effect rollups")
 
 
-def push_features(db: GPUdb, features):
+def fetch_side_effect_summaries(pg_conn, medication_ids=None, patient_ids=None, side_effect_names=None,
+                                use_rollups=False):
+    """
+    All three side-effect summaries from one scan of the joined side-effect rows.
+    The join runs once into a temp table; the per-medication, per-patient and
+    top summaries are aggregated from it. With every filter None the summaries
+    cover everything; otherwise the scan takes rows matching any filter and
+    each summary keeps its own keys (None or [] skips that summary).
+    With use_rollups the summaries are read from the materialized rollups instead.
+    Returns (med_rows, patient_rows, top_rows).
+    """
+    schema = DBConfig.SCHEMA
+    full = medication_ids is None and patient_ids is None and side_effect_names is None
+    if use_rollups:
+        return (
+            fetch_side_effects_by_med(pg_conn, medication_ids, use_rollups=True) if full or medication_ids else [],
+            fetch_side_effects_by_patient(pg_conn, patient_ids, use_rollups=True) if full or patient_ids else [],
+            fetch_top_side_effects(pg_conn, side_effect_names, use_rollups=True) if full or side_effect_names else [],
+        )
+    params = {
+        "full": full,
+        "medications": medication_ids,
+        "patients": patient_ids,
+        "names": side_effect_names,
+    }
+    with pg_conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("DROP TABLE IF EXISTS pg_temp.side_effect_rows;")
+        cur.execute(f"""
+        CREATE TEMP TABLE side_effect_rows AS
+        SELECT
+            pm."MedicationId" AS medication_id,
+            pm."MedicationNameSnapshot" AS medication_name,
+            se."SideEffectName" AS side_effect_name,
+            se."Severity" AS severity,
+            se."OnsetDate" AS onset_date,
+            pr."PatientId" AS patient_id
+        FROM "{schema}"."PatientSideEffect" se
+        JOIN "{schema}"."PrescribedMedication" pm ON se."PrescribedMedicationId" = pm."PrescribedMedicationId"
+        JOIN "{schema}"."Prescription" pr ON pm."PrescriptionId" = pr."PrescriptionId"
+        WHERE se."IsDeleted" = FALSE AND pm."IsDeleted" = FALSE AND pr."IsDeleted" = FALSE
+          AND (%(full)s
+               OR pm."MedicationId" = ANY(%(medications)s::uuid[])
+               OR pr."PatientId" = ANY(%(patients)s::uuid[])
+               OR se."SideEffectName" = ANY(%(names)s::text[]));
+        """, params)
+
+        med_rows = patient_rows = top_rows = []
+        if full or medication_ids:
+            cur.execute("""
+            SELECT
+                medication_id,
+                medication_name,
+                side_effect_name,
+                severity,
+                COUNT(*) AS report_count,
+                COUNT(DISTINCT patient_id) AS patient_count,
+                MAX(onset_date) AS last_reported
+            FROM side_effect_rows
+            WHERE %(full)s OR medication_id = ANY(%(medications)s::uuid[])
+            GROUP BY medication_id, medication_name, side_effect_name, severity
+            ORDER BY report_count DESC;
+            """, params)
+            med_rows = [normalize_med_row(r) for r in cur.fetchall()]
+
+        if full or patient_ids:
+            cur.execute(f"""
+            WITH per_patient AS (
+                SELECT
+                    patient_id,
+                    COUNT(*) AS report_count,
+                    COUNT(DISTINCT side_effect_name) AS unique_side_effects,
+                    MAX(onset_date) AS last_reported,
+                    STRING_AGG(DISTINCT medication_name, ', ' ORDER BY medication_name) AS medications
+                FROM side_effect_rows
+                WHERE %(full)s OR patient_id = ANY(%(patients)s::uuid[])
+                GROUP BY patient_id
+            )
+            SELECT
+                p.patient_id,
+                CONCAT(u."FirstName", ' ', u."LastName") AS patient_name,
+                u."Username" AS patient_username,
+                p.report_count,
+                p.unique_side_effects,
+                p.last_reported,
+                p.medications
+            FROM per_patient p
+            JOIN "{schema}"."User" u ON p.patient_id = u."UserId"
+            ORDER BY p.report_count DESC;
+            """, params)
+            patient_rows = [normalize_patient_row(r) for r in cur.fetchall()]
+
+        if full or side_effect_names:
+            cur.execute("""
+            WITH counted AS (
+                SELECT side_effect_name, medication_name, COUNT(*) AS cnt
+                FROM side_effect_rows
+                WHERE %(full)s OR side_effect_name = ANY(%(names)s::text[])
+                GROUP BY side_effect_name, medication_name
+            ),
+            ranked AS (
+                SELECT
+                    side_effect_name,
+                    medication_name,
+                    cnt,
+                    SUM(cnt) OVER (PARTITION BY side_effect_name) AS total_reports,
+                    ROW_NUMBER() OVER (PARTITION BY side_effect_name ORDER BY cnt DESC, medication_name) AS rn
+                FROM counted
+            )
+            SELECT
+                side_effect_name,
+                total_reports,
+                medication_name AS top_medication,
+                cnt AS top_medication_report_count
+            FROM ranked
+            WHERE rn = 1
+            ORDER BY total_reports DESC;
+            """, params)
+            top_rows = [normalize_top_row(r) for r in cur.fetchall()]
+
+        cur.execute("DROP TABLE side_effect_rows;")
+    return med_rows, patient_rows, top_rows
+
+
+def push_features(db: GPUdb, features, suffix=""):
     if not features:
         return 0
     columns = [
@@ -349,7 +654,7 @@ def push_features(db: GPUdb, features):
         "medication_status",
         "days_since_prev",
     ]
-    return bulk_insert_sql(db, qualify("medication_features"), columns, features)
+    return bulk_insert(db, qualify("medication_features" + suffix), columns, features)
 
 
 def score_row(row):
@@ -392,7 +697,7 @@ def push_predictions(db: GPUdb, prediction_rows):
     return 0
 
 
-def push_side_effects_by_med(db: GPUdb, rows):
+def push_side_effects_by_med(db: GPUdb, rows, replace=True, suffix=""):
     columns = [
         "medication_id",
         "medication_name",
@@ -403,11 +708,12 @@ def push_side_effects_by_med(db: GPUdb, rows):
         "last_reported",
     ]
     # Clear existing summary
-    db.execute_sql(f"DELETE FROM {qualify('side_effects_by_medication')};")
-    return bulk_insert_sql(db, qualify("side_effects_by_medication"), columns, rows)
+    if replace:
+        db.execute_sql(f"DELETE FROM {qualify('side_effects_by_medication' + suffix)};")
+    return bulk_insert(db, qualify("side_effects_by_medication" + suffix), columns, rows)
 
 
-def push_side_effects_by_patient(db: GPUdb, rows):
+def push_side_effects_by_patient(db: GPUdb, rows, replace=True, suffix=""):
     columns = [
         "patient_id",
         "patient_name",
@@ -417,68 +723,265 @@ def push_side_effects_by_patient(db: GPUdb, rows):
         "last_reported",
         "medications",
     ]
-    db.execute_sql(f"DELETE FROM {qualify('side_effects_by_patient')};")
-    return bulk_insert_sql(db, qualify("side_effects_by_patient"), columns, rows)
+    if replace:
+        db.execute_sql(f"DELETE FROM {qualify('side_effects_by_patient' + suffix)};")
+    return bulk_insert(db, qualify("side_effects_by_patient" + suffix), columns, rows)
 
 
-def push_top_side_effects(db: GPUdb, rows):
+def push_top_side_effects(db: GPUdb, rows, replace=True, suffix=""):
     columns = [
         "side_effect_name",
         "total_reports",
         "top_medication",
         "top_medication_report_count",
     ]
-    db.execute_sql(f"DELETE FROM {qualify('top_side_effects')};")
-    return bulk_insert_sql(db, qualify("top_side_effects"), columns, rows)
+    if replace:
+        db.execute_sql(f"DELETE FROM {qualify('top_side_effects' + suffix)};")
+    return bulk_insert(db, qualify("top_side_effects" + suffix), columns, rows)
+
+
+_WRITERS = {}
 
 
-def bulk_insert_sql(db: GPUdb, table: str, columns: list[str], rows: list[dict]):
-    """Insert rows via SQL VALUES."""
+def get_writer(db: GPUdb):
+    """One binary-ingest writer per Kinetica connection"""
+    if id(db) not in _WRITERS:
+        _WRITERS[id(db)] = create_writer(db)
+    return _WRITERS[id(db)]
+
+
+def bulk_insert(db: GPUdb, table: str, columns: list[str], rows: list[dict]):
+    """Insert rows through the binary record ingest path."""
     if not rows:
         return 0
-    col_sql = ",".join(columns)
-
-    def esc(val):
-        if val is None:
-            return ""
-        return str(val).replace("'", "''")
-
-    batch_size = 100
-    total = 0
-    for i in range(0, len(rows), batch_size):
-        chunk = rows[i : i + batch_size]
-        values_sql = []
-        for r in chunk:
-            vals = []
-            for c in columns:
-                v = r.get(c)
-                if isinstance(v, (int, float)):
-                    vals.append(str(v))
-                else:
-                    vals.append(f"'{esc(v)}'")
-            values_sql.append(f"({','.join(vals)})")
-        sql = f"INSERT INTO {table} ({col_sql}) VALUES " + ",".join(values_sql) + ";"
-        db.execute_sql(sql)
-        total += len(chunk)
-    return total
-
-
-def main(limit=None):
-    with connect_pg() as pg_conn:
-        kin = connect_kinetica()
-        drop_tables(kin)
-        ensure_tables(kin)
+    records = [{c: r.get(c) for c in columns} for r in rows]
+    return get_writer(db).insert(table, records)
+
+
+def load_sync_watermark(pg_conn, job_name=SYNC_JOB_NAME):
+    schema = DBConfig.SCHEMA
+    with pg_conn.cursor() as cur:
+        cur.execute(
+            f'SELECT "HighWaterMark" FROM "{schema}"."ComplianceJobWatermark" WHERE "JobName" = %s',
+            (job_name,),
+        )
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+def save_sync_watermark(pg_conn, high_water_mark, job_name=SYNC_JOB_NAME):
+    schema = DBConfig.SCHEMA
+    with pg_conn.cursor() as cur:
+        cur.execute(
+            f"""
+            INSERT INTO "{schema}"."ComplianceJobWatermark" ("JobName", "HighWaterMark")
+            VALUES (%s, %s)
+            ON CONFLICT ("JobName") DO UPDATE
+            SET "HighWaterMark" = EXCLUDED."HighWaterMark",
+                "UpdatedAt" = NOW()
+            """,
+            (job_name, high_water_mark),
+        )
+    pg_conn.commit()
+
+
+def fetch_changed_groups(pg_conn, since):
+    """
+    Groups touched by rows created, updated or soft-deleted after since.
+    Deleted rows are not filtered out here: their groups must be recomputed
+    so the rows they used to contribute disappear.
+    Returns {"patients", "medications", "side_effects", "prescribed_medications"}
+    lists of group keys; the last holds every PrescribedMedicationId involved.
+    """
+    schema = DBConfig.SCHEMA
+    sql = f"""
+    WITH changed_pm AS (
+        SELECT se."PrescribedMedicationId"
+        FROM "{schema}"."PatientSideEffect" se
+        WHERE GREATEST(se."UpdatedAt", se."CreatedAt") > %(since)s
+        UNION
+        SELECT pm."PrescribedMedicationId"
+        FROM "{schema}"."PrescribedMedication" pm
+        WHERE GREATEST(pm."UpdatedAt", pm."CreatedAt") > %(since)s
+        UNION
+        SELECT pm."PrescribedMedicationId"
+        FROM "{schema}"."PrescribedMedication" pm
+        JOIN "{schema}"."Prescription" pr ON pm."PrescriptionId" = pr."PrescriptionId"
+        WHERE GREATEST(pr."UpdatedAt", pr."CreatedAt") > %(since)s
+    ),
+    affected AS (
+        SELECT pr."PatientId", pm."MedicationId", pm."PrescribedMedicationId"
+        FROM changed_pm c
+        JOIN "{schema}"."PrescribedMedication" pm ON pm."PrescribedMedicationId" = c."PrescribedMedicationId"
+        JOIN "{schema}"."Prescription" pr ON pm."PrescriptionId" = pr."PrescriptionId"
+    )
+    SELECT 'patient' AS kind, "PatientId"::text AS key FROM affected
+    UNION
+    -- Renamed patients show up through User
+    SELECT 'patient', pr."PatientId"::text
+    FROM "{schema}"."User" u
+    JOIN "{schema}"."Prescription" pr ON pr."PatientId" = u."UserId"
+    WHERE GREATEST(u."UpdatedAt", u."CreatedAt") > %(since)s
+    UNION
+    SELECT 'medication', "MedicationId"::text FROM affected
+    UNION
+    SELECT 'prescribed_medication', "PrescribedMedicationId"::text FROM affected
+    UNION
+    SELECT 'side_effect', se."SideEffectName"
+    FROM affected a
+    JOIN "{schema}"."PatientSideEffect" se ON se."PrescribedMedicationId" = a."PrescribedMedicationId";
+    """
+    changed = {"patients": [], "medications": [], "side_effects": [], "prescribed_medications": []}
+    kinds = {
+        "patient": "patients",
+        "medication": "medications",
+        "side_effect": "side_effects",
+        "prescribed_medication": "prescribed_medications",
+    }
+    with pg_conn.cursor() as cur:
+        cur.execute(sql, {"since": since})
+        for kind, key in cur.fetchall():
+            changed[kinds[kind]].append(key)
+    return changed
+
+
+def previous_group_keys(kin, suffix, prescribed_medication_ids):
+    """
+    Patient and medication ids Kinetica still files these prescribed medications
+    under. They differ from Postgres when a MedicationId was corrected or a
+    prescription moved to another patient, and those old groups need recomputing too.
+    """
+    patients, medications = set(), set()
+    ids = list(prescribed_medication_ids)
+    for i in range(0, len(ids), KINETICA_DELETE_BATCH_SIZE):
+        batch = ids[i:i + KINETICA_DELETE_BATCH_SIZE]
+        response = kin.get_records(
+            table_name=qualify("medication_features" + suffix),
+            offset=0,
+            limit=len(batch),
+            encoding="json",
+            options={"expression": in_expression("prescribed_medication_id", batch)},
+        )
+        for record in response["records_json"]:
+            row = json.loads(record)
+            if row.get("patient_id"):
+                patients.add(row["patient_id"])
+            if row.get("medication_id"):
+                medications.add(row["medication_id"])
+    return patients, medications
+
+
+def rebuild(pg_conn, kin, limit=None, use_rollups=False):
+    """
+    Rebuild every analysis table into a new version, then re-point the views.
+    The live version is not touched until every load has succeeded; if one
+    fails, the half-loaded version is dropped, the exception propagates and
+    readers keep the current tables.
+    """
+    suffix = new_version_suffix()
+    try:
+        ensure_tables(kin, suffix)
 
         features = fetch_features(pg_conn, limit=limit)
-        inserted = push_features(kin, features)
+        inserted = push_features(kin, features, suffix=suffix)
+
+        med_rows, patient_rows, top_rows = fetch_side_effect_summaries(pg_conn, use_rollups=use_rollups)
 
-        med_rows = fetch_side_effects_by_med(pg_conn)
-        patient_rows = fetch_side_effects_by_patient(pg_conn)
-        top_rows = fetch_top_side_effects(pg_conn)
+        med_written = push_side_effects_by_med(kin, med_rows, replace=False, suffix=suffix)
+        patient_written = push_side_effects_by_patient(kin, patient_rows, replace=False, suffix=suffix)
+        top_written = push_top_side_effects(kin, top_rows, replace=False, suffix=suffix)
+    except Exception:
+        print(f"Rebuild failed; dropping the unpublished version {suffix}")
+        drop_tables(kin, suffix)
+        raise
 
-        med_written = push_side_effects_by_med(kin, med_rows)
-        patient_written = push_side_effects_by_patient(kin, patient_rows)
-        top_written = push_top_side_effects(kin, top_rows)
+    # Not covered by the cleanup above: once views start moving they may read these tables
+    publish_version(kin, suffix)
+    return inserted, med_written, patient_written, top_written
+
+
+def sync_incremental(pg_conn, kin, since):
+    """
+    Recompute only the groups changed after since: features and per-patient
+    summaries for affected patients, per-medication summaries for affected
+    medications and top rows for affected side-effect names. Each group's
+    Kinetica rows are deleted and re-inserted, which also drops groups that
+    vanished through soft deletes. Groups a changed prescribed medication was
+    filed under before (a corrected MedicationId or a reassigned PatientId) are
+    read back from medication_features and recomputed as well. A renamed side
+    effect keeps its old top_side_effects row until the next full rebuild.
+    """
+    # Views cannot be written to: apply the changes to the version they read
+    suffix = live_suffix(kin)
+    ensure_tables(kin, suffix)
+    writer = get_writer(kin)
+    changed = fetch_changed_groups(pg_conn, since)
+    old_patients, old_medications = previous_group_keys(kin, suffix, changed["prescribed_medications"])
+    changed["patients"] = sorted(set(changed["patients"]) | old_patients)
+    changed["medications"] = sorted(set(changed["medications"]) | old_medications)
+    print(
+        f"Changed since {since}: {len(changed['patients'])} patient(s), "
+        f"{len(changed['medications'])} medication(s), {len(changed['side_effects'])} side effect(s)"
+    )
+
+    med_rows, patient_rows, top_rows = fetch_side_effect_summaries(
+        pg_conn,
+        medication_ids=changed["medications"],
+        patient_ids=changed["patients"],
+        side_effect_names=changed["side_effects"],
+    )
+
+    inserted = med_written = patient_written = top_written = 0
+    if changed["prescribed_medications"]:
+        # Moved rows may sit under a patient that is no longer theirs; clear them by key first
+        writer.delete(qualify("medication_features" + suffix), "prescribed_medication_id",
+                      changed["prescribed_medications"])
+    if changed["patients"]:
+        writer.delete(qualify("medication_features" + suffix), "patient_id", changed["patients"])
+        inserted = push_features(kin, fetch_features(pg_conn, limit=None, patient_ids=changed["patients"]),
+                                 suffix=suffix)
+        writer.delete(qualify("side_effects_by_patient" + suffix), "patient_id", changed["patients"])
+        patient_written = push_side_effects_by_patient(kin, patient_rows, replace=False, suffix=suffix)
+    if changed["medications"]:
+        writer.delete(qualify("side_effects_by_medication" + suffix), "medication_id", changed["medications"])
+        med_written = push_side_effects_by_med(kin, med_rows, replace=False, suffix=suffix)
+    if changed["side_effects"]:
+        writer.delete(qualify("top_side_effects" + suffix), "side_effect_name", changed["side_effects"])
+        top_written = push_top_side_effects(kin, top_rows, replace=False, suffix=suffix)
+    return inserted, med_written, patient_written, top_written
+
+
+def main(limit=None, incremental=False, rollback=False, use_rollups=False):
+    if rollback:
+        rollback_tables(connect_kinetica())
+        return
+
+    with connect_pg() as pg_conn:
+        kin = connect_kinetica()
+        with pg_conn.cursor() as cur:
+            cur.execute("SELECT NOW()")
+            run_started = cur.fetchone()[0]
+
+        watermark = load_sync_watermark(pg_conn) if incremental else None
+        if watermark is not None:
+            # Refreshing every rollup would cost more than the sync itself; the few changed
+            # groups are summarized straight from the base tables instead
+            if use_rollups:
+                print("Incremental sync reads the base tables; rollups are only refreshed on full rebuilds")
+            since = watermark - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+            inserted, med_written, patient_written, top_written = sync_incremental(pg_conn, kin, since)
+        else:
+            if incremental:
+                print("No sync watermark yet: running a full rebuild")
+            if use_rollups:
+                refresh_side_effect_rollups(pg_conn)
+            inserted, med_written, patient_written, top_written = rebuild(
+                pg_conn, kin, limit=limit, use_rollups=use_rollups
+            )
+
+        # A limited rebuild is partial, so it must not become the base for later syncs
+        if watermark is not None or not limit:
+            save_sync_watermark(pg_conn, run_started)
 
         print(
             f"Pushed {inserted} feature rows; "
@@ -491,5 +994,12 @@ def main(limit=None):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Build Kinetica side-effect analytics tables.")
     parser.add_argument("--limit", type=int, default=None, help="Limit rows pulled from Postgres for testing.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Recompute only groups changed since the last run instead of rebuilding everything.")
+    parser.add_argument("--rollback", action="store_true",
+                        help="Point the views back at the version replaced by the last full rebuild.")
+    parser.add_argument("--use-rollups", action="store_true",
+                        help="On full rebuilds, refresh the Postgres side-effect rollups concurrently "
+                             "and export from them (incremental syncs always read the base tables).")
     args = parser.parse_args()
-    main(limit=args.limit)
+    main(limit=args.limit, incremental=args.incremental, rollback=args.rollback, use_rollups=args.use_rollups)
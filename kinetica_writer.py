@@ -0,0 +1,245 @@
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date
+from decimal import Decimal
+
+try:
+    import gpudb
+except ImportError:
+    gpudb = None
+
+# Records per insert_records call (or per multi-head worker batch)
+KINETICA_INGEST_BATCH_SIZE = int(os.getenv('KINETICA_INGEST_BATCH_SIZE', '10000'))
+# Batches sent concurrently when multi-head ingest is off
+KINETICA_FLUSH_WORKERS = int(os.getenv('KINETICA_FLUSH_WORKERS', '4'))
+# Send records straight to the worker ranks that own them
+KINETICA_MULTIHEAD = os.getenv('KINETICA_MULTIHEAD', 'false').lower() == 'true'
+
+# Values per delete expression
+KINETICA_DELETE_BATCH_SIZE = int(os.getenv('KINETICA_DELETE_BATCH_SIZE', '1000'))
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class KineticaIngestError(Exception):
+    """Some batches failed; written is the number of records that did go in"""
+    def __init__(self, table, written, errors):
+        super().__init__(f"{len(errors)} batch(es) failed for {table}: {errors[0]}")
+        self.table = table
+        self.written = written
+        self.errors = errors
+
+
+def _plain(value):
+    """Unwrap numpy scalars / pandas timestamps and stringify UUIDs"""
+    if value is None:
+        return None
+    if hasattr(value, 'to_pydatetime'):
+        value = value.to_pydatetime()
+    elif hasattr(value, 'item') and not isinstance(value, (str, bytes)):
+        value = value.item()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def _epoch_ms(value):
+    # Wall-clock time is stored as-is, like the previous 'YYYY-MM-DD HH:MM:SS' literals
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, datetime.min.time())
+    return int((value.replace(tzinfo=None) - _EPOCH).total_seconds() * 1000)
+
+
+def to_record_value(value, column_type, properties=()):
+    """Convert a Python value to what the binary encoder expects for a Kinetica column"""
+    value = _plain(value)
+    if value is None:
+        return None
+    if 'timestamp' in properties:
+        return _epoch_ms(value)
+    if 'date' in properties and isinstance(value, (datetime, date)):
+        return value.strftime('%Y-%m-%d')
+    if 'datetime' in properties and isinstance(value, (datetime, date)):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if column_type in ('int', 'long'):
+        return int(value)
+    if column_type in ('float', 'double'):
+        return float(value)
+    if column_type == 'string':
+        return value.isoformat() if isinstance(value, (datetime, date)) else str(value)
+    return value
+
+
+def in_expression(column, values):
+    """Kinetica filter expression column in (...) with string literals quoted"""
+    literals = []
+    for value in values:
+        value = _plain(value)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            literals.append(str(value))
+        else:
+            literals.append("'" + str(value).replace("'", "''") + "'")
+    return f"{column} in ({', '.join(literals)})"
+
+
+class KineticaWriter:
+    """
+    Binary record ingest into existing Kinetica tables.
+    Rows are dicts keyed by column name; values are coerced to each column's
+    declared type and sent through GPUdbTable.insert_records in batches of
+    batch_size, with flush_workers batches in flight at once. With multihead
+    the client routes records directly to the worker ranks that own them.
+    No SQL text is built, so values need no escaping.
+    """
+    def __init__(self, db, batch_size=KINETICA_INGEST_BATCH_SIZE, flush_workers=KINETICA_FLUSH_WORKERS,
+                 multihead=KINETICA_MULTIHEAD):
+        if gpudb is None:
+            raise RuntimeError("gpudb is not installed; use LocalKineticaWriter instead")
+        self.db = db
+        self.batch_size = max(1, batch_size)
+        self.flush_workers = max(1, flush_workers)
+        self.multihead = multihead
+        self.local = threading.local()
+        self.columns = {}
+        self.lock = threading.Lock()
+
+    def _table(self, table):
+        """Per-thread table handle (handles are not shared between flush threads)"""
+        handles = getattr(self.local, 'handles', None)
+        if handles is None:
+            handles = self.local.handles = {}
+        if table not in handles:
+            handles[table] = gpudb.GPUdbTable(None, name=table, db=self.db)
+        return handles[table]
+
+    def _column_types(self, table):
+        with self.lock:
+            if table not in self.columns:
+                record_type = self._table(table).get_table_type()
+                self.columns[table] = [
+                    (column.name, column.column_type, tuple(column.column_properties or ()))
+                    for column in record_type.columns
+                ]
+            return self.columns[table]
+
+    def _records(self, table, rows):
+        columns = self._column_types(table)
+        return [
+            {name: to_record_value(row.get(name), column_type, properties)
+             for name, column_type, properties in columns}
+            for row in rows
+        ]
+
+    def insert(self, table, rows, update_on_existing_pk=False):
+        """Insert rows (dicts) into table; returns the number written"""
+        if not rows:
+            return 0
+        options = {'update_on_existing_pk': 'true' if update_on_existing_pk else 'false'}
+
+        if self.multihead:
+            try:
+                handle = gpudb.GPUdbTable(None, name=table, db=self.db, use_multihead_ingest=True,
+                                          multihead_ingest_batch_size=self.batch_size)
+                handle.insert_records(self._records(table, rows), options=options)
+                handle.flush_data_to_server()
+            except Exception as e:
+                # The client does not say which worker batches went in, so none are counted
+                print(f"  ✗ Error in multi-head insert into {table}: {e}")
+                raise KineticaIngestError(table, 0, [e]) from e
+            return len(rows)
+
+        batches = [rows[i:i + self.batch_size] for i in range(0, len(rows), self.batch_size)]
+
+        def flush(batch):
+            self._table(table).insert_records(self._records(table, batch), options=options)
+            return len(batch)
+
+        written = 0
+        errors = []
+        with ThreadPoolExecutor(max_workers=min(self.flush_workers, len(batches))) as pool:
+            futures = [pool.submit(flush, batch) for batch in batches]
+            for batch_num, future in enumerate(futures, 1):
+                try:
+                    written += future.result()
+                except Exception as e:
+                    print(f"  ✗ Error inserting batch {batch_num} into {table}: {e}")
+                    errors.append(e)
+        if errors:
+            raise KineticaIngestError(table, written, errors)
+        return written
+
+    def delete(self, table, column, values):
+        """Delete every row whose column is one of values; returns the number deleted"""
+        values = list(values)
+        deleted = 0
+        for i in range(0, len(values), KINETICA_DELETE_BATCH_SIZE):
+            response = self.db.delete_records(
+                table_name=table,
+                expressions=[in_expression(column, values[i:i + KINETICA_DELETE_BATCH_SIZE])],
+            )
+            deleted += response['count_deleted']
+        return deleted
+
+
+class LocalKineticaWriter:
+    """
+    In-memory stand-in for KineticaWriter, for tests and runs without Kinetica.
+    Records land in self.tables[table]; tables listed in primary_keys honour
+    update_on_existing_pk like the server does.
+    """
+    def __init__(self, primary_keys=None, batch_size=KINETICA_INGEST_BATCH_SIZE):
+        self.primary_keys = primary_keys or {}
+        self.batch_size = max(1, batch_size)
+        self.tables = {}
+        self.batches = 0
+        self.lock = threading.Lock()
+
+    def insert(self, table, rows, update_on_existing_pk=False):
+        if not rows:
+            return 0
+        key_columns = self.primary_keys.get(table)
+        with self.lock:
+            stored = self.tables.setdefault(table, {})
+            for i in range(0, len(rows), self.batch_size):
+                self.batches += 1
+                for row in rows[i:i + self.batch_size]:
+                    record = {name: _plain(value) for name, value in row.items()}
+                    if key_columns:
+                        key = tuple(record.get(c) for c in key_columns)
+                        if key in stored and not update_on_existing_pk:
+                            continue
+                    else:
+                        key = len(stored)
+                    stored[key] = record
+        return len(rows)
+
+    def delete(self, table, column, values):
+        values = {_plain(value) for value in values}
+        with self.lock:
+            stored = self.tables.get(table, {})
+            doomed = [key for key, record in stored.items() if record.get(column) in values]
+            for key in doomed:
+                del stored[key]
+        return len(doomed)
+
+    def rows(self, table):
+        with self.lock:
+            return list(self.tables.get(table, {}).values())
+
+    def clear(self, table):
+        with self.lock:
+            self.tables.pop(table, None)
+
+
+def create_writer(db, **kwargs):
+    """KineticaWriter for a live connection, otherwise the local stand-in"""
+    if gpudb is None or db is None:
+        print("⚠ Kinetica client unavailable: using the in-memory writer")
+        return LocalKineticaWriter(batch_size=kwargs.get('batch_size', KINETICA_INGEST_BATCH_SIZE))
+    return KineticaWriter(db, **kwargs)
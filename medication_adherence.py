@@ -1,15 +1,19 @@
 import argparse
 import os
+import time
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 from collections import defaultdict, deque
 import numpy as np
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 import psycopg2
 import uuid
 import pandas as pd
 from dotenv import load_dotenv
 from db_config import DBConfig
+from kinetica_writer import create_writer, KineticaIngestError
 
 # Kinetica library
 try:
@@ -27,6 +31,15 @@ except ImportError:
 
 load_dotenv()
 
+# Rows fetched per round trip when streaming adherence data
+STREAM_CHUNK_SIZE = int(os.getenv('COMPLIANCE_STREAM_CHUNK_SIZE', '50000'))
+# Incremental mode: re-read rows changed this many seconds before the stored watermark,
+# so transactions that committed late are not missed (repeats upsert the same alert ids)
+INCREMENTAL_OVERLAP_SECONDS = int(os.getenv('COMPLIANCE_INCREMENTAL_OVERLAP_SECONDS', '300'))
+INCREMENTAL_JOB_NAME = 'patient_compliance_alerts'
+# Stable alert ids for incremental runs: one alert per adherence record
+ALERT_ID_NAMESPACE = uuid.UUID('6f0c7a3e-5d2b-4c1e-9a8f-3b7d2e1c4a90')
+
 # --- Sliding Window ---
 class SlidingWindowComplianceTracker:
     """
@@ -64,6 +77,22 @@ class SlidingWindowComplianceTracker:
         
         return len(window) >= self.violation_threshold, len(window)
 
+# Parallel mode: processes that each analyze one hash shard of the patients
+COMPLIANCE_WORKERS = int(os.getenv('COMPLIANCE_WORKERS', '1'))
+# Non-negative patient hash; every row of a patient lands in the same shard
+PATIENT_SHARD_SQL = "(hashtext({column}::text) & 2147483647)"
+
+# Compact loader: columns stored as int32 codes plus a lookup table, and as categoricals
+CODED_COLUMNS = ['PatientId', 'PrescribedMedicationId']
+CATEGORY_COLUMNS = ['MedicationNameSnapshot', 'CurrentStatus']
+
+# Fields of one compliance alert, in upsert order
+ALERT_COLUMNS = [
+    'patient_id', 'prescribed_medication_id', 'medication_name', 'alert_type',
+    'violation_count', 'severity', 'window_start', 'window_end',
+    'last_violation_date', 'updated_at'
+]
+
 # --- Medication Compliance Analyzer ---
 class MedicationComplianceAnalyzer:
     def __init__(self):
@@ -85,15 +114,19 @@ class MedicationComplianceAnalyzer:
         self.underdose_threshold = 0.7
         self.missed_threshold_ratio = 0.01
         
-    def load_medication_data(self, lookback_days: int = 120) -> pd.DataFrame:
-        """
-        Load medication adherence data with optimized query
-        """
-        query = f"""
+    def _medication_data_query(self, lookback_days: int, shard: Tuple[int, int] = None) -> str:
+        # Rows come grouped by (patient, medication), which streaming relies on.
+        # shard = (index, count) keeps only the patients hashed to that shard.
+        shard_filter = ""
+        if shard is not None and shard[1] > 1:
+            patient_hash = PATIENT_SHARD_SQL.format(column='pr."PatientId"')
+            shard_filter = f"AND {patient_hash} % {int(shard[1])} = {int(shard[0])}"
+        return f"""
         SELECT 
             pr."PatientId",
             pm."PrescribedMedicationId",
             pm."MedicationNameSnapshot",
+            mar."MedicationAdherenceRecordId",
             CAST(pm."DosePerTime" AS NUMERIC) AS "DosePerTime",
             pm."TimesPerDay",
             mar."DoseQuantity",
@@ -112,9 +145,25 @@ class MedicationComplianceAnalyzer:
             AND mar."CurrentStatus" IN ('Taken', 'Missed')
             AND pr."Status" = 'active'
             AND pm."Status" = 'active'
+            {shard_filter}
         ORDER BY 
-            pr."PatientId", pm."PrescribedMedicationId", mar."ScheduledTime";
+            pr."PatientId", pm."PrescribedMedicationId", mar."ScheduledTime", mar."MedicationAdherenceRecordId";
         """
+
+    @staticmethod
+    def _prepare_medication_frame(df: pd.DataFrame) -> pd.DataFrame:
+        if not df.empty:
+            # pd.read_sql already returns TIMESTAMPTZ as UTC, so the baseline buckets UTC days;
+            # utc=True keeps rows built from cursor records (session TimeZone offsets) on the same days
+            df['ScheduledTime'] = pd.to_datetime(df['ScheduledTime'], utc=True)
+            df['ScheduledDate'] = df['ScheduledTime'].dt.date
+        return df
+
+    def load_medication_data(self, lookback_days: int = 120, shard: Tuple[int, int] = None) -> pd.DataFrame:
+        """
+        Load medication adherence data with optimized query
+        """
+        query = self._medication_data_query(lookback_days, shard)
         
         # Suppress pandas warning about psycopg2 connection
         import warnings
@@ -122,11 +171,143 @@ class MedicationComplianceAnalyzer:
             warnings.simplefilter("ignore")
             df = pd.read_sql(query, self.conn)
         
-        if not df.empty:
-            df['ScheduledTime'] = pd.to_datetime(df['ScheduledTime'])
-            df['ScheduledDate'] = df['ScheduledTime'].dt.date
-            
-        return df
+        return self._prepare_medication_frame(df)
+
+    def iter_medication_data(self, lookback_days: int = 120, chunk_size: int = STREAM_CHUNK_SIZE,
+                             shard: Tuple[int, int] = None):
+        """
+        Stream the same rows as load_medication_data through a server-side cursor.
+        Each yielded DataFrame holds only complete (patient, medication) groups: the
+        last group of a chunk may continue in the next one, so it is carried over.
+        Memory is bounded by chunk_size plus the largest single group.
+        """
+        for chunk in self._iter_medication_records(lookback_days, chunk_size, shard):
+            yield self._prepare_medication_frame(chunk)
+
+    def _iter_medication_records(self, lookback_days: int, chunk_size: int, shard: Tuple[int, int] = None):
+        """Raw group-complete chunks for iter_medication_data (no ScheduledDate yet)"""
+        with self.conn.cursor(name='medication_data_stream') as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(self._medication_data_query(lookback_days, shard))
+            columns = None
+            carry = []
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                if columns is None:
+                    columns = [col.name for col in cursor.description]
+                rows = carry + rows
+
+                # PatientId and PrescribedMedicationId are the first two columns
+                last_group = rows[-1][:2]
+                split = len(rows)
+                while split > 0 and rows[split - 1][:2] == last_group:
+                    split -= 1
+                carry = rows[split:]
+                if split:
+                    yield pd.DataFrame.from_records(rows[:split], columns=columns, coerce_float=True)
+
+            if carry:
+                yield pd.DataFrame.from_records(carry, columns=columns, coerce_float=True)
+        # The named cursor lives in a transaction; end it so the snapshot is released
+        self.conn.rollback()
+
+    @staticmethod
+    def _code_values(values, mapping: Dict[Any, int]) -> np.ndarray:
+        """int32 codes for values, extending mapping (value -> code) with unseen ones; nulls get -1"""
+        local_codes, uniques = pd.factorize(values)
+        known = np.fromiter((mapping.setdefault(u, len(mapping)) for u in uniques),
+                            dtype=np.int32, count=len(uniques))
+        codes = known[local_codes] if len(known) else np.full(len(local_codes), -1, dtype=np.int32)
+        codes[local_codes < 0] = -1
+        return codes
+
+    def load_medication_data_compact(self, lookback_days: int = 120, chunk_size: int = STREAM_CHUNK_SIZE,
+                                     shard: Tuple[int, int] = None):
+        """
+        Same rows as load_medication_data in a compact typed frame:
+        int32-coded PatientId / PrescribedMedicationId, categorical status and
+        medication name, float32 doses and datetime64 ScheduledDate.
+        Rows are read in chunks, so the object-heavy frame never exists in full.
+        Returns (frame, lookups) where lookups maps each coded column to an Index
+        of the original ids (code -> id); see decode_alerts.
+        Doses lose NUMERIC exactness: ratios landing exactly on a threshold may
+        classify differently from the default loader.
+        """
+        mappings = {col: {} for col in CODED_COLUMNS + CATEGORY_COLUMNS}
+        parts = []
+        for chunk in self._iter_medication_records(lookback_days, chunk_size, shard):
+            scheduled = pd.to_datetime(chunk['ScheduledTime'], utc=True)
+            part = {col: self._code_values(chunk[col].astype(str), mappings[col]) for col in CODED_COLUMNS}
+            part.update({col: self._code_values(chunk[col], mappings[col]) for col in CATEGORY_COLUMNS})
+            part.update({
+                'DosePerTime': pd.to_numeric(chunk['DosePerTime'], errors='coerce').to_numpy(np.float32),
+                'TimesPerDay': pd.to_numeric(chunk['TimesPerDay'], errors='coerce').fillna(0).to_numpy(np.int16),
+                'DoseQuantity': pd.to_numeric(chunk['DoseQuantity'], errors='coerce').to_numpy(np.float32),
+                'ScheduledTime': scheduled.array,
+                'ScheduledDate': scheduled.dt.tz_localize(None).dt.normalize().to_numpy(),
+            })
+            parts.append(pd.DataFrame(part))
+
+        lookups = {col: pd.Index(list(mappings[col])) for col in CODED_COLUMNS}
+        if not parts:
+            return pd.DataFrame(), lookups
+
+        df = pd.concat(parts, ignore_index=True)
+        for col in CATEGORY_COLUMNS:
+            df[col] = pd.Categorical.from_codes(df[col].to_numpy(), categories=list(mappings[col]))
+        return df, lookups
+
+    @staticmethod
+    def decode_alerts(alerts: pd.DataFrame, lookups: Dict[str, pd.Index]) -> pd.DataFrame:
+        """Swap the integer ids of alerts computed on a compact frame back to UUID strings"""
+        if alerts.empty:
+            return alerts
+        alerts = alerts.copy()
+        alerts['patient_id'] = lookups['PatientId'].take(alerts['patient_id'].to_numpy(np.int64)).to_numpy()
+        alerts['prescribed_medication_id'] = lookups['PrescribedMedicationId'].take(
+            alerts['prescribed_medication_id'].to_numpy(np.int64)).to_numpy()
+        return alerts
+
+    def compare_loaders(self, lookback_days: int = 120, chunk_size: int = STREAM_CHUNK_SIZE) -> pd.DataFrame:
+        """Memory and timings of the default and compact loaders through detection and windowing"""
+        results = []
+        for name in ('default', 'compact'):
+            started = time.perf_counter()
+            if name == 'compact':
+                df, lookups = self.load_medication_data_compact(lookback_days, chunk_size)
+            else:
+                df = self.load_medication_data(lookback_days)
+            loaded = time.perf_counter()
+            violations = self.detect_violations(df)
+            detected = time.perf_counter()
+            alerts = self.apply_sliding_window_vectorized(violations) if not violations.empty else pd.DataFrame()
+            if name == 'compact':
+                alerts = self.decode_alerts(alerts, lookups)
+            windowed = time.perf_counter()
+            results.append({
+                'loader': name,
+                'rows': len(df),
+                'memory_mb': df.memory_usage(deep=True).sum() / 1e6,
+                'load_s': loaded - started,
+                'detect_s': detected - loaded,
+                'window_s': windowed - detected,
+                'alerts': len(alerts),
+            })
+        return pd.DataFrame(results).set_index('loader')
+
+    def stream_alerts(self, lookback_days: int = 120, chunk_size: int = STREAM_CHUNK_SIZE):
+        """
+        Yield (rows read, violations, alerts DataFrame) per chunk of complete groups.
+        The alerts match the batch engines; they are ordered by date within a chunk.
+        """
+        for chunk in self.iter_medication_data(lookback_days, chunk_size):
+            violations = self.detect_violations(chunk)
+            if violations.empty:
+                yield len(chunk), 0, pd.DataFrame(columns=ALERT_COLUMNS)
+                continue
+            yield len(chunk), len(violations), self.apply_sliding_window_vectorized(violations)
     
     def detect_violations(self, df: pd.DataFrame) -> pd.DataFrame:
         """
@@ -178,8 +359,8 @@ class MedicationComplianceAnalyzer:
         alerts = []
         current_date = datetime.now().date()
         
-        # Sort by date for proper window processing
-        violations_df = violations_df.sort_values('ScheduledDate')
+        # Sort by date for proper window processing (stable, so same-day rows keep load order)
+        violations_df = violations_df.sort_values('ScheduledDate', kind='mergesort')
         
         for _, row in violations_df.iterrows():
             patient_id = row['PatientId']
@@ -209,13 +390,467 @@ class MedicationComplianceAnalyzer:
                 })
         
         return alerts
-    
+
+    @staticmethod
+    def _violation_days(violations_df: pd.DataFrame) -> np.ndarray:
+        """UTC calendar day number of each violation (the loaders' ScheduledDate)"""
+        utc_time = pd.to_datetime(violations_df['ScheduledTime'], utc=True).dt.tz_localize(None)
+        return utc_time.to_numpy().astype('datetime64[D]').astype(np.int64)
+
+    def rolling_violation_counts(self, violations_df: pd.DataFrame) -> np.ndarray:
+        """
+        Violations in each row's window (aligned with violations_df), counting
+        same-day rows of a (patient, medication) in frame order.
+        Rows are ordered by (patient, medication, day) into one int64 key per row;
+        searchsorted on key - window_days finds where each row's window starts, so the
+        count is position - window start + 1 with no per-row Python work.
+        """
+        if violations_df.empty:
+            return np.empty(0, dtype=np.int64)
+
+        group = violations_df.groupby(['PatientId', 'PrescribedMedicationId'], sort=False).ngroup().to_numpy(np.int64)
+        day = self._violation_days(violations_df)
+        day = day - day.min()
+
+        # Groups are spaced so that key - window_days never reaches the previous group
+        span = int(day.max()) + self.window_size_days + 1
+        key = group * span + day
+        order = np.argsort(key, kind='stable')
+        sorted_key = key[order]
+        window_start = np.searchsorted(sorted_key, sorted_key - self.window_size_days, side='left')
+
+        counts = np.empty(len(key), dtype=np.int64)
+        counts[order] = np.arange(len(sorted_key)) - window_start + 1
+        return counts
+
+    def apply_sliding_window_vectorized(self, violations_df: pd.DataFrame) -> pd.DataFrame:
+        """Same alerts as apply_sliding_window_optimized, computed with NumPy"""
+        counts = self.rolling_violation_counts(violations_df)
+        return self._breaching_alerts(violations_df, counts, np.ones(len(counts), dtype=bool))
+
+    def _breaching_rows(self, violations_df: pd.DataFrame, counts: np.ndarray, eligible: np.ndarray) -> np.ndarray:
+        """Positions of eligible rows at or over the threshold, in the date order the iterative engine visits them"""
+        rows = np.flatnonzero(eligible & (counts >= self.violation_threshold))
+        return rows[np.argsort(self._violation_days(violations_df)[rows], kind='stable')]
+
+    def _breaching_alerts(self, violations_df: pd.DataFrame, counts: np.ndarray, eligible: np.ndarray) -> pd.DataFrame:
+        rows = self._breaching_rows(violations_df, counts, eligible)
+        if not len(rows):
+            return pd.DataFrame(columns=ALERT_COLUMNS)
+        hits = violations_df.iloc[rows].rename(columns={'violation_type': 'AlertType'})
+        return self._alerts_frame(hits, counts[rows])
+
+    def _alerts_frame(self, hits: pd.DataFrame, counts) -> pd.DataFrame:
+        """Alert rows (same fields as the iterative engine) from breaching violations and their counts"""
+        counts = np.asarray(counts, dtype=np.int64)
+        scheduled = pd.to_datetime(hits['ScheduledTime'], utc=True).reset_index(drop=True)
+        return pd.DataFrame({
+            'patient_id': hits['PatientId'].to_numpy(),
+            'prescribed_medication_id': hits['PrescribedMedicationId'].to_numpy(),
+            'medication_name': hits['MedicationNameSnapshot'].to_numpy(),
+            'alert_type': hits['AlertType'].to_numpy(),
+            'violation_count': counts,
+            'severity': np.where(counts >= 10, 'HIGH', 'MEDIUM'),
+            'window_start': (scheduled - pd.Timedelta(days=self.window_size_days)).dt.date.to_numpy(),
+            'window_end': scheduled.dt.date.to_numpy(),
+            'last_violation_date': scheduled,
+            'updated_at': datetime.now()
+        }, columns=ALERT_COLUMNS)
+
+    def detect_alerts_sql(self, lookback_days: int = 120) -> pd.DataFrame:
+        """
+        Classification and the rolling window run inside Postgres; only breaching
+        rows are returned. The count matches the iterative tracker: violations in
+        the previous window_days days plus the same-day violations up to this one.
+        """
+        query = f"""
+        WITH violation AS (
+            SELECT
+                pr."PatientId",
+                pm."PrescribedMedicationId",
+                pm."MedicationNameSnapshot",
+                mar."MedicationAdherenceRecordId",
+                mar."ScheduledTime",
+                -- UTC days, as the pandas engines bucket them (not the session TimeZone)
+                (mar."ScheduledTime" AT TIME ZONE 'UTC')::date AS "ScheduledDate",
+                CASE
+                    WHEN mar."CurrentStatus" = 'Missed' OR mar."DoseQuantity" <= 0 THEN 'missed'
+                    WHEN d."DeviationRatio" >= %(overdose)s::float8 THEN 'overdose'
+                    WHEN d."DeviationRatio" < %(underdose)s::float8 AND d."DeviationRatio" > 0 THEN 'underdose'
+                END AS "AlertType"
+            FROM "{self.db_schema}"."MedicationAdherenceRecord" mar
+            JOIN "{self.db_schema}"."PrescribedMedicationSchedule" pms
+                ON mar."PrescribedMedicationScheduleId" = pms."PrescribedMedicationScheduleId"
+            JOIN "{self.db_schema}"."PrescribedMedication" pm
+                ON pms."PrescribedMedicationId" = pm."PrescribedMedicationId"
+            JOIN "{self.db_schema}"."Prescription" pr
+                ON pm."PrescriptionId" = pr."PrescriptionId"
+            CROSS JOIN LATERAL (
+                -- float8 like the pandas engines, so ratios on a threshold classify the same way
+                SELECT CASE WHEN pm."DosePerTime" > 0
+                            THEN mar."DoseQuantity"::float8 / pm."DosePerTime"::float8
+                            ELSE 0 END AS "DeviationRatio"
+            ) d
+            WHERE
+                mar."ScheduledTime" >= NOW() - make_interval(days => %(lookback)s)
+                AND mar."CurrentStatus" IN ('Taken', 'Missed')
+                AND pr."Status" = 'active'
+                AND pm."Status" = 'active'
+        ),
+        counted AS (
+            SELECT
+                v.*,
+                COUNT(*) OVER (
+                    PARTITION BY "PatientId", "PrescribedMedicationId"
+                    ORDER BY "ScheduledDate"
+                    RANGE BETWEEN make_interval(days => %(window)s) PRECEDING AND CURRENT ROW
+                )
+                -- drop same-day peers that come after this row
+                - COUNT(*) OVER (PARTITION BY "PatientId", "PrescribedMedicationId", "ScheduledDate")
+                + ROW_NUMBER() OVER (
+                    PARTITION BY "PatientId", "PrescribedMedicationId", "ScheduledDate"
+                    ORDER BY "ScheduledTime", "MedicationAdherenceRecordId"
+                ) AS "ViolationCount"
+            FROM violation v
+            WHERE "AlertType" IS NOT NULL
+        )
+        SELECT
+            "PatientId",
+            "PrescribedMedicationId",
+            "MedicationNameSnapshot",
+            "AlertType",
+            "ViolationCount",
+            "ScheduledTime"
+        FROM counted
+        WHERE "ViolationCount" >= %(threshold)s
+        ORDER BY "ScheduledDate", "PatientId", "PrescribedMedicationId", "ScheduledTime", "MedicationAdherenceRecordId";
+        """
+        params = {
+            'overdose': self.overdose_threshold,
+            'underdose': self.underdose_threshold,
+            'lookback': lookback_days,
+            'window': self.window_size_days,
+            'threshold': self.violation_threshold,
+        }
+
+        import warnings
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            hits = pd.read_sql(query, self.conn, params=params)
+
+        if hits.empty:
+            return pd.DataFrame(columns=ALERT_COLUMNS)
+        return self._alerts_frame(hits, hits['ViolationCount'])
+
+    # --- Incremental mode ---
+    def _load_watermark(self, job_name: str):
+        self.cursor.execute(f"""
+            SELECT "HighWaterMark"
+            FROM "{self.db_schema}"."ComplianceJobWatermark"
+            WHERE "JobName" = %s
+        """, (job_name,))
+        row = self.cursor.fetchone()
+        return row['HighWaterMark'] if row else None
+
+    def _save_watermark(self, job_name: str, high_water_mark: datetime):
+        self.cursor.execute(f"""
+            INSERT INTO "{self.db_schema}"."ComplianceJobWatermark" ("JobName", "HighWaterMark")
+            VALUES (%s, %s)
+            ON CONFLICT ("JobName") DO UPDATE
+            SET "HighWaterMark" = EXCLUDED."HighWaterMark",
+                "UpdatedAt" = NOW()
+        """, (job_name, high_water_mark))
+
+    def _changed_groups(self, since: Optional[datetime], lookback_days: int) -> Dict[tuple, tuple]:
+        """
+        (patient, medication) -> (earliest ScheduledTime, latest change time) among rows
+        changed after since and after the group's stored LastChangedAt, so rows re-read
+        through the watermark overlap do not count as changes again.
+        since=None returns every group in the lookback.
+        """
+        self.cursor.execute(f"""
+            SELECT
+                pr."PatientId",
+                pm."PrescribedMedicationId",
+                MIN(mar."ScheduledTime") AS "FirstChanged",
+                MAX(GREATEST(mar."UpdatedAt", mar."CreatedAt")) AS "LastChanged"
+            FROM "{self.db_schema}"."MedicationAdherenceRecord" mar
+            JOIN "{self.db_schema}"."PrescribedMedicationSchedule" pms
+                ON mar."PrescribedMedicationScheduleId" = pms."PrescribedMedicationScheduleId"
+            JOIN "{self.db_schema}"."PrescribedMedication" pm
+                ON pms."PrescribedMedicationId" = pm."PrescribedMedicationId"
+            JOIN "{self.db_schema}"."Prescription" pr
+                ON pm."PrescriptionId" = pr."PrescriptionId"
+            LEFT JOIN "{self.db_schema}"."ComplianceWindowState" s
+                ON s."PatientId" = pr."PatientId"
+                AND s."PrescribedMedicationId" = pm."PrescribedMedicationId"
+            WHERE
+                (%(since)s::timestamptz IS NULL OR (
+                    GREATEST(mar."UpdatedAt", mar."CreatedAt") > %(since)s
+                    AND (s."LastChangedAt" IS NULL OR GREATEST(mar."UpdatedAt", mar."CreatedAt") > s."LastChangedAt")
+                ))
+                AND mar."ScheduledTime" >= NOW() - make_interval(days => %(lookback)s)
+                AND mar."CurrentStatus" IN ('Taken', 'Missed')
+                AND pr."Status" = 'active'
+                AND pm."Status" = 'active'
+            GROUP BY pr."PatientId", pm."PrescribedMedicationId"
+        """, {'since': since, 'lookback': lookback_days})
+        return {
+            (str(row['PatientId']), str(row['PrescribedMedicationId'])): (row['FirstChanged'], row['LastChanged'])
+            for row in self.cursor.fetchall()
+        }
+
+    def _load_window_states(self, groups) -> Dict[tuple, Dict[str, Any]]:
+        if not groups:
+            return {}
+        self.cursor.execute(f"""
+            SELECT s."PatientId", s."PrescribedMedicationId", s."RecentViolations", s."LastScheduledTime"
+            FROM "{self.db_schema}"."ComplianceWindowState" s
+            JOIN unnest(%s::uuid[], %s::uuid[]) AS g(patient_id, medication_id)
+                ON s."PatientId" = g.patient_id AND s."PrescribedMedicationId" = g.medication_id
+        """, ([g[0] for g in groups], [g[1] for g in groups]))
+        return {
+            (str(row['PatientId']), str(row['PrescribedMedicationId'])): row
+            for row in self.cursor.fetchall()
+        }
+
+    def _load_group_rows(self, cutoffs: Dict[tuple, datetime]) -> pd.DataFrame:
+        """Taken/Missed rows of the given groups scheduled after each group's cutoff"""
+        query = f"""
+        SELECT 
+            pr."PatientId",
+            pm."PrescribedMedicationId",
+            pm."MedicationNameSnapshot",
+            mar."MedicationAdherenceRecordId",
+            CAST(pm."DosePerTime" AS NUMERIC) AS "DosePerTime",
+            pm."TimesPerDay",
+            mar."DoseQuantity",
+            mar."ScheduledTime",
+            mar."CurrentStatus",
+            mar."ActionTime"
+        FROM unnest(%(patients)s::uuid[], %(medications)s::uuid[], %(cutoffs)s::timestamptz[])
+            AS g(patient_id, medication_id, cutoff)
+        JOIN "{self.db_schema}"."PrescribedMedication" pm
+            ON pm."PrescribedMedicationId" = g.medication_id
+        JOIN "{self.db_schema}"."Prescription" pr
+            ON pm."PrescriptionId" = pr."PrescriptionId"
+            AND pr."PatientId" = g.patient_id
+        JOIN "{self.db_schema}"."PrescribedMedicationSchedule" pms
+            ON pms."PrescribedMedicationId" = pm."PrescribedMedicationId"
+        JOIN "{self.db_schema}"."MedicationAdherenceRecord" mar
+            ON mar."PrescribedMedicationScheduleId" = pms."PrescribedMedicationScheduleId"
+        WHERE 
+            mar."ScheduledTime" > g.cutoff
+            AND mar."CurrentStatus" IN ('Taken', 'Missed')
+            AND pr."Status" = 'active'
+            AND pm."Status" = 'active'
+        ORDER BY 
+            pr."PatientId", pm."PrescribedMedicationId", mar."ScheduledTime", mar."MedicationAdherenceRecordId";
+        """
+        params = {
+            'patients': [g[0] for g in cutoffs],
+            'medications': [g[1] for g in cutoffs],
+            'cutoffs': list(cutoffs.values()),
+        }
+        import warnings
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            df = pd.read_sql(query, self.conn, params=params)
+
+        if not df.empty:
+            df['PatientId'] = df['PatientId'].astype(str)
+            df['PrescribedMedicationId'] = df['PrescribedMedicationId'].astype(str)
+            df['ScheduledTime'] = pd.to_datetime(df['ScheduledTime'], utc=True)
+            df['ScheduledDate'] = df['ScheduledTime'].dt.date
+        return df
+
+    def _save_window_states(self, states: List[tuple]):
+        if not states:
+            return
+        execute_values(self.cursor, f"""
+            INSERT INTO "{self.db_schema}"."ComplianceWindowState"
+                ("PatientId", "PrescribedMedicationId", "RecentViolations", "LastScheduledTime", "LastChangedAt")
+            VALUES %s
+            ON CONFLICT ("PatientId", "PrescribedMedicationId") DO UPDATE
+            SET "RecentViolations" = EXCLUDED."RecentViolations",
+                "LastScheduledTime" = EXCLUDED."LastScheduledTime",
+                "LastChangedAt" = GREATEST(
+                    "{self.db_schema}"."ComplianceWindowState"."LastChangedAt", EXCLUDED."LastChangedAt"
+                ),
+                "UpdatedAt" = NOW()
+        """, states, template="(%s::uuid, %s::uuid, %s::timestamptz[], %s, %s::timestamptz)", page_size=1000)
+
+    def run_incremental(self, lookback_days: int = 120, overlap_seconds: int = INCREMENTAL_OVERLAP_SECONDS,
+                        job_name: str = INCREMENTAL_JOB_NAME) -> pd.DataFrame:
+        """
+        Alerts for adherence rows changed since the last run.
+        Only (patient, medication) groups with changed rows are touched. When every
+        change is newer than anything seen for the group, the new rows are counted on
+        top of the stored trailing-window violations (ComplianceWindowState); a
+        back-dated change reloads that group's lookback instead. Each group stores the
+        latest change time it has processed, so rows re-read through the watermark
+        overlap are not mistaken for back-dated changes. Alerts carry a deterministic
+        alert_id per adherence record, so repeats upsert.
+        """
+        self.cursor.execute("SELECT NOW() AS now")
+        run_started = self.cursor.fetchone()['now']
+        watermark = self._load_watermark(job_name)
+        lookback_start = run_started - timedelta(days=lookback_days)
+
+        if watermark is None:
+            print("No watermark yet: processing the full lookback")
+            changed = None
+            last_changed = {group: last for group, (_, last) in self._changed_groups(None, lookback_days).items()}
+        else:
+            changed = self._changed_groups(watermark - timedelta(seconds=overlap_seconds), lookback_days)
+            print(f"Changed since {watermark}: {len(changed)} patient/medication group(s)")
+            if not changed:
+                self._save_watermark(job_name, run_started)
+                self.conn.commit()
+                return pd.DataFrame(columns=ALERT_COLUMNS + ['alert_id'])
+            last_changed = {group: last for group, (_, last) in changed.items()}
+
+        if changed is None:
+            rows = self.load_medication_data(lookback_days)
+            if not rows.empty:
+                rows['PatientId'] = rows['PatientId'].astype(str)
+                rows['PrescribedMedicationId'] = rows['PrescribedMedicationId'].astype(str)
+            states = {}
+            emit_from = {}
+        else:
+            states = self._load_window_states(list(changed))
+            cutoffs = {}
+            emit_from = {}
+            for group, (first_changed, _) in changed.items():
+                state = states.get(group)
+                if state is not None and first_changed > state['LastScheduledTime']:
+                    # Pure append: only rows after what this group has already seen
+                    cutoffs[group] = state['LastScheduledTime']
+                else:
+                    # Back-dated or first-seen change: recount the group's lookback
+                    states.pop(group, None)
+                    cutoffs[group] = lookback_start
+                    emit_from[group] = first_changed
+            rows = self._load_group_rows(cutoffs)
+
+        violations = self.detect_violations(rows).copy() if not rows.empty else pd.DataFrame()
+        if not violations.empty:
+            violations['IsContext'] = False
+
+        # Stored trailing violations go in front of the appended rows as counting context
+        context = [
+            (group[0], group[1], ts)
+            for group, state in states.items()
+            for ts in (state['RecentViolations'] or [])
+        ]
+        if context:
+            context_df = pd.DataFrame(context, columns=['PatientId', 'PrescribedMedicationId', 'ScheduledTime'])
+            context_df['ScheduledTime'] = pd.to_datetime(context_df['ScheduledTime'], utc=True)
+            context_df['IsContext'] = True
+            violations = pd.concat([context_df, violations], ignore_index=True)
+            violations = violations.sort_values(['PatientId', 'PrescribedMedicationId', 'ScheduledTime'], kind='mergesort')
+            violations = violations.reset_index(drop=True)
+
+        alerts = pd.DataFrame(columns=ALERT_COLUMNS + ['alert_id'])
+        if not violations.empty:
+            counts = self.rolling_violation_counts(violations)
+            eligible = ~violations['IsContext'].to_numpy(bool)
+            if emit_from:
+                # Reloaded groups only report rows at or after their earliest change
+                first = pd.to_datetime(pd.Series([
+                    emit_from.get((p, m)) for p, m in zip(violations['PatientId'], violations['PrescribedMedicationId'])
+                ], index=violations.index, dtype=object), utc=True)
+                reloaded = first.notna().to_numpy()
+                later = (pd.to_datetime(violations['ScheduledTime'], utc=True) >= first).to_numpy()
+                eligible &= ~reloaded | later
+            breach = self._breaching_rows(violations, counts, eligible)
+            if len(breach):
+                hits = violations.iloc[breach].rename(columns={'violation_type': 'AlertType'})
+                alerts = self._alerts_frame(hits, counts[breach])
+                alerts['alert_id'] = [
+                    str(uuid.uuid5(ALERT_ID_NAMESPACE, f"{p}|{m}|{r}"))
+                    for p, m, r in zip(hits['PatientId'], hits['PrescribedMedicationId'], hits['MedicationAdherenceRecordId'])
+                ]
+
+        self._save_window_states(self._window_states(rows, violations, last_changed))
+        self._save_watermark(job_name, run_started)
+        self.conn.commit()
+        return alerts
+
+    def _window_states(self, rows: pd.DataFrame, violations: pd.DataFrame,
+                       last_changed: Dict[tuple, datetime]) -> List[tuple]:
+        """
+        (patient, medication, violations still inside the window, last ScheduledTime seen,
+        latest change time processed) per group
+        """
+        if rows.empty:
+            return []
+        last_seen = rows.groupby(['PatientId', 'PrescribedMedicationId'])['ScheduledTime'].max()
+        recent = {}
+        if not violations.empty:
+            days = self._violation_days(violations)
+            frame = violations[['PatientId', 'PrescribedMedicationId', 'ScheduledTime']].assign(Day=days)
+            frame = frame[frame['Day'] >= frame.groupby(['PatientId', 'PrescribedMedicationId'])['Day'].transform('max') - self.window_size_days]
+            recent = frame.groupby(['PatientId', 'PrescribedMedicationId'])['ScheduledTime'].apply(
+                lambda ts: [t.to_pydatetime() for t in ts]
+            ).to_dict()
+        return [
+            (patient_id, medication_id, recent.get((patient_id, medication_id), []), last.to_pydatetime(),
+             last_changed.get((patient_id, medication_id)))
+            for (patient_id, medication_id), last in last_seen.items()
+        ]
+
     def close(self):
         """Close database connection"""
         if self.conn:
             self.cursor.close()
             self.conn.close()
 
+# --- Parallel Analysis ---
+def _analyze_shard(shard: Tuple[int, int], lookback_days: int, compact: bool):
+    """Worker: load one patient shard on its own connection, then detect and window it"""
+    started = time.perf_counter()
+    analyzer = MedicationComplianceAnalyzer()
+    try:
+        if compact:
+            rows, lookups = analyzer.load_medication_data_compact(lookback_days, shard=shard)
+        else:
+            rows = analyzer.load_medication_data(lookback_days, shard=shard)
+        violations = analyzer.detect_violations(rows)
+        if violations.empty:
+            alerts = pd.DataFrame(columns=ALERT_COLUMNS)
+        else:
+            alerts = analyzer.apply_sliding_window_vectorized(violations)
+            if compact:
+                alerts = analyzer.decode_alerts(alerts, lookups)
+        return alerts, len(rows), len(violations), time.perf_counter() - started
+    finally:
+        analyzer.close()
+
+
+def analyze_parallel(workers: int = COMPLIANCE_WORKERS, lookback_days: int = 120, compact: bool = False):
+    """
+    Shard patients by hash across a process pool and merge the alerts.
+    Windows never span patients, so every shard is independent and the merged
+    alerts (re-sorted into date order) equal a single-process vectorized run.
+    Returns (alerts DataFrame, rows loaded, violations detected).
+    """
+    workers = max(1, workers)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(_analyze_shard, (index, workers), lookback_days, compact) for index in range(workers)]
+        results = [future.result() for future in futures]
+
+    for index, (alerts, rows, violations, elapsed) in enumerate(results):
+        print(f"✓ Shard {index + 1}/{workers}: {rows} rows, {violations} violations, {len(alerts)} alerts in {elapsed:.1f}s")
+
+    parts = [alerts for alerts, _, _, _ in results if not alerts.empty]
+    if not parts:
+        return pd.DataFrame(columns=ALERT_COLUMNS), sum(r[1] for r in results), sum(r[2] for r in results)
+    alerts = pd.concat(parts, ignore_index=True)
+    alerts = alerts.sort_values(['window_end', 'patient_id', 'prescribed_medication_id'], kind='mergesort', ignore_index=True)
+    return alerts, sum(r[1] for r in results), sum(r[2] for r in results)
+
+
 # --- Kinetica Manager ---
 class KineticaManager:
     def __init__(self):
@@ -238,6 +873,7 @@ class KineticaManager:
             'SCHEMA': os.getenv('KINETICA_SCHEMA', '').strip()
         })()
         self.db = self._connect()
+        self.writer = create_writer(self.db)
         
     def _connect(self):
         """Connect to Kinetica"""
@@ -335,60 +971,29 @@ class KineticaManager:
         schema = self.config.SCHEMA
         table_name = f"{schema}.patient_compliance_alerts"
 
-        # Process in smaller batches to avoid timeouts
-        batch_size = 100
-        total_inserted = 0
-        
-        print(f"Upserting {len(alerts)} alerts in batches of {batch_size}...")
-        
-        for batch_num, i in enumerate(range(0, len(alerts), batch_size), 1):
-            batch = alerts[i:i + batch_size]
-            
-            try:
-                columns = [
-                    'alert_id', 'patient_id', 'prescribed_medication_id', 'medication_name',
-                    'alert_type', 'violation_count', 'severity', 'window_start',
-                    'window_end', 'last_violation_date', 'updated_at'
-                ]
-                
-                values = []
-                for alert in batch:
-                    # Generate unique ID for each alert
-                    alert_id = str(uuid.uuid4())
-                    
-                    # Properly escape single quotes in medication names
-                    med_name = alert['medication_name'].replace("'", "''") if alert['medication_name'] else 'Unknown'
-                    
-                    values.append(f"""(
-                        '{alert_id}',
-                        '{alert['patient_id']}',
-                        '{alert['prescribed_medication_id']}',
-                        '{med_name}',
-                        '{alert['alert_type']}',
-                        {alert['violation_count']},
-                        '{alert['severity']}',
-                        '{alert['window_start']}',
-                        '{alert['window_end']}',
-                        '{alert['last_violation_date'].strftime('%Y-%m-%d %H:%M:%S')}',
-                        '{alert['updated_at'].strftime('%Y-%m-%d %H:%M:%S')}'
-                    )""")
-                
-                insert_sql = f"""
-                INSERT INTO {table_name} ({', '.join(columns)})
-                VALUES {', '.join(values)}
-                """
-
-                # Execute the insert for this batch
-                self.db.execute_sql(insert_sql)
-                total_inserted += len(batch)
-                
-            except Exception as e:
-                print(f"  ✗ Error inserting batch {batch_num}: {e}")
-        
+        records = [
+            {
+                **alert,
+                # Incremental runs supply a stable id; otherwise generate one per alert
+                'alert_id': alert.get('alert_id') or str(uuid.uuid4()),
+                'medication_name': alert['medication_name'] or 'Unknown',
+            }
+            for alert in alerts
+        ]
+
+        print(f"Upserting {len(alerts)} alerts in batches of {self.writer.batch_size}...")
+        try:
+            # Same alert_id again (incremental re-runs) replaces the earlier row
+            total_inserted = self.writer.insert(table_name, records, update_on_existing_pk=True)
+        except KineticaIngestError as e:
+            total_inserted = e.written
+
         print(f"✓ Total inserted: {total_inserted} alerts")
         return total_inserted
 
-def main(rebuild_kinetica: bool = False):
+def main(rebuild_kinetica: bool = False, engine: str = "vectorized", incremental: bool = False,
+         stream: bool = False, chunk_size: int = STREAM_CHUNK_SIZE, compact: bool = False,
+         compare_loaders: bool = False, workers: int = COMPLIANCE_WORKERS):
     """Orchestrates the entire ETL pipeline"""
     print("\n--- Medication Compliance Analysis ---")
     
@@ -397,18 +1002,62 @@ def main(rebuild_kinetica: bool = False):
     kinetica_manager = KineticaManager()
     
     try:
-        # Extract and transform data
-        raw_data = analyzer.load_medication_data()
-        
-        if raw_data.empty:
-            print("No medication adherence data found. Exiting.")
+        if compare_loaders:
+            print(analyzer.compare_loaders(chunk_size=chunk_size).to_string(float_format=lambda v: f"{v:.3f}"))
             return
-            
-        violations_df = analyzer.detect_violations(raw_data)
-        alerts = analyzer.apply_sliding_window_optimized(violations_df)
-        
-        print(f"Data Loaded: {len(raw_data)} raw records")
-        print(f"Violations Detected: {len(violations_df)} intake violations")
+        if stream:
+            # Bounded memory: alerts are written chunk by chunk as groups complete
+            total_rows = total_violations = total_alerts = 0
+            table_ready = False
+            for rows, violation_count, chunk_alerts in analyzer.stream_alerts(chunk_size=chunk_size):
+                total_rows += rows
+                total_violations += violation_count
+                if chunk_alerts.empty:
+                    continue
+                if not table_ready:
+                    kinetica_manager.ensure_compliance_table()
+                    table_ready = True
+                total_alerts += kinetica_manager.upsert_alerts(chunk_alerts.to_dict('records'))
+            print(f"Data Loaded: {total_rows} raw records (streamed in chunks of {chunk_size})")
+            print(f"Violations Detected: {total_violations} intake violations")
+            print(f"Inserted {total_alerts} alerts to Kinetica")
+            return
+        if incremental:
+            # Only groups with adherence rows changed since the stored watermark
+            alerts = analyzer.run_incremental().to_dict('records')
+        elif engine == "sql":
+            # Classification and window run in Postgres; only alerts are transferred
+            alerts = analyzer.detect_alerts_sql().to_dict('records')
+        elif workers > 1:
+            # Patients hashed across worker processes, each with its own connection
+            started = time.perf_counter()
+            alerts_df, row_count, violation_count = analyze_parallel(workers, compact=compact)
+            alerts = alerts_df.to_dict('records')
+            print(f"Data Loaded: {row_count} raw records across {workers} workers")
+            print(f"Violations Detected: {violation_count} intake violations")
+            print(f"Parallel analysis took {time.perf_counter() - started:.1f}s")
+        else:
+            # Extract and transform data
+            if compact:
+                raw_data, lookups = analyzer.load_medication_data_compact(chunk_size=chunk_size)
+            else:
+                raw_data = analyzer.load_medication_data()
+
+            if raw_data.empty:
+                print("No medication adherence data found. Exiting.")
+                return
+
+            violations_df = analyzer.detect_violations(raw_data)
+            if engine == "iterative":
+                alerts = pd.DataFrame(analyzer.apply_sliding_window_optimized(violations_df), columns=ALERT_COLUMNS)
+            else:
+                alerts = analyzer.apply_sliding_window_vectorized(violations_df)
+            if compact:
+                alerts = analyzer.decode_alerts(alerts, lookups)
+            alerts = alerts.to_dict('records')
+
+            print(f"Data Loaded: {len(raw_data)} raw records")
+            print(f"Violations Detected: {len(violations_df)} intake violations")
         print(f"Alerts Found: {len(alerts)} threshold breaches")
         
         # Load to Kinetica
@@ -432,5 +1081,23 @@ def main(rebuild_kinetica: bool = False):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Medication Compliance ETL Pipeline")
     parser.add_argument("--rebuild", action="store_true", help="Rebuild Kinetica tables")
+    parser.add_argument("--engine", choices=["vectorized", "iterative", "sql"], default="vectorized",
+                        help="Sliding window implementation ('iterative' is the original per-row tracker, "
+                             "'sql' computes alerts inside Postgres)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Process only adherence rows changed since the last incremental run")
+    parser.add_argument("--stream", action="store_true",
+                        help="Read adherence rows through a server-side cursor in chunks (bounded memory)")
+    parser.add_argument("--chunk-size", type=int, default=STREAM_CHUNK_SIZE,
+                        help=f"Rows per fetch in --stream mode (default: {STREAM_CHUNK_SIZE})")
+    parser.add_argument("--compact", action="store_true",
+                        help="Load adherence rows into the compact typed frame")
+    parser.add_argument("--compare-loaders", action="store_true",
+                        help="Report memory use and timings of the default and compact loaders, then exit")
+    parser.add_argument("--workers", type=int, default=COMPLIANCE_WORKERS,
+                        help="Analyze patient shards in this many processes (0 = one per core; "
+                             "uses the vectorized engine)")
     args = parser.parse_args()
-    main(rebuild_kinetica=args.rebuild)
\ No newline at end of file
+    main(rebuild_kinetica=args.rebuild, engine=args.engine, incremental=args.incremental,
+         stream=args.stream, chunk_size=args.chunk_size, compact=args.compact,
+         compare_loaders=args.compare_loaders, workers=args.workers or os.cpu_count() or 1)
\ No newline at end of file
@@ -0,0 +1,54 @@
+import threading
+import time
+
+
+class LazyModel:
+    """
+    Process-wide handle for a heavy model (medspacy, Whisper).
+    Nothing is imported or loaded until the first get(), so the listener can
+    LISTEN straight away; every thread then shares the single loaded instance.
+    """
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.model = None
+        self.load_seconds = None
+        self.lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self.model is not None
+
+    def get(self):
+        if self.model is None:
+            with self.lock:
+                if self.model is None:
+                    print(f"Loading {self.name}...")
+                    started = time.perf_counter()
+                    model = self.loader()
+                    self.load_seconds = time.perf_counter() - started
+                    self.model = model
+                    print(f"✓ {self.name} ready in {self.load_seconds:.2f}s")
+        return self.model
+
+    def preload_async(self):
+        """Warm the model on a background thread; errors are reported, not raised"""
+        def warm():
+            try:
+                self.get()
+            except Exception as e:
+                print(f"✗ Background preload of {self.name} failed: {e}")
+
+        thread = threading.Thread(target=warm, name=f"preload-{self.name}", daemon=True)
+        thread.start()
+        return thread
+
+
+def timed_import(module_name):
+    """Import a module and report how long the import took"""
+    import importlib
+
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    print(f"  import {module_name}: {time.perf_counter() - started:.2f}s")
+    return module
@@ -1,50 +1,619 @@
-import psycopg2
+import time
+
+PROCESS_STARTED = time.perf_counter()
+
+import argparse
+import json
+import os
+import queue
 import select
-from patient_report import Extract_keyword
+import threading
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+# Heavy NLP/Whisper imports are deferred until a model is first needed
+from patient_report import Extract_keyword, NLP_MODEL
 from transcribe import transcribe_audio
+from transcription_engine import get_engine
 from db_config import DBConfig
-import json
+from report_queue import ReportWorkQueue, KIND_AUDIO
+from report_retry import ReportRetryStore, RETRY_LEASE
+from report_cluster import ClusterMembership, CLUSTER_ENABLED
+from report_metrics import METRICS, start_metrics_server, start_metrics_logger
+
+IMPORT_SECONDS = time.perf_counter() - PROCESS_STARTED
+
+
+class ListenerConfig:
+    # Worker threads per channel (each worker owns its own DB connection)
+    KEYWORD_WORKERS = int(os.getenv('NOTIFY_KEYWORD_WORKERS', '2'))
+    AUDIO_WORKERS = int(os.getenv('NOTIFY_AUDIO_WORKERS', '1'))
+    # Max pending notifications per channel before the listener blocks
+    QUEUE_SIZE = int(os.getenv('NOTIFY_QUEUE_SIZE', '100'))
+    # A worker whose processor cannot start (e.g. database down) retries after this
+    # many seconds, doubling up to the max
+    WORKER_RESTART_DELAY = float(os.getenv('NOTIFY_WORKER_RESTART_DELAY', '5'))
+    WORKER_RESTART_MAX_DELAY = float(os.getenv('NOTIFY_WORKER_RESTART_MAX_DELAY', '300'))
+    POLL_TIMEOUT = float(os.getenv('NOTIFY_POLL_TIMEOUT', '5'))
+    # Keyword notifications arriving within this window (seconds) share one batch
+    BATCH_WINDOW = float(os.getenv('NOTIFY_BATCH_WINDOW', '0.25'))
+    MAX_BATCH = int(os.getenv('NOTIFY_MAX_BATCH', '64'))
+    # Re-scan PatientReport for missed work every N seconds (0 = only at startup)
+    CATCHUP_INTERVAL = float(os.getenv('NOTIFY_CATCHUP_INTERVAL', '0'))
+    CATCHUP_BATCH = int(os.getenv('NOTIFY_CATCHUP_BATCH', '500'))
+    # Seconds between checks for failed reports whose backoff has expired
+    RETRY_INTERVAL = float(os.getenv('NOTIFY_RETRY_INTERVAL', '15'))
+    RETRY_BATCH = int(os.getenv('NOTIFY_RETRY_BATCH', '50'))
+    # Share reports with other listener nodes by PatientReportId partition
+    CLUSTER = CLUSTER_ENABLED
+    # Warm the NLP and Whisper models in the background once LISTEN is active
+    PRELOAD_MODELS = os.getenv('NOTIFY_PRELOAD_MODELS', 'false').lower() == 'true'
+    # Prometheus text endpoint on localhost (0 disables; give each listener its own port)
+    # and periodic log summary
+    METRICS_PORT = int(os.getenv('NOTIFY_METRICS_PORT', '0'))
+    METRICS_LOG_INTERVAL = float(os.getenv('NOTIFY_METRICS_LOG_INTERVAL', '60'))
+
+
+def handle_keyword_reports(processor, payloads):
+    print(f"[PROCESS] Running keyword extraction for {len(payloads)} report(s)")
+    processor.process_reports(payloads)
+
+
+def handle_voice_reports(processor, payloads):
+    for payload in payloads:
+        data = json.loads(payload)
+        report_id = data['report_id']
+        print(f"[PROCESS] Currently converting the audio to transcript for {report_id}")
+        processor.run_transcriber_system(data['voice_path'], report_id)
+
+
+def payload_report_id(payload):
+    """Report id carried by a notification payload (audio payloads are JSON)"""
+    if payload.lstrip().startswith('{'):
+        return json.loads(payload)['report_id']
+    return payload
+
+
+# channel -> (processor factory, handler, config attribute holding the worker count)
+CHANNEL_HANDLERS = {
+    "report_ready_for_processing": (Extract_keyword, handle_keyword_reports, 'KEYWORD_WORKERS'),
+    "new_patient_report": (transcribe_audio, handle_voice_reports, 'AUDIO_WORKERS'),
+    "new_desc_patient_report": (Extract_keyword, handle_keyword_reports, 'KEYWORD_WORKERS'),
+}
 
-processor=Extract_keyword()
-report_processor=transcribe_audio()
-
-conn=psycopg2.connect(**DBConfig.get_connection_params())
-conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
-cur=conn.cursor()
-
-# Listen to both channels
-cur.execute("LISTEN report_ready_for_processing;")
-cur.execute("LISTEN new_patient_report;")
-cur.execute("LISTEN new_desc_patient_report;")
-
-print("Listener started")
-
-while True:
-    if select.select([conn],[],[],5)==([],[],[]):
-        continue
-    conn.poll()
-    while conn.notifies:
-        notify=conn.notifies.pop(0)
-        report_id=notify.payload
-        
-        if notify.channel=="report_ready_for_processing":
+# Channels whose notifications are coalesced into nlp.pipe batches
+BATCHED_CHANNELS = {"report_ready_for_processing", "new_desc_patient_report"}
+
+
+class ChannelWorkerPool:
+    """
+    Bounded pool of worker threads serving a single LISTEN channel.
+    Every worker builds its own processor, so each one holds a private DB connection.
+    Payloads that arrive within batch_window seconds of each other are handed to the
+    handler together (up to max_batch). When a batch fails its payloads are re-run one
+    at a time, so a single poison report cannot sink the rest; each failure is recorded
+    for a backoff retry. A worker whose processor fails to start keeps retrying with
+    backoff rather than exiting, so the queue is never left without consumers.
+    Retry state is only cleared for reports known to have some
+    (re-offered retries and failures seen here), so ordinary batches cost no extra writes.
+    """
+    _STOP = object()
+
+    def __init__(self, channel, processor_factory, handler, concurrency=1, queue_size=100,
+                 batch_window=0, max_batch=1, restart_delay=ListenerConfig.WORKER_RESTART_DELAY,
+                 restart_max_delay=ListenerConfig.WORKER_RESTART_MAX_DELAY):
+        self.channel = channel
+        self.processor_factory = processor_factory
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_window = batch_window
+        self.max_batch = max(1, max_batch)
+        self.restart_delay = restart_delay
+        self.restart_max_delay = restart_max_delay
+        self.stopping = threading.Event()
+        self.threads = []
+        self.retrying = set()
+        self.retrying_lock = threading.Lock()
+        METRICS.register_gauge('report_queue_depth', self.queue.qsize, channel=channel)
+
+    def start(self):
+        for i in range(self.concurrency):
+            thread = threading.Thread(
+                target=self._run_worker,
+                name=f"{self.channel}-worker-{i + 1}",
+                daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+        print(f"✓ {self.channel}: {self.concurrency} worker(s), queue size {self.queue.maxsize}")
+
+    def submit(self, payload, stop_event):
+        """Queue a payload, blocking the caller while the queue is full (backpressure)"""
+        warned = False
+        while not stop_event.is_set():
             try:
-                processor.process_single_report(report_id)
-                print(f"[PROCESS] Running keyword extraction for {report_id}")
-            except Exception as e:
-                print(f"[ERROR] Failed to process report {report_id}: {e}")
-        elif notify.channel == "new_patient_report":
+                self.queue.put(payload, timeout=1)
+                return True
+            except queue.Full:
+                if not warned:
+                    print(f"[BACKPRESSURE] {self.channel} queue is full ({self.queue.maxsize}), waiting for workers")
+                    warned = True
+        return False
+
+    def offer(self, payload):
+        """Queue a payload only if there is room right now (used for retries)"""
+        try:
+            self.queue.put_nowait(payload)
+            return True
+        except queue.Full:
+            return False
+
+    def track_retry(self, report_id):
+        """Remember that report_id has retry state to clear once it is handled"""
+        with self.retrying_lock:
+            self.retrying.add(str(report_id))
+
+    def untrack_retry(self, report_id):
+        with self.retrying_lock:
+            self.retrying.discard(str(report_id))
+
+    def _take_retrying(self, payloads):
+        """Report ids in payloads that have retry state, forgetting them"""
+        ids = {str(payload_report_id(p)) for p in payloads}
+        with self.retrying_lock:
+            taken = ids & self.retrying
+            self.retrying -= taken
+        return list(taken)
+
+    def stop(self):
+        self.stopping.set()
+        for _ in self.threads:
+            self.queue.put(self._STOP)
+        for thread in self.threads:
+            thread.join()
+
+    def _next_batch(self):
+        """Block for one payload, then keep collecting until the window closes or the batch is full"""
+        batch = [self.queue.get()]
+        if batch[0] is self._STOP:
+            return batch
+
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
             try:
-                payload = json.loads(notify.payload) 
-                audio_path = payload['voice_path']
-                report_id = payload['report_id']
-                report_processor.run_transcriber_system(audio_path, report_id)
-                print(f"[PROCESS] Currently converting the audio to transcript for {report_id}")
-            except Exception as e:
-                print(f"[ERROR] Failed to process audio for {report_id}: {e}")
-        elif notify.channel == "new_desc_patient_report":
+                payload = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(payload)
+            if payload is self._STOP:
+                break
+        return batch
+
+    @staticmethod
+    def _rollback(processor):
+        # Leave the connection usable for the next batch
+        try:
+            processor.conn.rollback()
+        except Exception:
+            pass
+
+    def _handle(self, processor, retries, payloads):
+        try:
+            with METRICS.time_stage("total"):
+                self.handler(processor, payloads)
+        except Exception as e:
+            self._rollback(processor)
+            if len(payloads) > 1:
+                print(f"[ISOLATE] {self.channel} batch of {len(payloads)} failed ({e}), retrying reports one by one")
+                for payload in payloads:
+                    self._handle(processor, retries, [payload])
+                return
+            METRICS.inc('report_payload_failures_total', channel=self.channel)
+            print(f"[ERROR] {self.channel} failed for payload {payloads[0]}: {e}")
+            self._record_failure(processor, retries, payloads[0], e)
+            return
+
+        METRICS.inc('report_payloads_total', len(payloads), channel=self.channel)
+        handled = self._take_retrying(payloads)
+        if not handled:
+            return
+        try:
+            retries.clear(handled)
+            processor.conn.commit()
+        except Exception as e:
+            self._rollback(processor)
+            print(f"[WARN] Could not clear retry state for {self.channel}: {e}")
+
+    def _record_failure(self, processor, retries, payload, error):
+        try:
+            report_id = payload_report_id(payload)
+            attempts, dead = retries.record_failure(report_id, self.channel, payload, error)
+            processor.conn.commit()
+            self.track_retry(report_id)
+        except Exception as e:
+            self._rollback(processor)
+            print(f"[ERROR] Could not record failure for payload {payload}: {e}")
+            return
+
+        if dead:
+            METRICS.inc('report_dead_letters_total', channel=self.channel)
+            print(f"[DEAD-LETTER] Report {report_id} failed {attempts} time(s); moved to PatientReportDeadLetter")
+        else:
+            print(f"[RETRY] Report {report_id} failed (attempt {attempts}); retry scheduled with backoff")
+
+    def _start_processor(self):
+        """Build this worker's processor, retrying with backoff; None once the pool is stopping"""
+        delay = self.restart_delay
+        while not self.stopping.is_set():
             try:
-                processor.process_single_report(report_id)
-                print(f"[PROCESS] Running general report processing for {report_id}")
+                return self.processor_factory()
             except Exception as e:
-                print(f"[ERROR] Failed to process report {report_id}: {e}")
+                print(f"[ERROR] {threading.current_thread().name} could not start: {e}; retrying in {delay:g}s")
+                METRICS.inc('report_worker_start_failures_total', channel=self.channel)
+            if self.stopping.wait(delay):
+                break
+            delay = min(delay * 2, self.restart_max_delay)
+        return None
+
+    def _run_worker(self):
+        METRICS.set_channel(self.channel)
+        processor = self._start_processor()
+        if processor is None:
+            return
+
+        retries = ReportRetryStore(processor.cursor, processor.schema)
+        try:
+            stopping = False
+            while not stopping:
+                batch = self._next_batch()
+                payloads = [p for p in batch if p is not self._STOP]
+                stopping = len(payloads) < len(batch)
+                try:
+                    if payloads:
+                        self._handle(processor, retries, payloads)
+                finally:
+                    for _ in batch:
+                        self.queue.task_done()
+        finally:
+            processor.close()
+
+
+class BacklogScanner:
+    """
+    Feeds reports whose NOTIFY was missed (listener down or restarting) into the
+    worker pools. Runs once LISTEN is active so nothing falls between the scan and
+    new notifications; workers claim rows with SKIP LOCKED, so duplicates are harmless.
+    In cluster mode only this node's partition is scanned, and a rescan runs whenever
+    membership changes so the share of a departed node is picked up.
+    """
+    def __init__(self, pools, listening_event, stop_event, interval=0, batch_size=500, membership=None):
+        self.pools = pools
+        self.listening_event = listening_event
+        self.stop_event = stop_event
+        self.interval = interval
+        self.batch_size = batch_size
+        self.membership = membership
+        self.rescan_event = threading.Event()
+        self.thread = None
+
+    def request_scan(self):
+        self.rescan_event.set()
+
+    def _wait_for_next_scan(self):
+        """True when another scan is due (interval elapsed or rescan requested), False on stop"""
+        deadline = time.monotonic() + self.interval if self.interval > 0 else None
+        while not self.stop_event.is_set():
+            if self.rescan_event.wait(timeout=1):
+                self.rescan_event.clear()
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return True
+        return False
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="backlog-scanner", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        self.listening_event.wait()
+        try:
+            DBConfig.validate()
+            conn = psycopg2.connect(**DBConfig.get_connection_params())
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        except Exception as e:
+            print(f"[ERROR] Backlog scanner could not connect: {e}")
+            return
+
+        try:
+            work_queue = ReportWorkQueue(conn.cursor(cursor_factory=RealDictCursor))
+            while not self.stop_event.is_set():
+                queued = self.scan_once(work_queue)
+                print(f"[CATCH-UP] Queued {queued} pending report(s) from PatientReport")
+                if not self._wait_for_next_scan():
+                    break
+        except Exception as e:
+            print(f"[ERROR] Backlog scan failed: {e}")
+        finally:
+            conn.close()
+
+    def scan_once(self, work_queue):
+        queued = 0
+        partition = self.membership.partition if self.membership else None
+        for kind, report_id, voice_path in work_queue.scan_pending(self.batch_size, partition):
+            if kind == KIND_AUDIO:
+                channel = "new_patient_report"
+                payload = json.dumps({'voice_path': voice_path, 'report_id': report_id})
+            else:
+                channel = "report_ready_for_processing"
+                payload = report_id
+
+            pool = self.pools.get(channel)
+            if pool is None:
+                continue
+            if not pool.submit(payload, self.stop_event):
+                break
+            queued += 1
+        return queued
+
+
+class RetryScheduler:
+    """
+    Re-offers failed reports once their backoff has expired.
+    Retries only take free queue space (never blocking), so a backlog of failures
+    cannot hold up fresh notifications; whatever does not fit is released and
+    picked up on a later pass.
+    """
+    def __init__(self, pools, listening_event, stop_event, interval=15, batch_size=50):
+        self.pools = pools
+        self.listening_event = listening_event
+        self.stop_event = stop_event
+        self.interval = interval
+        self.batch_size = batch_size
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="retry-scheduler", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        self.listening_event.wait()
+        if self.interval <= 0:
+            return
+        try:
+            DBConfig.validate()
+            conn = psycopg2.connect(**DBConfig.get_connection_params())
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        except Exception as e:
+            print(f"[ERROR] Retry scheduler could not connect: {e}")
+            return
+
+        try:
+            store = ReportRetryStore(conn.cursor(cursor_factory=RealDictCursor))
+            while not self.stop_event.wait(self.interval):
+                try:
+                    self.run_once(store)
+                except psycopg2.Error as e:
+                    print(f"[ERROR] Retry pass failed: {e}")
+        finally:
+            conn.close()
+
+    def run_once(self, store):
+        due = store.claim_due(self.batch_size, RETRY_LEASE)
+        deferred = []
+        for row in due:
+            report_id = str(row['PatientReportId'])
+            pool = self.pools.get(row['Channel'])
+            if pool is None:
+                deferred.append(report_id)
+                continue
+            # Tracked before it is queued, so a fast worker still clears its state
+            pool.track_retry(report_id)
+            if not pool.offer(row['Payload']):
+                pool.untrack_retry(report_id)
+                deferred.append(report_id)
+        if deferred:
+            store.release(deferred)
+        offered = len(due) - len(deferred)
+        if offered:
+            METRICS.inc('report_retries_total', offered)
+            print(f"[RETRY] Re-queued {offered} failed report(s) ({len(deferred)} deferred)")
+        return offered
+
+
+class NotificationDispatcher:
+    """
+    Keeps the LISTEN connection on a dedicated thread and hands every
+    notification to the worker pool registered for its channel.
+    """
+    def __init__(self, pools, poll_timeout=5, catchup_interval=0, catchup_batch=500, preload=(),
+                 metrics_port=0, metrics_log_interval=0, retry_interval=15, retry_batch=50,
+                 membership=None):
+        self.pools = pools
+        self.membership = membership
+        self.poll_timeout = poll_timeout
+        self.preload = preload
+        self.metrics_port = metrics_port
+        self.metrics_log_interval = metrics_log_interval
+        self.metrics_server = None
+        self.stop_event = threading.Event()
+        self.listening_event = threading.Event()
+        self.scanner = BacklogScanner(
+            pools,
+            self.listening_event,
+            self.stop_event,
+            interval=catchup_interval,
+            batch_size=catchup_batch,
+            membership=membership
+        )
+        self.retry_scheduler = RetryScheduler(
+            pools,
+            self.listening_event,
+            self.stop_event,
+            interval=retry_interval,
+            batch_size=retry_batch
+        )
+        self.thread = None
+        self.conn = None
+
+    def start(self):
+        if self.metrics_port:
+            self.metrics_server = start_metrics_server(self.metrics_port)
+        if self.metrics_log_interval > 0:
+            start_metrics_logger(self.metrics_log_interval, self.stop_event)
+        if self.membership:
+            self.membership.start()
+            self.membership.on_change.append(self.scanner.request_scan)
+        for pool in self.pools.values():
+            pool.start()
+        self.thread = threading.Thread(target=self._listen, name="notify-listener", daemon=True)
+        self.thread.start()
+        self.scanner.start()
+        self.retry_scheduler.start()
+
+    def _listen(self):
+        DBConfig.validate()
+        self.conn = psycopg2.connect(**DBConfig.get_connection_params())
+        self.conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        cur = self.conn.cursor()
+
+        for channel in self.pools:
+            cur.execute(f"LISTEN {channel};")
+
+        print(f"Listener started ({time.perf_counter() - PROCESS_STARTED:.2f}s after launch, "
+              f"module imports {IMPORT_SECONDS:.2f}s)")
+        self.listening_event.set()
+
+        for model in self.preload:
+            model.preload_async()
+
+        try:
+            while not self.stop_event.is_set():
+                if select.select([self.conn], [], [], self.poll_timeout) == ([], [], []):
+                    continue
+                self.conn.poll()
+                while self.conn.notifies:
+                    notify = self.conn.notifies.pop(0)
+                    pool = self.pools.get(notify.channel)
+                    if pool is None:
+                        continue
+                    if self.membership and not self._owned(notify.payload):
+                        METRICS.inc('report_notifications_skipped_total', channel=notify.channel)
+                        continue
+                    if not pool.submit(notify.payload, self.stop_event):
+                        return
+        except Exception as e:
+            print(f"[ERROR] Listener stopped: {e}")
+            self.stop_event.set()
+        finally:
+            cur.close()
+            self.conn.close()
+
+    def _owned(self, payload):
+        try:
+            return self.membership.owns(payload_report_id(payload))
+        except (ValueError, KeyError):
+            # Unparseable payload: let the worker report it
+            return True
+
+    def stop(self):
+        self.stop_event.set()
+        # Unblock the scanner if the listener died before LISTEN was issued
+        self.listening_event.set()
+        if self.thread:
+            self.thread.join()
+        self.scanner.thread.join()
+        self.retry_scheduler.thread.join()
+        for pool in self.pools.values():
+            pool.stop()
+        if self.membership:
+            self.membership.stop()
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+
+    def wait(self):
+        """Block the calling thread until the listener exits or Ctrl+C is pressed"""
+        try:
+            while self.thread.is_alive():
+                self.thread.join(timeout=1)
+        except KeyboardInterrupt:
+            print("\nShutting down listener...")
+        finally:
+            self.stop()
+
+
+def build_pools(concurrency, queue_size, batch_window=0, max_batch=1):
+    pools = {}
+    for channel, (factory, handler, workers_key) in CHANNEL_HANDLERS.items():
+        batched = channel in BATCHED_CHANNELS
+        pools[channel] = ChannelWorkerPool(
+            channel,
+            factory,
+            handler,
+            concurrency=concurrency[workers_key],
+            queue_size=queue_size,
+            batch_window=batch_window if batched else 0,
+            max_batch=max_batch if batched else 1
+        )
+    return pools
+
+
+def main(keyword_workers=ListenerConfig.KEYWORD_WORKERS,
+         audio_workers=ListenerConfig.AUDIO_WORKERS,
+         queue_size=ListenerConfig.QUEUE_SIZE,
+         catchup_interval=ListenerConfig.CATCHUP_INTERVAL,
+         batch_window=ListenerConfig.BATCH_WINDOW,
+         max_batch=ListenerConfig.MAX_BATCH,
+         preload_models=ListenerConfig.PRELOAD_MODELS,
+         metrics_port=ListenerConfig.METRICS_PORT,
+         retry_interval=ListenerConfig.RETRY_INTERVAL,
+         cluster=ListenerConfig.CLUSTER):
+    pools = build_pools(
+        {'KEYWORD_WORKERS': keyword_workers, 'AUDIO_WORKERS': audio_workers},
+        queue_size,
+        batch_window=batch_window,
+        max_batch=max_batch
+    )
+    dispatcher = NotificationDispatcher(
+        pools,
+        poll_timeout=ListenerConfig.POLL_TIMEOUT,
+        catchup_interval=catchup_interval,
+        catchup_batch=ListenerConfig.CATCHUP_BATCH,
+        preload=[NLP_MODEL, get_engine()] if preload_models else (),
+        metrics_port=metrics_port,
+        metrics_log_interval=ListenerConfig.METRICS_LOG_INTERVAL,
+        retry_interval=retry_interval,
+        retry_batch=ListenerConfig.RETRY_BATCH,
+        membership=ClusterMembership() if cluster else None
+    )
+    dispatcher.start()
+    dispatcher.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Patient report LISTEN/NOTIFY processor")
+    parser.add_argument("--keyword-workers", type=int, default=ListenerConfig.KEYWORD_WORKERS,
+                        help="Worker threads per keyword extraction channel")
+    parser.add_argument("--audio-workers", type=int, default=ListenerConfig.AUDIO_WORKERS,
+                        help="Worker threads for audio transcription")
+    parser.add_argument("--queue-size", type=int, default=ListenerConfig.QUEUE_SIZE,
+                        help="Max queued notifications per channel before applying backpressure")
+    parser.add_argument("--catchup-interval", type=float, default=ListenerConfig.CATCHUP_INTERVAL,
+                        help="Seconds between PatientReport backlog scans (0 = only at startup)")
+    parser.add_argument("--batch-window", type=float, default=ListenerConfig.BATCH_WINDOW,
+                        help="Seconds to coalesce keyword notifications into one nlp.pipe batch")
+    parser.add_argument("--max-batch", type=int, default=ListenerConfig.MAX_BATCH,
+                        help="Max reports per keyword extraction batch")
+    parser.add_argument("--preload", action="store_true", default=ListenerConfig.PRELOAD_MODELS,
+                        help="Load NLP and Whisper models in the background after LISTEN starts")
+    parser.add_argument("--metrics-port", type=int, default=ListenerConfig.METRICS_PORT,
+                        help="Port for the local Prometheus /metrics endpoint (0 disables)")
+    parser.add_argument("--retry-interval", type=float, default=ListenerConfig.RETRY_INTERVAL,
+                        help="Seconds between retry passes over failed reports (0 disables retries)")
+    parser.add_argument("--cluster", action="store_true", default=ListenerConfig.CLUSTER,
+                        help="Join the listener cluster and process only this node's share of reports")
+    args = parser.parse_args()
+    main(args.keyword_workers, args.audio_workers, args.queue_size, args.catchup_interval,
+         args.batch_window, args.max_batch, args.preload, args.metrics_port, args.retry_interval,
+         args.cluster)
@@ -0,0 +1,737 @@
+import time
+
+PROCESS_STARTED = time.perf_counter()
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncpg
+
+from db_config import DBConfig
+from notify import ListenerConfig, BATCHED_CHANNELS, payload_report_id
+from patient_report import KeywordExtractor, NLP_MODEL, keyword_texts, report_keyword_rows
+from transcription_engine import get_engine
+from transcript_cache import audio_hash, TRANSCRIPT_CACHE_ENABLED
+from report_queue import KEYWORD_PENDING, AUDIO_PENDING, HELD_FOR_RETRY
+from report_retry import RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, RETRY_LEASE, PROCESSING_LEASE
+from report_metrics import METRICS, start_metrics_server, start_metrics_logger
+
+IMPORT_SECONDS = time.perf_counter() - PROCESS_STARTED
+
+KEYWORD_CHANNELS = ("report_ready_for_processing", "new_desc_patient_report")
+AUDIO_CHANNEL = "new_patient_report"
+
+
+class AsyncListenerConfig:
+    # Connections shared by every in-flight report (plus one dedicated LISTEN connection).
+    # Connections are only held for single queries and short write transactions, never
+    # across NLP or Whisper, so the pool can be much smaller than the task count.
+    POOL_MIN = int(os.getenv('NOTIFY_ASYNC_POOL_MIN', '2'))
+    POOL_MAX = int(os.getenv('NOTIFY_ASYNC_POOL_MAX', '4'))
+    # Reports (or keyword batches) processed concurrently per channel
+    KEYWORD_TASKS = int(os.getenv('NOTIFY_ASYNC_KEYWORD_TASKS', '4'))
+    AUDIO_TASKS = int(os.getenv('NOTIFY_ASYNC_AUDIO_TASKS', '2'))
+    # Executor threads running the shared medspacy pipeline and the Whisper engine
+    NLP_THREADS = int(os.getenv('NOTIFY_ASYNC_NLP_THREADS', '2'))
+    AUDIO_THREADS = int(os.getenv('NOTIFY_ASYNC_AUDIO_THREADS', '2'))
+
+
+class AsyncReportStore:
+    """
+    asyncpg versions of the listener's queries (claims, keyword and transcript
+    writes, transcript cache and retry bookkeeping). Each method runs on the
+    connection it is given so callers control the transaction.
+    """
+    def __init__(self, schema=None, model_size=None, max_attempts=RETRY_MAX_ATTEMPTS,
+                 base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY, lease_seconds=PROCESSING_LEASE):
+        self.schema = schema or DBConfig.SCHEMA
+        self.model_size = model_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease_seconds = lease_seconds
+
+    # --- leases ---
+    async def _lease(self, conn, report_ids, payloads, channel, pending_sql):
+        """
+        Lease pending reports in PatientReportProcessingState and return the leased rows.
+        The lease commits on its own, so the caller can release the connection while it
+        works; a lease still live elsewhere is skipped. NextRetryAt moves with the lease,
+        so a report lost with a crashed listener is retried once the lease expires.
+        """
+        return await conn.fetch(f"""
+            WITH leased AS (
+                INSERT INTO "{self.schema}"."PatientReportProcessingState" AS s
+                    ("PatientReportId", "Channel", "Payload", "NextRetryAt", "LeasedUntil")
+                SELECT r."PatientReportId", $3, v.payload,
+                       NOW() + make_interval(secs => $4::float8),
+                       NOW() + make_interval(secs => $4::float8)
+                FROM unnest($1::uuid[], $2::text[]) AS v(report_id, payload)
+                JOIN "{self.schema}"."PatientReport" AS r ON r."PatientReportId" = v.report_id
+                WHERE r."IsDeleted" = FALSE
+                  AND {pending_sql}
+                ON CONFLICT ("PatientReportId") DO UPDATE
+                SET "Channel" = EXCLUDED."Channel",
+                    "Payload" = EXCLUDED."Payload",
+                    "NextRetryAt" = EXCLUDED."NextRetryAt",
+                    "LeasedUntil" = EXCLUDED."LeasedUntil"
+                WHERE s."LeasedUntil" IS NULL OR s."LeasedUntil" <= NOW()
+                RETURNING s."PatientReportId"
+            )
+            SELECT r."PatientReportId", r."Description", r."CreatedAt"
+            FROM leased
+            JOIN "{self.schema}"."PatientReport" AS r USING ("PatientReportId")
+        """, list(report_ids), list(payloads), channel, self.lease_seconds)
+
+    async def lease_keyword_reports(self, conn, report_ids, channel):
+        return await self._lease(conn, report_ids, report_ids, channel, KEYWORD_PENDING)
+
+    async def lease_audio_reports(self, conn, report_ids, channel, payloads):
+        return await self._lease(conn, report_ids, payloads, channel, AUDIO_PENDING)
+
+    async def release_leases(self, conn, report_ids):
+        """Give leases back after a failed attempt; reports with no failure history lose their row"""
+        await conn.execute(f"""
+            DELETE FROM "{self.schema}"."PatientReportProcessingState"
+            WHERE "PatientReportId" = ANY($1::uuid[])
+              AND "LeasedUntil" IS NOT NULL
+              AND "AttemptCount" = 0
+        """, list(report_ids))
+        await conn.execute(f"""
+            UPDATE "{self.schema}"."PatientReportProcessingState"
+            SET "LeasedUntil" = NULL,
+                "NextRetryAt" = NOW()
+            WHERE "PatientReportId" = ANY($1::uuid[])
+              AND "LeasedUntil" IS NOT NULL
+        """, list(report_ids))
+
+    async def forget_finished(self, conn, report_ids):
+        """Drop retry state of reports that no longer owe work, leaving live leases alone"""
+        finished = f"""
+            NOT EXISTS (
+                SELECT 1 FROM "{self.schema}"."PatientReport" AS r
+                WHERE r."PatientReportId" = s."PatientReportId"
+                  AND r."IsDeleted" = FALSE
+                  AND (({KEYWORD_PENDING}) OR ({AUDIO_PENDING}))
+            )
+        """
+        await conn.execute(f"""
+            DELETE FROM "{self.schema}"."PatientReportProcessingState" AS s
+            WHERE s."PatientReportId" = ANY($1::uuid[])
+              AND (s."LeasedUntil" IS NULL OR s."LeasedUntil" <= NOW())
+              AND {finished}
+        """, list(report_ids))
+        await conn.execute(f"""
+            DELETE FROM "{self.schema}"."PatientReportDeadLetter" AS s
+            WHERE s."PatientReportId" = ANY($1::uuid[])
+              AND {finished}
+        """, list(report_ids))
+
+    # --- writes ---
+    async def write_report_keywords(self, conn, results):
+        report_ids = [str(report_id) for report_id, _ in results]
+        await conn.execute(f"""
+            DELETE FROM "{self.schema}"."PatientReportKeyword"
+            WHERE "PatientReportId" = ANY($1::uuid[])
+        """, report_ids)
+        rows = report_keyword_rows(results)
+        if rows:
+            ids, keywords, labels = zip(*rows)
+            await conn.execute(f"""
+                INSERT INTO "{self.schema}"."PatientReportKeyword" ("PatientReportId", "Keyword", "EntityLabel")
+                SELECT * FROM unnest($1::uuid[], $2::text[], $3::text[])
+            """, list(ids), list(keywords), list(labels))
+
+    async def write_keywords(self, conn, results):
+        """Keywords string and normalized rows for many reports, one statement each"""
+        await conn.execute(f"""
+            UPDATE "{self.schema}"."PatientReport" AS r
+            SET "Keywords" = v.keywords
+            FROM unnest($1::uuid[], $2::text[]) AS v(report_id, keywords)
+            WHERE r."PatientReportId" = v.report_id
+        """, [str(report_id) for report_id, _ in results],
+            [", ".join(keyword_texts(entities)) for _, entities in results])
+        await self.write_report_keywords(conn, results)
+
+    async def save_transcript(self, conn, report_id, transcript, entities=None):
+        if entities is None:
+            await conn.execute(f"""
+                UPDATE "{self.schema}"."PatientReport"
+                SET "Description" = $1
+                WHERE "PatientReportId" = $2::uuid
+            """, transcript, report_id)
+            return
+        # Keywords set in the same UPDATE, so the trigger sends no second notification
+        await conn.execute(f"""
+            UPDATE "{self.schema}"."PatientReport"
+            SET "Description" = $1,
+                "Keywords" = $2
+            WHERE "PatientReportId" = $3::uuid
+        """, transcript, ", ".join(keyword_texts(entities)), report_id)
+        await self.write_report_keywords(conn, [(report_id, entities)])
+
+    # --- transcript cache (same table and rules as TranscriptCache) ---
+    async def cached_transcript(self, conn, audio_path, stat, content_hash=None):
+        if content_hash is None:
+            row = await conn.fetchrow(f"""
+                SELECT "AudioHash", "Transcript"
+                FROM "{self.schema}"."AudioTranscriptCache"
+                WHERE "VoiceDirectory" = $1
+                  AND "ModelSize" = $2
+                  AND "FileSize" = $3
+                  AND "FileMtime" = $4
+                LIMIT 1
+            """, audio_path, self.model_size, stat.st_size, stat.st_mtime)
+        else:
+            row = await conn.fetchrow(f"""
+                SELECT "AudioHash", "Transcript"
+                FROM "{self.schema}"."AudioTranscriptCache"
+                WHERE "AudioHash" = $1
+                  AND "ModelSize" = $2
+            """, content_hash, self.model_size)
+        return row
+
+    async def store_transcript(self, conn, audio_path, stat, content_hash, transcript):
+        await conn.execute(f"""
+            INSERT INTO "{self.schema}"."AudioTranscriptCache"
+                ("AudioHash", "ModelSize", "Transcript", "VoiceDirectory", "FileSize", "FileMtime")
+            VALUES ($1, $2, $3, $4, $5, $6)
+            ON CONFLICT ("AudioHash", "ModelSize") DO UPDATE
+            SET "VoiceDirectory" = EXCLUDED."VoiceDirectory",
+                "FileSize" = EXCLUDED."FileSize",
+                "FileMtime" = EXCLUDED."FileMtime"
+        """, content_hash, self.model_size, transcript, audio_path, stat.st_size, stat.st_mtime)
+
+    # --- retry bookkeeping (same tables and rules as ReportRetryStore) ---
+    async def record_failure(self, conn, report_id, channel, payload, error):
+        attempts = await conn.fetchval(f"""
+            INSERT INTO "{self.schema}"."PatientReportProcessingState" AS s
+                ("PatientReportId", "Channel", "Payload", "AttemptCount", "LastError", "LastAttemptAt", "NextRetryAt")
+            VALUES ($1::uuid, $2, $3, 1, $4, NOW(), NOW() + make_interval(secs => $5::float8))
+            ON CONFLICT ("PatientReportId") DO UPDATE
+            SET "Channel" = EXCLUDED."Channel",
+                "Payload" = EXCLUDED."Payload",
+                "AttemptCount" = s."AttemptCount" + 1,
+                "LastError" = EXCLUDED."LastError",
+                "LastAttemptAt" = NOW(),
+                "NextRetryAt" = NOW() + make_interval(secs => LEAST($6::float8, $5::float8 * POWER(2, s."AttemptCount"))),
+                "LeasedUntil" = NULL
+            RETURNING "AttemptCount"
+        """, report_id, channel, payload, str(error)[:2000], self.base_delay, self.max_delay)
+        if attempts < self.max_attempts:
+            return attempts, False
+
+        await conn.execute(f"""
+            WITH moved AS (
+                DELETE FROM "{self.schema}"."PatientReportProcessingState"
+                WHERE "PatientReportId" = $1::uuid
+                RETURNING *
+            )
+            INSERT INTO "{self.schema}"."PatientReportDeadLetter"
+                ("PatientReportId", "Channel", "Payload", "AttemptCount", "LastError")
+            SELECT "PatientReportId", "Channel", "Payload", "AttemptCount", "LastError"
+            FROM moved
+            ON CONFLICT ("PatientReportId") DO UPDATE
+            SET "Channel" = EXCLUDED."Channel",
+                "Payload" = EXCLUDED."Payload",
+                "AttemptCount" = EXCLUDED."AttemptCount",
+                "LastError" = EXCLUDED."LastError",
+                "DeadLetteredAt" = NOW()
+        """, report_id)
+        return attempts, True
+
+    async def clear_failures(self, conn, report_ids):
+        await conn.execute(f"""
+            DELETE FROM "{self.schema}"."PatientReportProcessingState"
+            WHERE "PatientReportId" = ANY($1::uuid[])
+        """, list(report_ids))
+        await conn.execute(f"""
+            DELETE FROM "{self.schema}"."PatientReportDeadLetter"
+            WHERE "PatientReportId" = ANY($1::uuid[])
+        """, list(report_ids))
+
+    async def claim_due_retries(self, conn, limit, lease_seconds=RETRY_LEASE):
+        return await conn.fetch(f"""
+            UPDATE "{self.schema}"."PatientReportProcessingState"
+            SET "NextRetryAt" = NOW() + make_interval(secs => $1::float8)
+            WHERE "PatientReportId" IN (
+                SELECT "PatientReportId"
+                FROM "{self.schema}"."PatientReportProcessingState"
+                WHERE "NextRetryAt" <= NOW()
+                ORDER BY "NextRetryAt"
+                LIMIT $2
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING "PatientReportId", "Channel", "Payload"
+        """, lease_seconds, limit)
+
+    async def release_retries(self, conn, report_ids):
+        await conn.execute(f"""
+            UPDATE "{self.schema}"."PatientReportProcessingState"
+            SET "NextRetryAt" = NOW()
+            WHERE "PatientReportId" = ANY($1::uuid[])
+        """, list(report_ids))
+
+    # --- backlog ---
+    async def pending_page(self, conn, after_id=None, batch_size=500):
+        """
+        One keyset page of reports still owed work, as ([(channel, payload)], last id).
+        Callers fetch page by page so no connection is held between pages.
+        """
+        held_for_retry = HELD_FOR_RETRY.format(schema=self.schema)
+        rows = await conn.fetch(f"""
+            SELECT
+                "PatientReportId",
+                "VoiceDirectory",
+                ({AUDIO_PENDING}) AS "NeedsAudio"
+            FROM "{self.schema}"."PatientReport" AS r
+            WHERE "IsDeleted" = FALSE
+              AND "Keywords" IS NULL
+              AND (({KEYWORD_PENDING}) OR ({AUDIO_PENDING}))
+              AND NOT ({held_for_retry})
+              AND ($1::uuid IS NULL OR "PatientReportId" > $1::uuid)
+            ORDER BY "PatientReportId"
+            LIMIT $2
+        """, after_id, batch_size)
+        work = []
+        for row in rows:
+            report_id = str(row['PatientReportId'])
+            if row['NeedsAudio']:
+                work.append((AUDIO_CHANNEL, json.dumps({'voice_path': row['VoiceDirectory'], 'report_id': report_id})))
+            else:
+                work.append((KEYWORD_CHANNELS[0], report_id))
+        return work, (str(rows[-1]['PatientReportId']) if rows else None)
+
+
+class AsyncReportListener:
+    """
+    Single-process asyncio listener.
+    One connection LISTENs on every channel while an asyncpg pool serves the
+    in-flight reports, so the connection count follows the pool size rather than
+    one connection per worker. medspacy and Whisper run in thread executors (the
+    models are loaded once per process), keeping the event loop free to accept
+    notifications. Whisper only transcribes in parallel with WHISPER_WORKERS > 1;
+    with one worker the engine serializes calls on its in-process model.
+
+    Reports are leased in PatientReportProcessingState before any slow work, so
+    connections go back to the pool during NLP and Whisper while other listeners
+    still skip the report. A lease lost with a crashed listener expires into the
+    normal retry schedule.
+
+    Notifications are hints: PatientReport rows stay pending until written, so
+    when a queue is full the notification is dropped and a backlog scan is
+    scheduled instead of buffering without bound.
+    """
+    def __init__(self, keyword_tasks=AsyncListenerConfig.KEYWORD_TASKS,
+                 audio_tasks=AsyncListenerConfig.AUDIO_TASKS,
+                 queue_size=ListenerConfig.QUEUE_SIZE,
+                 batch_window=ListenerConfig.BATCH_WINDOW,
+                 max_batch=ListenerConfig.MAX_BATCH,
+                 pool_min=AsyncListenerConfig.POOL_MIN,
+                 pool_max=AsyncListenerConfig.POOL_MAX,
+                 nlp_threads=AsyncListenerConfig.NLP_THREADS,
+                 audio_threads=AsyncListenerConfig.AUDIO_THREADS,
+                 catchup_interval=ListenerConfig.CATCHUP_INTERVAL,
+                 catchup_batch=ListenerConfig.CATCHUP_BATCH,
+                 retry_interval=ListenerConfig.RETRY_INTERVAL,
+                 retry_batch=ListenerConfig.RETRY_BATCH,
+                 preload=ListenerConfig.PRELOAD_MODELS,
+                 metrics_log_interval=ListenerConfig.METRICS_LOG_INTERVAL):
+        self.tasks_per_channel = {channel: keyword_tasks for channel in KEYWORD_CHANNELS}
+        self.tasks_per_channel[AUDIO_CHANNEL] = audio_tasks
+        self.queue_size = queue_size
+        self.batch_window = batch_window
+        self.max_batch = max(1, max_batch)
+        # No task holds a connection across NLP or Whisper, so tasks only wait briefly for one
+        pool_max = max(1, pool_max)
+        self.pool_min = min(pool_min, pool_max)
+        self.pool_max = pool_max
+        self.catchup_interval = catchup_interval
+        self.catchup_batch = catchup_batch
+        self.retry_interval = retry_interval
+        self.retry_batch = retry_batch
+        self.preload = preload
+        self.metrics_log_interval = metrics_log_interval
+        self.metrics_stop = threading.Event()
+
+        self.engine = get_engine()
+        self.extractor = KeywordExtractor()
+        self.store = AsyncReportStore(model_size=self.engine.model_size)
+        self.nlp_executor = ThreadPoolExecutor(max_workers=max(1, nlp_threads), thread_name_prefix="nlp")
+        if self.engine.workers <= 1:
+            # Extra threads would only queue on the engine's model lock
+            audio_threads = 1
+        self.audio_executor = ThreadPoolExecutor(max_workers=max(1, audio_threads), thread_name_prefix="whisper")
+        self.handlers = {channel: self.process_keyword_reports for channel in KEYWORD_CHANNELS}
+        self.handlers[AUDIO_CHANNEL] = self.process_voice_reports
+
+        self.queues = {}
+        self.pool = None
+        self.listen_conn = None
+        self.tasks = []
+        self.stop_event = None
+        self.rescan_event = None
+
+    # --- lifecycle ---
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        self.rescan_event = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop_event.set)
+            except NotImplementedError:
+                pass
+
+        DBConfig.validate()
+        params = DBConfig.get_connection_params()
+        params['port'] = int(params['port'])
+        self.pool = await asyncpg.create_pool(min_size=self.pool_min, max_size=self.pool_max, **params)
+        self.listen_conn = await asyncpg.connect(**params)
+        METRICS.register_gauge('report_db_pool_connections', self.pool.get_size, state='open')
+        METRICS.register_gauge('report_db_pool_connections', self.pool.get_idle_size, state='idle')
+
+        for channel, concurrency in self.tasks_per_channel.items():
+            self.queues[channel] = asyncio.Queue(maxsize=self.queue_size)
+            METRICS.register_gauge('report_queue_depth', self.queues[channel].qsize, channel=channel)
+            for i in range(max(1, concurrency)):
+                self.tasks.append(asyncio.create_task(self._worker(channel), name=f"{channel}-task-{i + 1}"))
+            await self.listen_conn.add_listener(channel, self._on_notify)
+            print(f"✓ {channel}: {concurrency} task(s), queue size {self.queue_size}")
+
+        print(f"Async listener started ({time.perf_counter() - PROCESS_STARTED:.2f}s after launch, "
+              f"module imports {IMPORT_SECONDS:.2f}s, pool {self.pool_min}-{self.pool_max} connections)")
+
+        if self.preload:
+            NLP_MODEL.preload_async()
+            self.engine.preload_async()
+
+        # Scan once at startup; LISTEN is already active, so nothing falls in between
+        self.rescan_event.set()
+        self.tasks.append(asyncio.create_task(self._catchup_loop(), name="backlog-scanner"))
+        if self.retry_interval > 0:
+            self.tasks.append(asyncio.create_task(self._retry_loop(), name="retry-scheduler"))
+        if self.metrics_log_interval > 0:
+            start_metrics_logger(self.metrics_log_interval, self.metrics_stop)
+
+        try:
+            await self.stop_event.wait()
+        finally:
+            await self.close()
+
+    async def close(self):
+        print("\nShutting down async listener...")
+        self.metrics_stop.set()
+        if self.listen_conn is not None:
+            await self.listen_conn.close()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.pool is not None:
+            await self.pool.close()
+        self.nlp_executor.shutdown()
+        self.audio_executor.shutdown()
+        self.engine.close()
+
+    def _on_notify(self, connection, pid, channel, payload):
+        queue = self.queues.get(channel)
+        if queue is None:
+            return
+        try:
+            queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            METRICS.inc('report_notifications_dropped_total', channel=channel)
+            if not self.rescan_event.is_set():
+                print(f"[BACKPRESSURE] {channel} queue is full ({self.queue_size}), deferring to a backlog scan")
+            self.rescan_event.set()
+
+    # --- workers ---
+    async def _next_batch(self, channel, queue):
+        batch = [await queue.get()]
+        if channel not in BATCHED_CHANNELS:
+            return batch
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                else:
+                    batch.append(queue.get_nowait())
+            except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                break
+        return batch
+
+    async def _worker(self, channel):
+        queue = self.queues[channel]
+        while True:
+            batch = await self._next_batch(channel, queue)
+            try:
+                await self._handle(channel, batch)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _handle(self, channel, payloads):
+        try:
+            with METRICS.time_stage("total", channel=channel):
+                await self.handlers[channel](channel, payloads)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if len(payloads) > 1:
+                print(f"[ISOLATE] {channel} batch of {len(payloads)} failed ({e}), retrying reports one by one")
+                for payload in payloads:
+                    await self._handle(channel, [payload])
+                return
+            METRICS.inc('report_payload_failures_total', channel=channel)
+            print(f"[ERROR] {channel} failed for payload {payloads[0]}: {e}")
+            await self._record_failure(channel, payloads[0], e)
+            return
+
+        # Handlers clear retry state in their write transaction, together with the lease
+        METRICS.inc('report_payloads_total', len(payloads), channel=channel)
+
+    async def _record_failure(self, channel, payload, error):
+        try:
+            report_id = payload_report_id(payload)
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    attempts, dead = await self.store.record_failure(conn, report_id, channel, payload, error)
+        except Exception as e:
+            print(f"[ERROR] Could not record failure for payload {payload}: {e}")
+            return
+        if dead:
+            METRICS.inc('report_dead_letters_total', channel=channel)
+            print(f"[DEAD-LETTER] Report {report_id} failed {attempts} time(s); moved to PatientReportDeadLetter")
+        else:
+            print(f"[RETRY] Report {report_id} failed (attempt {attempts}); retry scheduled with backoff")
+
+    async def _take_leases(self, channel, report_ids, lease):
+        """Run a store lease call on a short-lived connection; finished reports lose stale retry state"""
+        async with self.pool.acquire() as conn:
+            with METRICS.time_stage("fetch", channel=channel):
+                reports = await lease(conn)
+            skipped = set(report_ids) - {str(r['PatientReportId']) for r in reports}
+            if skipped:
+                await self.store.forget_finished(conn, skipped)
+        return reports
+
+    async def _release_leases(self, report_ids):
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await self.store.release_leases(conn, report_ids)
+        except Exception as e:
+            print(f"[WARN] Could not release leases for {len(report_ids)} report(s): {e}")
+
+    # --- processing ---
+    async def process_keyword_reports(self, channel, payloads):
+        report_ids = list(dict.fromkeys(payloads))
+        loop = asyncio.get_running_loop()
+        # Leased reports are skipped by other listeners while NLP runs with no connection held
+        reports = await self._take_leases(
+            channel, report_ids, lambda conn: self.store.lease_keyword_reports(conn, report_ids, channel)
+        )
+        if not reports:
+            print(f"[SKIP] No pending reports in batch of {len(report_ids)}.")
+            return
+        leased = [str(r['PatientReportId']) for r in reports]
+        try:
+            with METRICS.time_stage("nlp", channel=channel):
+                entity_sets = await loop.run_in_executor(
+                    self.nlp_executor,
+                    self.extractor.extract_medical_entities_batch,
+                    [r['Description'] for r in reports]
+                )
+            results = list(zip(leased, entity_sets))
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    with METRICS.time_stage("write", channel=channel):
+                        await self.store.write_keywords(conn, results)
+                        await self.store.clear_failures(conn, leased)
+        except Exception:
+            await self._release_leases(leased)
+            raise
+
+        for report in reports:
+            METRICS.observe_lag(report['CreatedAt'], channel=channel)
+        print(f"[DONE] Processed {len(results)} report(s) in one batch ({len(report_ids) - len(results)} skipped)")
+
+    async def process_voice_reports(self, channel, payloads):
+        for payload in payloads:
+            data = json.loads(payload)
+            await self.process_voice_report(channel, payload, data['report_id'], data['voice_path'])
+
+    async def process_voice_report(self, channel, payload, report_id, audio_path):
+        # Lease before the cache lookup so two listeners never transcribe the same report
+        reports = await self._take_leases(
+            channel, [report_id],
+            lambda conn: self.store.lease_audio_reports(conn, [report_id], channel, [payload])
+        )
+        if not reports:
+            print(f"[SKIP] Audio for report {report_id} already transcribed, leased elsewhere or not found.")
+            return
+        try:
+            await self._transcribe_report(channel, report_id, audio_path)
+        except Exception:
+            await self._release_leases([report_id])
+            raise
+        METRICS.observe_lag(reports[0]['CreatedAt'], channel=channel)
+        print(f"--- Process Complete ({report_id}) ---")
+
+    async def _transcribe_report(self, channel, report_id, audio_path):
+        loop = asyncio.get_running_loop()
+        # Whisper and NLP run without a pooled connection; the lease keeps other listeners off
+        with METRICS.time_stage("transcript_cache", channel=channel):
+            transcript, content_hash, stat = await self._cached_transcript(audio_path)
+        if transcript is not None:
+            print(f"[CACHE] Reusing transcript for {os.path.basename(audio_path)}")
+        else:
+            print(f"\n--- Transcribing: {os.path.basename(audio_path)} ---")
+            with METRICS.time_stage("whisper", channel=channel):
+                transcript = await loop.run_in_executor(self.audio_executor, self.engine.transcribe, audio_path)
+            if TRANSCRIPT_CACHE_ENABLED:
+                if content_hash is None:
+                    content_hash = await loop.run_in_executor(self.audio_executor, audio_hash, audio_path)
+                async with self.pool.acquire() as conn:
+                    await self.store.store_transcript(conn, audio_path, stat, content_hash, transcript)
+
+        entities = None
+        try:
+            with METRICS.time_stage("nlp", channel=channel):
+                entities = await loop.run_in_executor(
+                    self.nlp_executor, self.extractor.extract_medical_entities, transcript
+                )
+        except Exception as e:
+            # Fall back to the trigger-driven extraction pass
+            print(f"[WARN] Inline keyword extraction failed for {report_id}: {e}")
+
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                with METRICS.time_stage("write", channel=channel):
+                    await self.store.save_transcript(conn, report_id, transcript, entities)
+                    await self.store.clear_failures(conn, [report_id])
+
+    async def _cached_transcript(self, audio_path):
+        """(transcript or None, content hash or None, os.stat result); connections held per lookup only"""
+        loop = asyncio.get_running_loop()
+        stat = await loop.run_in_executor(None, os.stat, audio_path)
+        if not TRANSCRIPT_CACHE_ENABLED:
+            return None, None, stat
+
+        async with self.pool.acquire() as conn:
+            row = await self.store.cached_transcript(conn, audio_path, stat)
+        if row:
+            return row['Transcript'], row['AudioHash'], stat
+
+        content_hash = await loop.run_in_executor(self.audio_executor, audio_hash, audio_path)
+        async with self.pool.acquire() as conn:
+            row = await self.store.cached_transcript(conn, audio_path, stat, content_hash)
+            if row:
+                # Remember this path too, so the next upload of it skips hashing
+                await self.store.store_transcript(conn, audio_path, stat, content_hash, row['Transcript'])
+        if row:
+            return row['Transcript'], content_hash, stat
+        return None, content_hash, stat
+
+    # --- background passes ---
+    async def _catchup_loop(self):
+        while True:
+            if self.catchup_interval > 0:
+                try:
+                    await asyncio.wait_for(self.rescan_event.wait(), self.catchup_interval)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await self.rescan_event.wait()
+            self.rescan_event.clear()
+            try:
+                queued = 0
+                last_id = None
+                while True:
+                    async with self.pool.acquire() as conn:
+                        work, last_id = await self.store.pending_page(conn, last_id, self.catchup_batch)
+                    if not work:
+                        break
+                    # Blocking put with the connection released: the scan advances only as fast as workers drain
+                    for channel, payload in work:
+                        await self.queues[channel].put(payload)
+                        queued += 1
+                print(f"[CATCH-UP] Queued {queued} pending report(s) from PatientReport")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[ERROR] Backlog scan failed: {e}")
+
+    async def _retry_loop(self):
+        while True:
+            await asyncio.sleep(self.retry_interval)
+            try:
+                async with self.pool.acquire() as conn:
+                    due = await self.store.claim_due_retries(conn, self.retry_batch)
+                    deferred = []
+                    for row in due:
+                        queue = self.queues.get(row['Channel'])
+                        try:
+                            if queue is None:
+                                raise asyncio.QueueFull
+                            queue.put_nowait(row['Payload'])
+                        except asyncio.QueueFull:
+                            deferred.append(str(row['PatientReportId']))
+                    if deferred:
+                        await self.store.release_retries(conn, deferred)
+                offered = len(due) - len(deferred)
+                if offered:
+                    METRICS.inc('report_retries_total', offered)
+                    print(f"[RETRY] Re-queued {offered} failed report(s) ({len(deferred)} deferred)")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[ERROR] Retry pass failed: {e}")
+
+
+def main(keyword_tasks=AsyncListenerConfig.KEYWORD_TASKS,
+         audio_tasks=AsyncListenerConfig.AUDIO_TASKS,
+         pool_max=AsyncListenerConfig.POOL_MAX,
+         queue_size=ListenerConfig.QUEUE_SIZE,
+         catchup_interval=ListenerConfig.CATCHUP_INTERVAL,
+         preload_models=ListenerConfig.PRELOAD_MODELS,
+         metrics_port=ListenerConfig.METRICS_PORT):
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    listener = AsyncReportListener(
+        keyword_tasks=keyword_tasks,
+        audio_tasks=audio_tasks,
+        pool_max=pool_max,
+        queue_size=queue_size,
+        catchup_interval=catchup_interval,
+        preload=preload_models
+    )
+    asyncio.run(listener.run())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Patient report LISTEN/NOTIFY processor (asyncio)")
+    parser.add_argument("--keyword-tasks", type=int, default=AsyncListenerConfig.KEYWORD_TASKS,
+                        help="Concurrent keyword batches per keyword channel")
+    parser.add_argument("--audio-tasks", type=int, default=AsyncListenerConfig.AUDIO_TASKS,
+                        help="Concurrent audio transcriptions")
+    parser.add_argument("--pool-size", type=int, default=AsyncListenerConfig.POOL_MAX,
+                        help="Max pooled database connections shared by every task")
+    parser.add_argument("--queue-size", type=int, default=ListenerConfig.QUEUE_SIZE,
+                        help="Max queued notifications per channel before deferring to a backlog scan")
+    parser.add_argument("--catchup-interval", type=float, default=ListenerConfig.CATCHUP_INTERVAL,
+                        help="Seconds between PatientReport backlog scans (0 = startup and on overflow)")
+    parser.add_argument("--preload", action="store_true", default=ListenerConfig.PRELOAD_MODELS,
+                        help="Load NLP and Whisper models in the background after LISTEN starts")
+    parser.add_argument("--metrics-port", type=int, default=ListenerConfig.METRICS_PORT,
+                        help="Port for the local Prometheus /metrics endpoint (0 disables)")
+    args = parser.parse_args()
+    main(args.keyword_tasks, args.audio_tasks, args.pool_size, args.queue_size,
+         args.catchup_interval, args.preload, args.metrics_port)
@@ -1,25 +1,168 @@
-import medspacy
+import argparse
+import json
+import os
 import psycopg2
-from psycopg2.extras import RealDictCursor
+import time
+from psycopg2.extras import RealDictCursor, execute_values
 from datetime import date
 from db_config import DBConfig
+from report_queue import ReportWorkQueue
+from keyword_cache import KeywordCache, description_hash, pipeline_fingerprint
+from model_loader import LazyModel, timed_import
+from report_metrics import METRICS
 import re
-import spacy
 
-class Extract_keyword:
-    def __init__(self):
-        # Load MedSpaCy pipeline (pre-trained)
-        self.nlp = medspacy.load("en_core_sci_sm-0.5.0", disable=["parser"])
-        self.sentencizer = self.nlp.get_pipe("medspacy_pyrush")
-        self.context = self.nlp.get_pipe("medspacy_context")
-        self.matcher = self.nlp.get_pipe("medspacy_target_matcher")
+# nlp.pipe tuning for batched extraction
+NLP_BATCH_SIZE = int(os.getenv('NLP_BATCH_SIZE', '64'))
+NLP_N_PROCESS = int(os.getenv('NLP_N_PROCESS', '1'))
+
+BACKFILL_CHECKPOINT = os.getenv('KEYWORD_BACKFILL_CHECKPOINT', 'keyword_backfill.checkpoint.json')
+
+
+def _load_nlp():
+    medspacy = timed_import("medspacy")
+    # Load MedSpaCy pipeline (pre-trained)
+    return medspacy.load("en_core_sci_sm-0.5.0", disable=["parser"])
+
+
+def keyword_texts(entities):
+    return {text for text, _ in entities}
+
+
+def normalize_keyword(text):
+    """Search form of a keyword: lower-case with single spaces"""
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def report_keyword_rows(results):
+    """(report_id, keyword, label) rows for PatientReportKeyword, one per distinct normalized keyword"""
+    rows = []
+    for report_id, entities in results:
+        seen = set()
+        for text, label in sorted(entities):
+            keyword = normalize_keyword(text)
+            if keyword and keyword not in seen:
+                seen.add(keyword)
+                rows.append((str(report_id), keyword, label))
+    return rows
+
+
+# One pipeline per process, loaded on first use and shared by every Extract_keyword
+NLP_MODEL = LazyModel("medspacy 'en_core_sci_sm-0.5.0'", _load_nlp)
+
+class KeywordExtractor:
+    """
+    medspacy keyword extraction with the keyword cache, independent of any
+    database connection (the async listener drives it from an executor).
+    """
+    cursor = None
+    schema = None
+
+    def __init__(self, batch_size=NLP_BATCH_SIZE, n_process=NLP_N_PROCESS):
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self._cache = None
+
+    @property
+    def nlp(self):
+        return NLP_MODEL.get()
+
+    @property
+    def sentencizer(self):
+        return self.nlp.get_pipe("medspacy_pyrush")
+
+    @property
+    def context(self):
+        return self.nlp.get_pipe("medspacy_context")
+
+    @property
+    def matcher(self):
+        return self.nlp.get_pipe("medspacy_target_matcher")
+
+    # Built on first use because the cache key depends on the loaded pipeline.
+    # Without a cursor only the in-process tier is used
+    @property
+    def cache(self):
+        if self._cache is None:
+            self._cache = KeywordCache(pipeline_fingerprint(self.nlp), self.cursor, self.schema)
+            self._cache.purge_stale()
+        return self._cache
+
+    def clean_description(self, description):
+        no_quotes_description = description.replace("'", "")
+        return re.sub(r'\s+', ' ', no_quotes_description).strip()
+
+    # Fully dynamic extraction
+    def extract_medical_keywords(self, description):
+        return keyword_texts(self.extract_medical_entities(description))
+
+    def extract_medical_entities(self, description):
+        cleaned = self.clean_description(description)
+        key = description_hash(cleaned)
+        entities = self.cache.get(key)
+        if entities is None:
+            entities = self.entities_from_doc(self.nlp(cleaned))
+            self.cache.put(key, entities)
+        return entities
+
+    # Batched extraction through nlp.pipe, preserving input order
+    def extract_medical_keywords_batch(self, descriptions):
+        return [keyword_texts(e) for e in self.extract_medical_entities_batch(descriptions)]
+
+    def extract_medical_entities_batch(self, descriptions):
+        cleaned = [self.clean_description(d) for d in descriptions]
+        hashes = [description_hash(text) for text in cleaned]
+        results = self.cache.get_many(hashes)
+
+        # Run the pipeline once per distinct text that is not cached yet
+        pending = {}
+        for key, text in zip(hashes, cleaned):
+            if key not in results:
+                pending.setdefault(key, text)
+
+        if pending:
+            docs = self.nlp.pipe(pending.values(), batch_size=self.batch_size, n_process=self.n_process)
+            computed = {key: self.entities_from_doc(doc) for key, doc in zip(pending, docs)}
+            self.cache.put_many(computed)
+            results.update(computed)
+
+        return [results[key] for key in hashes]
+
+    def keywords_from_doc(self, doc):
+        return keyword_texts(self.entities_from_doc(doc))
+
+    # (keyword, entity label) pairs for every non-negated entity
+    def entities_from_doc(self, doc):
+        results = set()
+
+        for ent in doc.ents:
+            # Skip negated entities
+            if hasattr(ent._, "context") and ent._.context.is_negated:
+                continue
+            results.add((ent.text.strip(), ent.label_))
+
+            # Optional debug:
+            print(f"[DEBUG] Found entity: {ent.text}, label: {ent.label_}, negated? {getattr(ent._, 'context', None) and ent._.context.is_negated}")
+
+        return frozenset(results)
+
+
+class Extract_keyword(KeywordExtractor):
+    def __init__(self, batch_size=NLP_BATCH_SIZE, n_process=NLP_N_PROCESS, conn=None):
+        super().__init__(batch_size, n_process)
+        # A borrowed connection lets another processor write keywords in its own transaction
+        self.owns_conn = conn is None
 
         try:
-            DBConfig.validate()
-            self.conn = psycopg2.connect(**DBConfig.get_connection_params())
-            self.conn.autocommit = False
+            if self.owns_conn:
+                DBConfig.validate()
+                self.conn = psycopg2.connect(**DBConfig.get_connection_params())
+                self.conn.autocommit = False
+            else:
+                self.conn = conn
             self.cursor = self.conn.cursor(cursor_factory=RealDictCursor)
             self.schema = DBConfig.SCHEMA
+            self.queue = ReportWorkQueue(self.cursor, self.schema)
             print(f"✓ Connected to database: {DBConfig.NAME}")
             print(f"✓ Using schema: {self.schema}")
         except Exception as e:
@@ -36,24 +179,6 @@ class Extract_keyword:
         self.cursor.execute(query, (report_id,))
         return self.cursor.fetchone()
     
-    # Fully dynamic extraction
-    def extract_medical_keywords(self, description):
-        no_quotes_description = description.replace("'", "")
-        cleaned_description = re.sub(r'\s+', ' ', no_quotes_description).strip()
-        doc = self.nlp(cleaned_description)
-        results = set()
-
-        for ent in doc.ents:
-            # Skip negated entities
-            if hasattr(ent._, "context") and ent._.context.is_negated:
-                continue
-            results.add(ent.text.strip())
-
-            # Optional debug:
-            print(f"[DEBUG] Found entity: {ent.text}, label: {ent.label_}, negated? {getattr(ent._, 'context', None) and ent._.context.is_negated}")
-
-        return results
-
     # Insert into description
     def insert_keywords(self, record_id, keywords):
         self.cursor.execute(f"""
@@ -62,21 +187,260 @@ class Extract_keyword:
             WHERE "PatientReportId" = %s
         """, (keywords, record_id))
 
+    # Write many keyword strings back in a single UPDATE ... FROM (VALUES ...)
+    def insert_keywords_batch(self, rows):
+        if not rows:
+            return
+        execute_values(self.cursor, f"""
+            UPDATE "{self.schema}"."PatientReport" AS r
+            SET "Keywords" = v.keywords
+            FROM (VALUES %s) AS v(report_id, keywords)
+            WHERE r."PatientReportId" = v.report_id::uuid
+        """, rows, page_size=len(rows))
+
+    # Replace the normalized, searchable keyword rows for each (report_id, entities) pair
+    def insert_report_keywords(self, results):
+        if not results:
+            return
+        report_ids = [str(report_id) for report_id, _ in results]
+        self.cursor.execute(f"""
+            DELETE FROM "{self.schema}"."PatientReportKeyword"
+            WHERE "PatientReportId" = ANY(%s::uuid[])
+        """, (report_ids,))
+
+        rows = report_keyword_rows(results)
+        if rows:
+            execute_values(self.cursor, f"""
+                INSERT INTO "{self.schema}"."PatientReportKeyword" ("PatientReportId", "Keyword", "EntityLabel")
+                VALUES %s
+            """, rows, template="(%s::uuid, %s, %s)", page_size=1000)
+
+    # Both the display string and the structured rows, in the caller's transaction
+    def write_keywords(self, results):
+        self.insert_keywords_batch([
+            (str(report_id), ", ".join(keyword_texts(entities)))
+            for report_id, entities in results
+        ])
+        self.insert_report_keywords(results)
+
+    def find_reports_by_keyword(self, keyword, partial=False, limit=100):
+        """
+        Reports whose extracted keywords match keyword (case-insensitive).
+        partial=True matches substrings through the trigram index.
+        """
+        self.cursor.execute(f"""
+            SELECT *
+            FROM "{self.schema}".find_reports_by_keyword(%s, %s)
+            LIMIT %s
+        """, (keyword, partial, limit))
+        rows = self.cursor.fetchall()
+        self.conn.commit()
+        return rows
+
     # Process a single report
     def process_single_report(self, report_id):
-        report = self.fetch_single_report(report_id)
+        # Row stays locked until commit so other listeners skip it
+        with METRICS.time_stage("fetch"):
+            report = self.queue.claim_keyword_report(report_id)
         if not report:
-            print(f"[SKIP] Report {report_id} already processed or not found.")
+            self.conn.rollback()
+            print(f"[SKIP] Report {report_id} already processed, claimed elsewhere or not found.")
             return
 
-        keywords = self.extract_medical_keywords(report['Description'])
+        with METRICS.time_stage("nlp"):
+            entities = self.extract_medical_entities(report['Description'])
+        keywords = keyword_texts(entities)
         keywords_str = ", ".join(keywords)
         print(f"[DEBUG] Extracted keywords: {keywords}")
 
-        self.insert_keywords(report_id,keywords_str)
-        self.conn.commit()
+        with METRICS.time_stage("write"):
+            self.insert_keywords(report_id,keywords_str)
+            self.insert_report_keywords([(report_id, entities)])
+            self.conn.commit()
+        METRICS.observe_lag(report['CreatedAt'])
         print(f"[DONE] Processed report {report_id}")
 
+    # Process many reports with one fetch, one nlp.pipe pass and one UPDATE
+    def process_reports(self, report_ids):
+        report_ids = list(dict.fromkeys(str(r) for r in report_ids))
+        with METRICS.time_stage("fetch"):
+            reports = self.queue.claim_keyword_reports(report_ids)
+        if not reports:
+            self.conn.rollback()
+            print(f"[SKIP] No pending reports in batch of {len(report_ids)}.")
+            return 0
+
+        with METRICS.time_stage("nlp"):
+            entity_sets = self.extract_medical_entities_batch(r['Description'] for r in reports)
+        results = [
+            (str(report['PatientReportId']), entities)
+            for report, entities in zip(reports, entity_sets)
+        ]
+
+        with METRICS.time_stage("write"):
+            self.write_keywords(results)
+            self.conn.commit()
+        for report in reports:
+            METRICS.observe_lag(report['CreatedAt'])
+        print(f"[DONE] Processed {len(results)} report(s) in one batch ({len(report_ids) - len(results)} skipped)")
+        return len(results)
+
+    def model_version(self):
+        meta = self.nlp.meta
+        return f"{meta.get('name', 'unknown')}-{meta.get('version', 'unknown')}"
+
+    def _load_checkpoint(self, path, mode, since):
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            checkpoint = json.load(f)
+        # A different mode, filter or model means the old progress no longer applies
+        if (checkpoint.get('mode'), checkpoint.get('since'), checkpoint.get('model')) != (mode, since, self.model_version()):
+            print(f"⚠ Ignoring checkpoint {path}: it was written for a different run")
+            return None
+        return checkpoint
+
+    def _save_checkpoint(self, path, checkpoint):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, path)
+
+    # Re-extract keywords for existing reports outside the NOTIFY path
+    def backfill(self, mode="pending", since=None, chunk_size=1000, checkpoint_path=BACKFILL_CHECKPOINT, restart=False):
+        """
+        Stream descriptions through a server-side cursor and write keywords back in bulk.
+        mode 'pending' only fills reports without keywords; 'all' re-extracts every
+        report (e.g. after an NLP model upgrade). since limits to rows updated after it.
+        Progress is checkpointed after each chunk so a crashed run resumes where it stopped.
+        """
+        checkpoint = None if restart else self._load_checkpoint(checkpoint_path, mode, since)
+        if checkpoint is None:
+            checkpoint = {'mode': mode, 'since': since, 'model': self.model_version(), 'last_id': None, 'processed': 0}
+        else:
+            print(f"↻ Resuming backfill after report {checkpoint['last_id']} ({checkpoint['processed']} done)")
+
+        filters = ['"IsDeleted" = FALSE', '"Description" IS NOT NULL', '"Description" <> \'\'']
+        params = []
+        if mode == "pending":
+            filters.append('"Keywords" IS NULL')
+        if since:
+            filters.append('"UpdatedAt" >= %s')
+            params.append(since)
+        if checkpoint['last_id']:
+            filters.append('"PatientReportId" > %s::uuid')
+            params.append(checkpoint['last_id'])
+
+        # Separate connection: the named cursor must survive the per-chunk commits on self.conn
+        read_conn = psycopg2.connect(**DBConfig.get_connection_params())
+        read_cursor = read_conn.cursor(name="keyword_backfill")
+        read_cursor.itersize = chunk_size
+        read_cursor.execute(f"""
+            SELECT "PatientReportId", "Description"
+            FROM "{self.schema}"."PatientReport"
+            WHERE {' AND '.join(filters)}
+            ORDER BY "PatientReportId"
+        """, params)
+
+        def stream():
+            while True:
+                chunk = read_cursor.fetchmany(chunk_size)
+                if not chunk:
+                    return
+                cleaned = [(str(report_id), self.clean_description(d)) for report_id, d in chunk]
+                hashes = [description_hash(text) for _, text in cleaned]
+                cached = self.cache.get_many(hashes)
+                for (report_id, text), key in zip(cleaned, hashes):
+                    if key in cached:
+                        # Cache hit: an empty doc keeps pipe output in report order at no NLP cost
+                        yield "", (report_id, key, cached[key])
+                    else:
+                        yield text, (report_id, key, None)
+
+        # One nlp.pipe over the whole stream so worker processes are started only once
+        docs = self.nlp.pipe(stream(), as_tuples=True, batch_size=self.batch_size, n_process=self.n_process)
+
+        started = time.perf_counter()
+        run_processed = 0
+        rows = []
+        computed = {}
+
+        def flush():
+            nonlocal run_processed
+            self.cache.put_many(computed)
+            computed.clear()
+            self.write_keywords(rows)
+            self.conn.commit()
+            run_processed += len(rows)
+            checkpoint['last_id'] = rows[-1][0]
+            checkpoint['processed'] += len(rows)
+            self._save_checkpoint(checkpoint_path, checkpoint)
+            elapsed = time.perf_counter() - started
+            print(f"[BACKFILL] {checkpoint['processed']} reports written "
+                  f"({run_processed / elapsed:.1f} reports/sec)")
+            rows.clear()
+
+        try:
+            for doc, (report_id, key, entities) in docs:
+                if entities is None:
+                    entities = self.entities_from_doc(doc)
+                    computed[key] = entities
+                rows.append((report_id, entities))
+                if len(rows) >= chunk_size:
+                    flush()
+            if rows:
+                flush()
+        finally:
+            read_cursor.close()
+            read_conn.close()
+
+        elapsed = time.perf_counter() - started
+        rate = run_processed / elapsed if elapsed > 0 else 0.0
+        print(f"✓ Backfill complete: {run_processed} reports in {elapsed:.1f}s ({rate:.1f} reports/sec)")
+        print(f"✓ Keyword cache: {self.cache.hits} hits, {self.cache.misses} misses")
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        return run_processed
+
     def close(self):
         self.cursor.close()
-        self.conn.close()
+        if self.owns_conn:
+            self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Patient report keyword extraction")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    backfill_parser = subparsers.add_parser("backfill", help="(Re)extract keywords for existing PatientReport rows")
+    backfill_parser.add_argument("--mode", choices=["pending", "all"], default="pending",
+                                 help="'pending' fills missing keywords, 'all' re-extracts every report")
+    backfill_parser.add_argument("--since", default=None,
+                                 help="Only reports updated at or after this timestamp")
+    backfill_parser.add_argument("--chunk-size", type=int, default=1000,
+                                 help="Rows fetched and written per chunk")
+    backfill_parser.add_argument("--batch-size", type=int, default=NLP_BATCH_SIZE,
+                                 help="nlp.pipe batch size")
+    backfill_parser.add_argument("--processes", type=int, default=NLP_N_PROCESS,
+                                 help="Worker processes for NLP")
+    backfill_parser.add_argument("--checkpoint", default=BACKFILL_CHECKPOINT,
+                                 help="Checkpoint file used to resume a crashed run")
+    backfill_parser.add_argument("--restart", action="store_true",
+                                 help="Ignore any existing checkpoint")
+    args = parser.parse_args()
+
+    processor = Extract_keyword(batch_size=args.batch_size, n_process=args.processes)
+    try:
+        processor.backfill(
+            mode=args.mode,
+            since=args.since,
+            chunk_size=args.chunk_size,
+            checkpoint_path=args.checkpoint,
+            restart=args.restart
+        )
+    finally:
+        processor.close()
+
+
+if __name__ == "__main__":
+    main()
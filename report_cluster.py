@@ -0,0 +1,140 @@
+import os
+import socket
+import threading
+import uuid
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from db_config import DBConfig
+from report_metrics import METRICS
+
+# Run as one node of a partitioned group of listeners
+CLUSTER_ENABLED = os.getenv('NOTIFY_CLUSTER', 'false').lower() == 'true'
+HEARTBEAT_INTERVAL = float(os.getenv('NOTIFY_CLUSTER_HEARTBEAT', '5'))
+# A node that has not heartbeated for this long is considered gone
+NODE_TTL = float(os.getenv('NOTIFY_CLUSTER_NODE_TTL', '20'))
+
+# Partition key: the low 32 bits of the report UUID (random in v4 UUIDs).
+# Same value as partition_key() below, so scans can filter server-side.
+PARTITION_KEY_SQL = """(('x' || right(replace({column}::text, '-', ''), 8))::bit(32)::bigint)"""
+
+
+def partition_key(report_id):
+    return uuid.UUID(str(report_id)).int & 0xFFFFFFFF
+
+
+class ClusterMembership:
+    """
+    Node registry for running several listeners side by side.
+    Every node upserts itself into ReportProcessorNode and heartbeats; the live
+    nodes, sorted by id, split reports by partition_key(report_id) % node_count.
+    Each node only processes its own share of notifications and backlog, so adding
+    a node adds capacity instead of duplicate claim attempts. Row claims still use
+    SKIP LOCKED, so the brief overlap while membership changes cannot cause
+    double processing.
+    """
+    def __init__(self, node_id=None, heartbeat_interval=HEARTBEAT_INTERVAL, node_ttl=NODE_TTL, schema=None):
+        self.node_id = node_id or str(uuid.uuid4())
+        self.heartbeat_interval = heartbeat_interval
+        self.node_ttl = node_ttl
+        self.schema = schema or DBConfig.SCHEMA
+        self.lock = threading.Lock()
+        self.index = 0
+        self.count = 1
+        self.on_change = []
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.conn = None
+        METRICS.register_gauge('cluster_live_nodes', lambda: self.count)
+
+    @property
+    def partition(self):
+        """(index, node count) of this node's share"""
+        with self.lock:
+            return self.index, self.count
+
+    def owns(self, report_id):
+        index, count = self.partition
+        if count <= 1:
+            return True
+        try:
+            return partition_key(report_id) % count == index
+        except ValueError:
+            # Not a UUID: let the claim query decide
+            return True
+
+    def start(self):
+        DBConfig.validate()
+        self.conn = psycopg2.connect(**DBConfig.get_connection_params())
+        self.conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        self.cursor = self.conn.cursor(cursor_factory=RealDictCursor)
+        self.cursor.execute(f"""
+            INSERT INTO "{self.schema}"."ReportProcessorNode" ("NodeId", "Hostname", "Pid")
+            VALUES (%s, %s, %s)
+            ON CONFLICT ("NodeId") DO UPDATE
+            SET "LastHeartbeatAt" = NOW()
+        """, (self.node_id, socket.gethostname(), os.getpid()))
+        self.refresh()
+        self.thread = threading.Thread(target=self._run, name="cluster-heartbeat", daemon=True)
+        self.thread.start()
+
+    def refresh(self):
+        """Heartbeat, drop expired nodes and recompute this node's partition"""
+        self.cursor.execute(f"""
+            UPDATE "{self.schema}"."ReportProcessorNode"
+            SET "LastHeartbeatAt" = NOW()
+            WHERE "NodeId" = %s
+        """, (self.node_id,))
+        if self.cursor.rowcount == 0:
+            # Removed as expired (e.g. after a long pause): join again
+            self.cursor.execute(f"""
+                INSERT INTO "{self.schema}"."ReportProcessorNode" ("NodeId", "Hostname", "Pid")
+                VALUES (%s, %s, %s)
+            """, (self.node_id, socket.gethostname(), os.getpid()))
+        self.cursor.execute(f"""
+            DELETE FROM "{self.schema}"."ReportProcessorNode"
+            WHERE "LastHeartbeatAt" < NOW() - make_interval(secs => %s)
+        """, (self.node_ttl,))
+        self.cursor.execute(f"""
+            SELECT "NodeId"
+            FROM "{self.schema}"."ReportProcessorNode"
+            ORDER BY "NodeId"
+        """)
+        nodes = [str(row['NodeId']) for row in self.cursor.fetchall()]
+
+        with self.lock:
+            previous = (self.index, self.count)
+            self.count = max(1, len(nodes))
+            self.index = nodes.index(self.node_id) if self.node_id in nodes else 0
+            changed = (self.index, self.count) != previous
+
+        if changed:
+            print(f"[CLUSTER] Node {self.node_id[:8]} owns partition {self.index + 1}/{self.count}")
+            for callback in self.on_change:
+                callback()
+        return changed
+
+    def _run(self):
+        while not self.stop_event.wait(self.heartbeat_interval):
+            try:
+                self.refresh()
+            except psycopg2.Error as e:
+                print(f"[ERROR] Cluster heartbeat failed: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        if self.conn is None:
+            return
+        try:
+            # Leave straight away so the other nodes take over this share now, not after the TTL
+            self.cursor.execute(f"""
+                DELETE FROM "{self.schema}"."ReportProcessorNode"
+                WHERE "NodeId" = %s
+            """, (self.node_id,))
+        except psycopg2.Error as e:
+            print(f"[WARN] Could not deregister node {self.node_id}: {e}")
+        finally:
+            self.conn.close()
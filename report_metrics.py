@@ -0,0 +1,247 @@
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Stage latencies (seconds)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Notification-to-completion lag (seconds), measured from PatientReport.CreatedAt
+LAG_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 900, 1800, 3600, 4 * 3600, 24 * 3600)
+
+HELP = {
+    'report_stage_seconds': ('histogram', 'Time spent in each processing stage'),
+    'report_completion_lag_seconds': ('histogram', 'Seconds from PatientReport.CreatedAt until processing committed'),
+    'report_payloads_total': ('counter', 'Notification payloads handled by the worker pools'),
+    'report_payload_failures_total': ('counter', 'Notification payloads whose handler raised'),
+    'report_retries_total': ('counter', 'Failed reports re-queued after their backoff expired'),
+    'report_dead_letters_total': ('counter', 'Reports moved to the dead-letter table after exhausting retries'),
+    'report_worker_start_failures_total': ('counter', 'Worker processor start attempts that failed (retried with backoff)'),
+    'keyword_cache_lookups_total': ('counter', 'Keyword cache lookups by result'),
+    'report_queue_depth': ('gauge', 'Payloads waiting in a channel queue'),
+    'report_notifications_dropped_total': ('counter', 'Notifications left to the backlog scan because the queue was full'),
+    'report_notifications_skipped_total': ('counter', 'Notifications ignored because another cluster node owns the report'),
+    'cluster_live_nodes': ('gauge', 'Listener nodes currently heartbeating'),
+    'report_db_pool_connections': ('gauge', 'Connections in the async listener pool'),
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{str(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def quantile(self, q):
+        """Upper bucket bound containing the q-th observation (coarse, but cheap)"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        running = 0
+        for bound, n in zip(self.buckets, self.counts):
+            running += n
+            if running >= target:
+                return bound
+        return float('inf')
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters, gauges and histograms for the report listener.
+    The processing channel is tracked per thread, so processors can time
+    their stages without knowing which channel they serve.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.local = threading.local()
+
+    # --- channel context ---
+    def set_channel(self, channel):
+        self.local.channel = channel
+
+    @property
+    def channel(self):
+        return getattr(self.local, 'channel', 'none')
+
+    # --- recording ---
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=STAGE_BUCKETS, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def register_gauge(self, name, fn, **labels):
+        with self.lock:
+            self.gauges[(name, _label_key(labels))] = fn
+
+    # channel overrides the thread's channel (asyncio tasks share one thread)
+    @contextmanager
+    def time_stage(self, stage, channel=None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('report_stage_seconds', time.perf_counter() - started,
+                         channel=channel or self.channel, stage=stage)
+
+    def observe_lag(self, created_at, channel=None):
+        if created_at is None:
+            return
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        lag = (datetime.now(timezone.utc) - created_at).total_seconds()
+        self.observe('report_completion_lag_seconds', max(lag, 0.0), buckets=LAG_BUCKETS,
+                     channel=channel or self.channel)
+
+    # --- exposition ---
+    def render_prometheus(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {k: (h.buckets, list(h.counts), h.total, h.count) for k, h in self.histograms.items()}
+            gauges = dict(self.gauges)
+
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name in described:
+                return
+            described.add(name)
+            kind, text = HELP.get(name, ('untyped', name))
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, key), value in sorted(counters.items()):
+            describe(name)
+            lines.append(f"{name}{_format_labels(key)} {value}")
+
+        for (name, key), fn in sorted(gauges.items(), key=lambda item: item[0]):
+            describe(name)
+            try:
+                value = fn()
+            except Exception:
+                continue
+            lines.append(f"{name}{_format_labels(key)} {value}")
+
+        for (name, key), (buckets, counts, total, count) in sorted(histograms.items()):
+            describe(name)
+            running = 0
+            for bound, n in zip(buckets, counts):
+                running += n
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {running}")
+            lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{name}_count{_format_labels(key)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """One line per histogram/counter, for the periodic log"""
+        with self.lock:
+            histograms = list(self.histograms.items())
+            counters = list(self.counters.items())
+            gauges = list(self.gauges.items())
+
+        lines = []
+        for (name, key), histogram in sorted(histograms, key=lambda item: item[0]):
+            if not histogram.count:
+                continue
+            labels = " ".join(f"{k}={v}" for k, v in key)
+            lines.append(
+                f"  {name} {labels}: n={histogram.count} "
+                f"avg={histogram.total / histogram.count:.3f}s p95<={histogram.quantile(0.95)}s"
+            )
+        for (name, key), value in sorted(counters):
+            labels = " ".join(f"{k}={v}" for k, v in key)
+            lines.append(f"  {name} {labels}: {value}")
+        for (name, key), fn in sorted(gauges, key=lambda item: item[0]):
+            labels = " ".join(f"{k}={v}" for k, v in key)
+            try:
+                lines.append(f"  {name} {labels}: {fn()}")
+            except Exception:
+                pass
+        return "\n".join(lines)
+
+
+METRICS = MetricsRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = METRICS
+
+    def do_GET(self):
+        if self.path.rstrip('/') not in ('/metrics', ''):
+            self.send_error(404)
+            return
+        body = self.registry.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep scrapes out of the listener output
+        pass
+
+
+def start_metrics_server(port, host='127.0.0.1', registry=METRICS):
+    """
+    Serve the registry in Prometheus text format on http://host:port/metrics.
+    Returns None when the port cannot be bound (e.g. another listener on this host
+    already serves it); the listener keeps running without the endpoint.
+    """
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        print(f"⚠ Metrics endpoint disabled, could not bind {host}:{port}: {e}")
+        return None
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    print(f"✓ Metrics available at http://{host}:{port}/metrics")
+    return server
+
+
+def start_metrics_logger(interval, stop_event, registry=METRICS):
+    """Print a metrics summary every interval seconds until stop_event is set"""
+    def run():
+        while not stop_event.wait(interval):
+            summary = registry.summary()
+            if summary:
+                print(f"[METRICS]\n{summary}")
+
+    thread = threading.Thread(target=run, name="metrics-log", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,112 @@
+from db_config import DBConfig
+from report_cluster import PARTITION_KEY_SQL
+
+# Work still owed on a PatientReport row, derived purely from its columns
+KEYWORD_PENDING = """
+    "Keywords" IS NULL
+    AND "Description" IS NOT NULL
+    AND "Description" <> ''
+"""
+AUDIO_PENDING = """
+    "Keywords" IS NULL
+    AND "VoiceDirectory" IS NOT NULL
+    AND ("Description" IS NULL OR "Description" = '')
+"""
+
+# Reports the retry scheduler owns: dead-lettered, or failed and not yet due again
+HELD_FOR_RETRY = """
+    EXISTS (
+        SELECT 1 FROM "{schema}"."PatientReportDeadLetter" AS d
+        WHERE d."PatientReportId" = r."PatientReportId"
+    )
+    OR EXISTS (
+        SELECT 1 FROM "{schema}"."PatientReportProcessingState" AS s
+        WHERE s."PatientReportId" = r."PatientReportId"
+          AND s."NextRetryAt" > NOW()
+    )
+"""
+
+KIND_KEYWORD = "keyword"
+KIND_AUDIO = "audio"
+
+
+class ReportWorkQueue:
+    """
+    Durable work queue built on PatientReport state.
+    A row stays queued until its Keywords are written, so nothing is lost while
+    the listener is down. Claims use FOR UPDATE SKIP LOCKED, which lets several
+    listener processes drain the same backlog without double-processing.
+    """
+    def __init__(self, cursor, schema=None):
+        self.cursor = cursor
+        self.schema = schema or DBConfig.SCHEMA
+
+    def _claim(self, report_id, pending_sql):
+        self.cursor.execute(f"""
+            SELECT *
+            FROM "{self.schema}"."PatientReport"
+            WHERE "PatientReportId" = %s
+              AND "IsDeleted" = FALSE
+              AND {pending_sql}
+            FOR UPDATE SKIP LOCKED
+        """, (report_id,))
+        return self.cursor.fetchone()
+
+    def claim_keyword_report(self, report_id):
+        """Lock a report awaiting keyword extraction; None if done or claimed elsewhere"""
+        return self._claim(report_id, KEYWORD_PENDING)
+
+    def claim_keyword_reports(self, report_ids):
+        """Lock every pending report in report_ids in one query, skipping rows claimed elsewhere"""
+        self.cursor.execute(f"""
+            SELECT *
+            FROM "{self.schema}"."PatientReport"
+            WHERE "PatientReportId" = ANY(%s::uuid[])
+              AND "IsDeleted" = FALSE
+              AND {KEYWORD_PENDING}
+            FOR UPDATE SKIP LOCKED
+        """, (list(report_ids),))
+        return self.cursor.fetchall()
+
+    def claim_audio_report(self, report_id):
+        """Lock a voice report awaiting transcription; None if done or claimed elsewhere"""
+        return self._claim(report_id, AUDIO_PENDING)
+
+    def scan_pending(self, batch_size=500, partition=None):
+        """
+        Yield (kind, report_id, voice_path) for every report that still needs work.
+        Uses keyset pagination so a large backlog is never held in memory.
+        Reports waiting on a retry backoff or in the dead-letter table are skipped.
+        partition=(index, count) restricts the scan to one cluster node's share.
+        """
+        held_for_retry = HELD_FOR_RETRY.format(schema=self.schema)
+        partition_key = PARTITION_KEY_SQL.format(column='r."PatientReportId"')
+        index, count = partition or (0, 1)
+        last_id = None
+        while True:
+            self.cursor.execute(f"""
+                SELECT
+                    "PatientReportId",
+                    "VoiceDirectory",
+                    ({AUDIO_PENDING}) AS "NeedsAudio"
+                FROM "{self.schema}"."PatientReport" AS r
+                WHERE "IsDeleted" = FALSE
+                  AND "Keywords" IS NULL
+                  AND (({KEYWORD_PENDING}) OR ({AUDIO_PENDING}))
+                  AND NOT ({held_for_retry})
+                  AND (%s = 1 OR {partition_key} %% %s = %s)
+                  AND (%s::uuid IS NULL OR "PatientReportId" > %s::uuid)
+                ORDER BY "PatientReportId"
+                LIMIT %s
+            """, (count, count, index, last_id, last_id, batch_size))
+            rows = self.cursor.fetchall()
+            if not rows:
+                return
+
+            for row in rows:
+                report_id = str(row['PatientReportId'])
+                if row['NeedsAudio']:
+                    yield KIND_AUDIO, report_id, row['VoiceDirectory']
+                else:
+                    yield KIND_KEYWORD, report_id, None
+            last_id = str(rows[-1]['PatientReportId'])
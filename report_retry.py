@@ -0,0 +1,188 @@
+import argparse
+import os
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from db_config import DBConfig
+
+# Attempts before a report is moved to PatientReportDeadLetter
+RETRY_MAX_ATTEMPTS = int(os.getenv('REPORT_RETRY_MAX_ATTEMPTS', '5'))
+# Delay after the n-th failure is base * 2^(n-1) seconds, capped at max
+RETRY_BASE_DELAY = float(os.getenv('REPORT_RETRY_BASE_DELAY', '30'))
+RETRY_MAX_DELAY = float(os.getenv('REPORT_RETRY_MAX_DELAY', '3600'))
+# How long a retry handed to a worker is hidden from the scheduler before it is re-offered
+RETRY_LEASE = float(os.getenv('REPORT_RETRY_LEASE', '600'))
+# How long a report being processed stays leased to its worker; long enough to cover Whisper
+PROCESSING_LEASE = float(os.getenv('REPORT_PROCESSING_LEASE', '1800'))
+
+
+def backoff_seconds(attempt, base=RETRY_BASE_DELAY, cap=RETRY_MAX_DELAY):
+    """Exponential backoff delay after the given (1-based) failed attempt"""
+    return min(cap, base * (2 ** max(0, attempt - 1)))
+
+
+class ReportRetryStore:
+    """
+    Failure bookkeeping for the report listener.
+    PatientReportProcessingState holds the attempt count, last error and next retry
+    time of every report that failed; after max_attempts the report moves to
+    PatientReportDeadLetter until an operator re-drives it.
+    Writes join the caller's transaction.
+    """
+    def __init__(self, cursor, schema=None, max_attempts=RETRY_MAX_ATTEMPTS,
+                 base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+        self.cursor = cursor
+        self.schema = schema or DBConfig.SCHEMA
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def record_failure(self, report_id, channel, payload, error):
+        """
+        Count a failed attempt and schedule the next one.
+        Returns (attempt count, dead-lettered?).
+        """
+        self.cursor.execute(f"""
+            INSERT INTO "{self.schema}"."PatientReportProcessingState" AS s
+                ("PatientReportId", "Channel", "Payload", "AttemptCount", "LastError", "LastAttemptAt", "NextRetryAt")
+            VALUES (%(id)s, %(channel)s, %(payload)s, 1, %(error)s, NOW(), NOW() + make_interval(secs => %(base)s))
+            ON CONFLICT ("PatientReportId") DO UPDATE
+            SET "Channel" = EXCLUDED."Channel",
+                "Payload" = EXCLUDED."Payload",
+                "AttemptCount" = s."AttemptCount" + 1,
+                "LastError" = EXCLUDED."LastError",
+                "LastAttemptAt" = NOW(),
+                "NextRetryAt" = NOW() + make_interval(secs => LEAST(%(cap)s, %(base)s * POWER(2, s."AttemptCount"))),
+                "LeasedUntil" = NULL
+            RETURNING "AttemptCount"
+        """, {
+            'id': report_id,
+            'channel': channel,
+            'payload': payload,
+            'error': str(error)[:2000],
+            'base': self.base_delay,
+            'cap': self.max_delay,
+        })
+        attempts = self.cursor.fetchone()['AttemptCount']
+        if attempts < self.max_attempts:
+            return attempts, False
+
+        self.cursor.execute(f"""
+            WITH moved AS (
+                DELETE FROM "{self.schema}"."PatientReportProcessingState"
+                WHERE "PatientReportId" = %s
+                RETURNING *
+            )
+            INSERT INTO "{self.schema}"."PatientReportDeadLetter"
+                ("PatientReportId", "Channel", "Payload", "AttemptCount", "LastError")
+            SELECT "PatientReportId", "Channel", "Payload", "AttemptCount", "LastError"
+            FROM moved
+            ON CONFLICT ("PatientReportId") DO UPDATE
+            SET "Channel" = EXCLUDED."Channel",
+                "Payload" = EXCLUDED."Payload",
+                "AttemptCount" = EXCLUDED."AttemptCount",
+                "LastError" = EXCLUDED."LastError",
+                "DeadLetteredAt" = NOW()
+        """, (report_id,))
+        return attempts, True
+
+    def clear(self, report_ids):
+        """Forget failure history for reports that have now been handled"""
+        self.cursor.execute(f"""
+            DELETE FROM "{self.schema}"."PatientReportProcessingState"
+            WHERE "PatientReportId" = ANY(%(ids)s::uuid[]);
+            DELETE FROM "{self.schema}"."PatientReportDeadLetter"
+            WHERE "PatientReportId" = ANY(%(ids)s::uuid[]);
+        """, {'ids': list(report_ids)})
+
+    def claim_due(self, limit=50, lease_seconds=RETRY_LEASE):
+        """
+        Lease up to limit retries whose time has come.
+        Leased rows are pushed lease_seconds into the future, so a retry lost with a
+        crashed worker is offered again later; SKIP LOCKED keeps listeners apart.
+        """
+        self.cursor.execute(f"""
+            UPDATE "{self.schema}"."PatientReportProcessingState"
+            SET "NextRetryAt" = NOW() + make_interval(secs => %s)
+            WHERE "PatientReportId" IN (
+                SELECT "PatientReportId"
+                FROM "{self.schema}"."PatientReportProcessingState"
+                WHERE "NextRetryAt" <= NOW()
+                ORDER BY "NextRetryAt"
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING "PatientReportId", "Channel", "Payload", "AttemptCount"
+        """, (lease_seconds, limit))
+        return self.cursor.fetchall()
+
+    def release(self, report_ids):
+        """Make leased retries due again (e.g. the worker queue had no room)"""
+        self.cursor.execute(f"""
+            UPDATE "{self.schema}"."PatientReportProcessingState"
+            SET "NextRetryAt" = NOW()
+            WHERE "PatientReportId" = ANY(%s::uuid[])
+        """, (list(report_ids),))
+
+    def dead_letters(self):
+        self.cursor.execute(f"""
+            SELECT "PatientReportId", "Channel", "AttemptCount", "LastError", "DeadLetteredAt"
+            FROM "{self.schema}"."PatientReportDeadLetter"
+            ORDER BY "DeadLetteredAt"
+        """)
+        return self.cursor.fetchall()
+
+    def redrive(self, report_ids=None):
+        """
+        Move dead-lettered reports (all of them when report_ids is None) back into
+        the retry state with a fresh attempt budget, due immediately.
+        """
+        self.cursor.execute(f"""
+            WITH moved AS (
+                DELETE FROM "{self.schema}"."PatientReportDeadLetter"
+                WHERE %(ids)s::uuid[] IS NULL OR "PatientReportId" = ANY(%(ids)s::uuid[])
+                RETURNING *
+            )
+            INSERT INTO "{self.schema}"."PatientReportProcessingState"
+                ("PatientReportId", "Channel", "Payload", "AttemptCount", "LastError", "LastAttemptAt", "NextRetryAt")
+            SELECT "PatientReportId", "Channel", "Payload", 0, "LastError", NULL, NOW()
+            FROM moved
+            ON CONFLICT ("PatientReportId") DO UPDATE
+            SET "AttemptCount" = 0,
+                "NextRetryAt" = NOW()
+            RETURNING "PatientReportId"
+        """, {'ids': list(report_ids) if report_ids else None})
+        return [str(row['PatientReportId']) for row in self.cursor.fetchall()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Patient report retry and dead-letter queue")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("list", help="Show dead-lettered reports")
+    redrive_parser = subparsers.add_parser("redrive", help="Send dead-lettered reports back to the listener")
+    redrive_parser.add_argument("--report-id", action="append", default=None,
+                                help="Report to re-drive (repeatable); default is every dead-lettered report")
+    args = parser.parse_args()
+
+    DBConfig.validate()
+    conn = psycopg2.connect(**DBConfig.get_connection_params())
+    try:
+        store = ReportRetryStore(conn.cursor(cursor_factory=RealDictCursor))
+        if args.command == "list":
+            rows = store.dead_letters()
+            for row in rows:
+                print(f"{row['PatientReportId']}  {row['Channel']}  attempts={row['AttemptCount']}  "
+                      f"at {row['DeadLetteredAt']:%Y-%m-%d %H:%M:%S}  {row['LastError']}")
+            print(f"✓ {len(rows)} dead-lettered report(s)")
+        else:
+            redriven = store.redrive(args.report_id)
+            conn.commit()
+            print(f"✓ Re-driven {len(redriven)} report(s); running listeners will retry them shortly")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
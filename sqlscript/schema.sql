@@ -8,6 +8,7 @@ SET
 	PUBLIC;
 
 CREATE EXTENSION IF NOT EXISTS pgcrypto;
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
 -- ----------------------------------------------------
 --  TRIGGER FUNCTION (Utility Function)
 -- ----------------------------------------------------
@@ -720,6 +721,7 @@ CREATE TABLE IF NOT EXISTS "SIGMAmed"."MedicationAdherenceRecord" (
 	"DoseQuantity" DECIMAL(5, 2) NULL,
 	"ScheduledTime" TIMESTAMPTZ NOT NULL,
 	"ActionTime" TIMESTAMPTZ DEFAULT NOW(),
+	"UpdatedAt" TIMESTAMPTZ DEFAULT NOW(),
 	"CreatedAt" TIMESTAMPTZ DEFAULT NOW()
 );
 
@@ -762,6 +764,85 @@ CREATE TABLE IF NOT EXISTS "SIGMAmed"."AppointmentReminder" (
 	"CreatedAt" TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- Table 19: Keyword Extraction Cache (NLP results keyed by description hash)
+CREATE TABLE IF NOT EXISTS "SIGMAmed"."KeywordExtractionCache" (
+	"PipelineVersion" VARCHAR(64) NOT NULL,
+	"DescriptionHash" CHAR(64) NOT NULL,
+	"Keywords" JSONB NOT NULL DEFAULT '[]'::JSONB,
+	"CreatedAt" TIMESTAMPTZ DEFAULT NOW(),
+	PRIMARY KEY ("PipelineVersion", "DescriptionHash")
+);
+
+-- Table 20: Patient Report Keyword (normalized keywords extracted from PatientReport)
+CREATE TABLE IF NOT EXISTS "SIGMAmed"."PatientReportKeyword" (
+	"PatientReportId" UUID NOT NULL REFERENCES "SIGMAmed"."PatientReport" ("PatientReportId") ON DELETE CASCADE,
+	"Keyword" VARCHAR(255) NOT NULL,
+	"EntityLabel" VARCHAR(50) NULL,
+	"CreatedAt" TIMESTAMPTZ DEFAULT NOW(),
+	PRIMARY KEY ("PatientReportId", "Keyword")
+);
+
+-- Table 21: Audio Transcript Cache (Whisper output keyed by audio content hash)
+CREATE TABLE IF NOT EXISTS "SIGMAmed"."AudioTranscriptCache" (
+	"AudioHash" CHAR(64) NOT NULL,
+	"ModelSize" VARCHAR(20) NOT NULL,
+	"Transcript" TEXT NOT NULL,
+	"VoiceDirectory" TEXT NULL,
+	"FileSize" BIGINT NULL,
+	"FileMtime" DOUBLE PRECISION NULL,
+	"CreatedAt" TIMESTAMPTZ DEFAULT NOW(),
+	PRIMARY KEY ("AudioHash", "ModelSize")
+);
+
+-- Table 22: Patient Report Processing State (retry bookkeeping and in-flight leases for listener work)
+CREATE TABLE IF NOT EXISTS "SIGMAmed"."PatientReportProcessingState" (
+	"PatientReportId" UUID PRIMARY KEY REFERENCES "SIGMAmed"."PatientReport" ("PatientReportId") ON DELETE CASCADE,
+	"Channel" VARCHAR(64) NOT NULL,
+	"Payload" TEXT NOT NULL,
+	"AttemptCount" INT NOT NULL DEFAULT 0,
+	"LastError" TEXT NULL,
+	"LastAttemptAt" TIMESTAMPTZ NULL,
+	"NextRetryAt" TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+	"LeasedUntil" TIMESTAMPTZ NULL
+);
+
+-- Table 23: Patient Report Dead Letter (reports that exhausted their retries)
+CREATE TABLE IF NOT EXISTS "SIGMAmed"."PatientReportDeadLetter" (
+	"PatientReportId" UUID PRIMARY KEY REFERENCES "SIGMAmed"."PatientReport" ("PatientReportId") ON DELETE CASCADE,
+	"Channel" VARCHAR(64) NOT NULL,
+	"Payload" TEXT NOT NULL,
+	"AttemptCount" INT NOT NULL,
+	"LastError" TEXT NULL,
+	"DeadLetteredAt" TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Table 24: Report Processor Node (listener nodes sharing report processing)
+CREATE TABLE IF NOT EXISTS "SIGMAmed"."ReportProcessorNode" (
+	"NodeId" VARCHAR(64) PRIMARY KEY,
+	"Hostname" VARCHAR(255) NULL,
+	"Pid" INT NULL,
+	"StartedAt" TIMESTAMPTZ DEFAULT NOW(),
+	"LastHeartbeatAt" TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Table 25: Compliance Job Watermark (last change time processed by incremental analysis)
+CREATE TABLE IF NOT EXISTS "SIGMAmed"."ComplianceJobWatermark" (
+	"JobName" VARCHAR(100) PRIMARY KEY,
+	"HighWaterMark" TIMESTAMPTZ NOT NULL,
+	"UpdatedAt" TIMESTAMPTZ DEFAULT NOW()
+);
+
+-- Table 26: Compliance Window State (trailing violations per patient medication between runs)
+CREATE TABLE IF NOT EXISTS "SIGMAmed"."ComplianceWindowState" (
+	"PatientId" UUID NOT NULL REFERENCES "SIGMAmed"."Patient" ("UserId") ON DELETE CASCADE,
+	"PrescribedMedicationId" UUID NOT NULL REFERENCES "SIGMAmed"."PrescribedMedication" ("PrescribedMedicationId") ON DELETE CASCADE,
+	"RecentViolations" TIMESTAMPTZ[] NOT NULL DEFAULT '{}',
+	"LastScheduledTime" TIMESTAMPTZ NOT NULL,
+	"LastChangedAt" TIMESTAMPTZ NULL,
+	"UpdatedAt" TIMESTAMPTZ DEFAULT NOW(),
+	PRIMARY KEY ("PatientId", "PrescribedMedicationId")
+);
+
 -- ----------------------------------------------------
 -- 5. APPLY TRIGGERS (Must be last)
 -- ----------------------------------------------------
@@ -865,6 +946,11 @@ BEFORE UPDATE ON "SIGMAmed"."PrescribedMedicationSchedule"
 FOR EACH ROW
 EXECUTE FUNCTION public.set_updated_at_timestamp();
 
+CREATE TRIGGER set_updated_at_MedicationAdherenceRecord
+BEFORE UPDATE ON "SIGMAmed"."MedicationAdherenceRecord"
+FOR EACH ROW
+EXECUTE FUNCTION public.set_updated_at_timestamp();
+
 CREATE TRIGGER set_updated_at_PatientReport
 BEFORE UPDATE ON "SIGMAmed"."PatientReport"
 FOR EACH ROW
@@ -1001,6 +1087,7 @@ GRANT SELECT ON TABLE "SIGMAmed"."MedicalHistory" TO sigmamed_hospital_admin;
 GRANT SELECT ON TABLE "SIGMAmed"."PatientSymptom" TO sigmamed_hospital_admin;
 GRANT SELECT ON TABLE "SIGMAmed"."PatientSideEffect" TO sigmamed_hospital_admin;
 GRANT SELECT ON TABLE "SIGMAmed"."PatientReport" TO sigmamed_hospital_admin;
+GRANT SELECT ON TABLE "SIGMAmed"."PatientReportKeyword" TO sigmamed_hospital_admin;
 GRANT SELECT ON TABLE "SIGMAmed"."AuditLog" TO sigmamed_hospital_admin;
 GRANT USAGE ON ALL SEQUENCES IN SCHEMA "SIGMAmed" TO sigmamed_hospital_admin;
 GRANT USAGE ON SCHEMA "SIGMAmed" TO sigmamed_hospital_admin;
@@ -1021,6 +1108,7 @@ GRANT SELECT, INSERT, UPDATE, DELETE ON TABLE "SIGMAmed"."MedicalHistory" TO sig
 GRANT SELECT, INSERT, UPDATE, DELETE ON TABLE "SIGMAmed"."PatientSymptom" TO sigmamed_doctor;
 GRANT SELECT, INSERT, UPDATE, DELETE ON TABLE "SIGMAmed"."PatientSideEffect" TO sigmamed_doctor;
 GRANT SELECT, INSERT, UPDATE, DELETE ON TABLE "SIGMAmed"."PatientReport" TO sigmamed_doctor;
+GRANT SELECT ON TABLE "SIGMAmed"."PatientReportKeyword" TO sigmamed_doctor;
 GRANT SELECT ON TABLE "SIGMAmed"."AuditLog" TO sigmamed_doctor;
 GRANT USAGE ON ALL SEQUENCES IN SCHEMA "SIGMAmed" TO sigmamed_doctor;
 GRANT USAGE ON SCHEMA "SIGMAmed" TO sigmamed_doctor;
@@ -1135,6 +1223,7 @@ ALTER TABLE "SIGMAmed"."MedicalHistory" ENABLE ROW LEVEL SECURITY;
 ALTER TABLE "SIGMAmed"."PatientSymptom" ENABLE ROW LEVEL SECURITY;
 ALTER TABLE "SIGMAmed"."PatientSideEffect" ENABLE ROW LEVEL SECURITY;
 ALTER TABLE "SIGMAmed"."PatientReport" ENABLE ROW LEVEL SECURITY;
+ALTER TABLE "SIGMAmed"."PatientReportKeyword" ENABLE ROW LEVEL SECURITY;
 ALTER TABLE "SIGMAmed"."AuditLog" ENABLE ROW LEVEL SECURITY;
 
 ALTER TABLE "SIGMAmed"."User" FORCE ROW LEVEL SECURITY;
@@ -1937,6 +2026,33 @@ CREATE POLICY patient_report_update ON "SIGMAmed"."PatientReport"
     USING ("PatientId" = "SIGMAmed".current_user_id())
     WITH CHECK ("PatientId" = "SIGMAmed".current_user_id());
 
+-- PatientReportKeyword (visible only where the parent report is, under the caller's PatientReport policies)
+CREATE POLICY superadmin_report_keyword_all ON "SIGMAmed"."PatientReportKeyword"
+    FOR ALL
+    TO sigmamed_superadmin
+    USING (true)
+    WITH CHECK (true);
+
+CREATE POLICY hospital_admin_report_keyword_select ON "SIGMAmed"."PatientReportKeyword"
+    FOR SELECT
+    TO sigmamed_hospital_admin
+    USING (
+        EXISTS (
+            SELECT 1 FROM "SIGMAmed"."PatientReport" pr
+            WHERE pr."PatientReportId" = "PatientReportKeyword"."PatientReportId"
+        )
+    );
+
+CREATE POLICY doctor_report_keyword_select ON "SIGMAmed"."PatientReportKeyword"
+    FOR SELECT
+    TO sigmamed_doctor
+    USING (
+        EXISTS (
+            SELECT 1 FROM "SIGMAmed"."PatientReport" pr
+            WHERE pr."PatientReportId" = "PatientReportKeyword"."PatientReportId"
+        )
+    );
+
 -- AuditLog
 CREATE POLICY superadmin_audit_all ON "SIGMAmed"."AuditLog"
     FOR SELECT
@@ -2068,6 +2184,138 @@ WHERE PM."IsDeleted" = FALSE
   AND P."IsDeleted" = FALSE 
   AND U."IsDeleted" = FALSE;
 
+-- Side-effect rollups for the Kinetica export and dashboards.
+-- Refresh with REFRESH MATERIALIZED VIEW CONCURRENTLY (needs the unique indexes below).
+CREATE MATERIALIZED VIEW IF NOT EXISTS "SIGMAmed"."SideEffectsByMedicationRollup" AS
+SELECT
+    PM."MedicationId",
+    PM."MedicationNameSnapshot" AS "MedicationName",
+    PSE."SideEffectName",
+    PSE."Severity",
+    COUNT(*) AS "ReportCount",
+    COUNT(DISTINCT P."PatientId") AS "PatientCount",
+    MAX(PSE."OnsetDate") AS "LastReported"
+FROM "SIGMAmed"."PatientSideEffect" AS PSE
+INNER JOIN "SIGMAmed"."PrescribedMedication" AS PM
+    ON PSE."PrescribedMedicationId" = PM."PrescribedMedicationId"
+INNER JOIN "SIGMAmed"."Prescription" AS P
+    ON PM."PrescriptionId" = P."PrescriptionId"
+WHERE PSE."IsDeleted" = FALSE
+  AND PM."IsDeleted" = FALSE
+  AND P."IsDeleted" = FALSE
+GROUP BY PM."MedicationId", PM."MedicationNameSnapshot", PSE."SideEffectName", PSE."Severity";
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS "SIGMAmed"."SideEffectsByPatientRollup" AS
+SELECT
+    P."PatientId",
+    CONCAT(U."FirstName", ' ', U."LastName") AS "PatientName",
+    U."Username" AS "PatientUsername",
+    COUNT(*) AS "ReportCount",
+    COUNT(DISTINCT PSE."SideEffectName") AS "UniqueSideEffects",
+    MAX(PSE."OnsetDate") AS "LastReported",
+    STRING_AGG(DISTINCT PM."MedicationNameSnapshot", ', ' ORDER BY PM."MedicationNameSnapshot") AS "Medications"
+FROM "SIGMAmed"."PatientSideEffect" AS PSE
+INNER JOIN "SIGMAmed"."PrescribedMedication" AS PM
+    ON PSE."PrescribedMedicationId" = PM."PrescribedMedicationId"
+INNER JOIN "SIGMAmed"."Prescription" AS P
+    ON PM."PrescriptionId" = P."PrescriptionId"
+INNER JOIN "SIGMAmed"."User" AS U
+    ON P."PatientId" = U."UserId"
+WHERE PSE."IsDeleted" = FALSE
+  AND PM."IsDeleted" = FALSE
+  AND P."IsDeleted" = FALSE
+GROUP BY P."PatientId", U."FirstName", U."LastName", U."Username";
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS "SIGMAmed"."TopSideEffectsRollup" AS
+WITH Counted AS (
+    SELECT
+        PSE."SideEffectName",
+        PM."MedicationNameSnapshot" AS "MedicationName",
+        COUNT(*) AS "ReportCount"
+    FROM "SIGMAmed"."PatientSideEffect" AS PSE
+    INNER JOIN "SIGMAmed"."PrescribedMedication" AS PM
+        ON PSE."PrescribedMedicationId" = PM."PrescribedMedicationId"
+    INNER JOIN "SIGMAmed"."Prescription" AS P
+        ON PM."PrescriptionId" = P."PrescriptionId"
+    WHERE PSE."IsDeleted" = FALSE
+      AND PM."IsDeleted" = FALSE
+      AND P."IsDeleted" = FALSE
+    GROUP BY PSE."SideEffectName", PM."MedicationNameSnapshot"
+),
+Ranked AS (
+    SELECT
+        "SideEffectName",
+        "MedicationName",
+        "ReportCount",
+        SUM("ReportCount") OVER (PARTITION BY "SideEffectName") AS "TotalReports",
+        ROW_NUMBER() OVER (PARTITION BY "SideEffectName" ORDER BY "ReportCount" DESC, "MedicationName") AS "Rank"
+    FROM Counted
+)
+SELECT
+    "SideEffectName",
+    "TotalReports",
+    "MedicationName" AS "TopMedication",
+    "ReportCount" AS "TopMedicationReportCount"
+FROM Ranked
+WHERE "Rank" = 1;
+
+COMMENT ON MATERIALIZED VIEW "SIGMAmed"."TopSideEffectsRollup" IS 'Report totals per side effect with the medication it is most often reported against.';
+
+-- The rollups are created after the GRANT block above, so they need their own grants.
+-- Materialized views bypass row-level security: only the rollups without patient
+-- identities are readable by the dashboard roles.
+GRANT SELECT ON "SIGMAmed"."SideEffectsByMedicationRollup" TO sigmamed_superadmin, sigmamed_hospital_admin, sigmamed_doctor;
+GRANT SELECT ON "SIGMAmed"."TopSideEffectsRollup" TO sigmamed_superadmin, sigmamed_hospital_admin, sigmamed_doctor;
+GRANT SELECT ON "SIGMAmed"."SideEffectsByPatientRollup" TO sigmamed_superadmin;
+
+-- FUNCTION: Find patient reports by extracted keyword (doctor dashboards)
+CREATE OR REPLACE FUNCTION "SIGMAmed".find_reports_by_keyword(
+    p_keyword TEXT,
+    p_partial BOOLEAN DEFAULT FALSE
+)
+RETURNS TABLE (
+    "PatientReportId" UUID,
+    "PatientId" UUID,
+    "DoctorId" UUID,
+    "Type" "SIGMAmed".patient_report_status_enum,
+    "Severity" "SIGMAmed".severity_enum,
+    "MatchedKeyword" VARCHAR(255),
+    "EntityLabel" VARCHAR(50),
+    "Keywords" TEXT,
+    "CreatedAt" TIMESTAMPTZ
+) AS $$
+#variable_conflict use_column
+DECLARE
+    v_keyword TEXT := LOWER(REGEXP_REPLACE(TRIM(p_keyword), '\s+', ' ', 'g'));
+    -- Partial matches treat % and _ in the search text literally (backslash is LIKE's escape)
+    v_pattern TEXT := '%' || REPLACE(REPLACE(REPLACE(v_keyword, '\', '\\'), '%', '\%'), '_', '\_') || '%';
+BEGIN
+    -- Exact match uses the btree index, partial match the trigram index
+    RETURN QUERY
+    SELECT
+        PR."PatientReportId",
+        PR."PatientId",
+        PR."DoctorId",
+        PR."Type",
+        PR."Severity",
+        PRK."Keyword",
+        PRK."EntityLabel",
+        PR."Keywords",
+        PR."CreatedAt"
+    FROM "SIGMAmed"."PatientReportKeyword" AS PRK
+    INNER JOIN "SIGMAmed"."PatientReport" AS PR
+        ON PR."PatientReportId" = PRK."PatientReportId"
+    WHERE PR."IsDeleted" = FALSE
+      AND (
+          (NOT p_partial AND PRK."Keyword" = v_keyword)
+          OR (p_partial AND PRK."Keyword" LIKE v_pattern)
+      )
+    ORDER BY PR."CreatedAt" DESC;
+END;
+$$ LANGUAGE PLPGSQL STABLE;
+
+COMMENT ON FUNCTION "SIGMAmed".find_reports_by_keyword IS 'Find patient reports whose extracted keywords match a symptom or term.';
+
 
 -- ClinicalInstitution Indexes
 CREATE INDEX idx_clinical_institution_name ON "SIGMAmed"."ClinicalInstitution"("ClinicalInstitutionName") WHERE "IsDeleted" = FALSE;
@@ -2081,13 +2329,19 @@ CREATE INDEX idx_medication_name ON "SIGMAmed"."Medication"("MedicationName") WH
 -- Prescription Indexes
 CREATE INDEX idx_prescription_number ON "SIGMAmed"."Prescription"("PrescriptionNumber") WHERE "IsDeleted" = FALSE; 
 CREATE INDEX idx_prescription_patient_date ON "SIGMAmed"."Prescription"("PatientId","PrescribedDate") WHERE "IsDeleted" = FALSE; 
+CREATE INDEX idx_prescription_changed_at ON "SIGMAmed"."Prescription"((GREATEST("UpdatedAt", "CreatedAt")));
 
 -- PrescribedMedication Indexes 
 CREATE INDEX idx_prescribed_medication_prescription ON "SIGMAmed"."PrescribedMedication"("PrescriptionId") WHERE "IsDeleted" = FALSE;
 CREATE INDEX idx_prescribed_medication_status ON "SIGMAmed"."PrescribedMedication"("MedicationId","PrescriptionId","Status") WHERE "IsDeleted" = FALSE;
+CREATE INDEX idx_prescribed_medication_changed_at ON "SIGMAmed"."PrescribedMedication"((GREATEST("UpdatedAt", "CreatedAt")));
+
+-- PatientSideEffect Indexes
+CREATE INDEX idx_side_effect_changed_at ON "SIGMAmed"."PatientSideEffect"((GREATEST("UpdatedAt", "CreatedAt")));
 
 -- MedicationAdherenceRecord Indexes
 CREATE INDEX idx_adherence_schedule ON "SIGMAmed"."MedicationAdherenceRecord"("ScheduledTime", "PrescribedMedicationScheduleId");
+CREATE INDEX idx_adherence_changed_at ON "SIGMAmed"."MedicationAdherenceRecord"((GREATEST("UpdatedAt", "CreatedAt")));
 
 -- PrescribedMedicationSchedule Indexes
 CREATE INDEX idx_prescribed_schedule_medication ON "SIGMAmed"."PrescribedMedicationSchedule"("PrescribedMedicationId"); 
@@ -2095,6 +2349,22 @@ CREATE INDEX idx_prescribed_schedule_medication ON "SIGMAmed"."PrescribedMedicat
 -- PatientReport Indexes
 CREATE INDEX idx_report_patient_time ON "SIGMAmed"."PatientReport"("PatientId","CreatedAt") WHERE "IsDeleted" = FALSE;
 CREATE INDEX idx_report_doctor ON "SIGMAmed"."PatientReport"("DoctorId") WHERE "IsDeleted" = FALSE;
+CREATE INDEX idx_report_pending_keywords ON "SIGMAmed"."PatientReport"("PatientReportId") WHERE "Keywords" IS NULL AND "IsDeleted" = FALSE;
+
+-- PatientReportKeyword Indexes
+CREATE INDEX idx_report_keyword ON "SIGMAmed"."PatientReportKeyword"("Keyword");
+CREATE INDEX idx_report_keyword_trgm ON "SIGMAmed"."PatientReportKeyword" USING GIN ("Keyword" gin_trgm_ops);
+
+-- AudioTranscriptCache Indexes
+CREATE INDEX idx_audio_transcript_path ON "SIGMAmed"."AudioTranscriptCache"("VoiceDirectory", "ModelSize");
+
+-- PatientReportProcessingState Indexes
+CREATE INDEX idx_report_processing_next_retry ON "SIGMAmed"."PatientReportProcessingState"("NextRetryAt");
+
+-- Side-effect rollup Indexes (unique, so the views can be refreshed concurrently)
+CREATE UNIQUE INDEX idx_side_effects_by_medication_rollup ON "SIGMAmed"."SideEffectsByMedicationRollup"("MedicationId", "MedicationName", "SideEffectName", "Severity");
+CREATE UNIQUE INDEX idx_side_effects_by_patient_rollup ON "SIGMAmed"."SideEffectsByPatientRollup"("PatientId");
+CREATE UNIQUE INDEX idx_top_side_effects_rollup ON "SIGMAmed"."TopSideEffectsRollup"("SideEffectName");
 
 -- PatientCareTeam Indexes
 CREATE INDEX idx_care_patient ON "SIGMAmed"."PatientCareTeam"("PatientId","IsActive") WHERE "IsDeleted" = FALSE;
@@ -0,0 +1,102 @@
+import types
+import uuid
+from datetime import datetime, date
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import kinetica_writer
+from kinetica_writer import KineticaIngestError, KineticaWriter, LocalKineticaWriter, to_record_value
+
+
+class FakeColumn:
+    def __init__(self, name, column_type, properties=()):
+        self.name = name
+        self.column_type = column_type
+        self.column_properties = list(properties)
+
+
+COLUMNS = [FakeColumn('alert_id', 'string', ['primary_key']), FakeColumn('violation_count', 'long')]
+
+
+def fake_gpudb(fail_on=None, multihead_error=None):
+    """gpudb stand-in whose tables fail insert_records for records with alert_id in fail_on"""
+    inserted = []
+
+    class FakeTable:
+        def __init__(self, _type, name, db, **options):
+            self.name = name
+            self.multihead = options.get('use_multihead_ingest', False)
+
+        def get_table_type(self):
+            return types.SimpleNamespace(columns=COLUMNS)
+
+        def insert_records(self, records, options=None):
+            if self.multihead and multihead_error is not None:
+                raise multihead_error
+            if fail_on and any(r['alert_id'] in fail_on for r in records):
+                raise RuntimeError("insert rejected")
+            inserted.extend(records)
+
+        def flush_data_to_server(self):
+            pass
+
+    return types.SimpleNamespace(GPUdbTable=FakeTable), inserted
+
+
+def test_to_record_value_coerces_to_column_types():
+    assert to_record_value(np.int64(7), 'long') == 7
+    assert isinstance(to_record_value(np.int64(7), 'long'), int)
+    assert to_record_value(Decimal('1.25'), 'double') == 1.25
+    assert to_record_value(uuid.UUID(int=1), 'string') == '00000000-0000-0000-0000-000000000001'
+    assert to_record_value(date(2024, 1, 2), 'string', ('date',)) == '2024-01-02'
+    assert to_record_value(datetime(2024, 1, 2, 3, 4, 5), 'string', ('datetime',)) == '2024-01-02 03:04:05'
+    assert to_record_value(None, 'long') is None
+
+
+def test_to_record_value_keeps_wall_clock_for_timestamps():
+    # The UTC offset is dropped, as with the earlier SQL literals
+    expected = int((datetime(2024, 1, 2, 3, 4, 5) - datetime(1970, 1, 1)).total_seconds() * 1000)
+    assert to_record_value(pd.Timestamp('2024-01-02 03:04:05+08:00'), 'long', ('timestamp',)) == expected
+    assert to_record_value('2024-01-02T03:04:05', 'long', ('timestamp',)) == expected
+
+
+def test_local_writer_upserts_on_existing_primary_key():
+    writer = LocalKineticaWriter(primary_keys={'alerts': ['alert_id']})
+    writer.insert('alerts', [{'alert_id': 'a', 'violation_count': 6}, {'alert_id': 'b', 'violation_count': 6}])
+
+    writer.insert('alerts', [{'alert_id': 'a', 'violation_count': 9}])
+    assert {r['alert_id']: r['violation_count'] for r in writer.rows('alerts')} == {'a': 6, 'b': 6}
+
+    writer.insert('alerts', [{'alert_id': 'a', 'violation_count': 9}], update_on_existing_pk=True)
+    assert {r['alert_id']: r['violation_count'] for r in writer.rows('alerts')} == {'a': 9, 'b': 6}
+
+
+def test_ingest_error_reports_records_written(monkeypatch):
+    fake, inserted = fake_gpudb(fail_on={'r3'})
+    monkeypatch.setattr(kinetica_writer, 'gpudb', fake)
+    writer = KineticaWriter(object(), batch_size=2, flush_workers=2, multihead=False)
+    rows = [{'alert_id': f'r{i}', 'violation_count': i} for i in range(6)]
+
+    with pytest.raises(KineticaIngestError) as excinfo:
+        writer.insert('alerts', rows)
+
+    # r2 and r3 share the failed batch; the other two batches went in
+    assert excinfo.value.written == 4
+    assert excinfo.value.table == 'alerts'
+    assert len(excinfo.value.errors) == 1
+    assert sorted(r['alert_id'] for r in inserted) == ['r0', 'r1', 'r4', 'r5']
+
+
+def test_multihead_failure_raises_ingest_error(monkeypatch):
+    fake, _ = fake_gpudb(multihead_error=RuntimeError("worker rank unreachable"))
+    monkeypatch.setattr(kinetica_writer, 'gpudb', fake)
+    writer = KineticaWriter(object(), multihead=True)
+
+    with pytest.raises(KineticaIngestError) as excinfo:
+        writer.insert('alerts', [{'alert_id': 'a', 'violation_count': 1}])
+
+    assert excinfo.value.written == 0
+    assert isinstance(excinfo.value.errors[0], RuntimeError)
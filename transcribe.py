@@ -1,21 +1,33 @@
-import whisper
 import os
 import psycopg2
 from db_config import DBConfig
 from psycopg2.extras import RealDictCursor
+from report_queue import ReportWorkQueue
+from transcription_engine import get_engine
+from transcript_cache import TranscriptCache
+from patient_report import Extract_keyword, keyword_texts
+from report_metrics import METRICS
 from datetime import datetime
 
+# Extract keywords right after transcription instead of waiting for report_ready_for_processing
+TRANSCRIBE_EXTRACT_KEYWORDS = os.getenv('TRANSCRIBE_EXTRACT_KEYWORDS', 'true').lower() == 'true'
+
 
 class transcribe_audio:
-    def __init__(self):
-        self.MODEL_SIZE = "base"
-        self.MODEL = None
+    def __init__(self, extract_keywords=TRANSCRIBE_EXTRACT_KEYWORDS):
+        # Chunked engine shared by every worker; model size and workers come from env
+        self.engine = get_engine()
+        self.MODEL_SIZE = self.engine.model_size
         try:
             DBConfig.validate()
             self.conn = psycopg2.connect(**DBConfig.get_connection_params())
             self.conn.autocommit = False
             self.cursor = self.conn.cursor(cursor_factory=RealDictCursor)
             self.schema = DBConfig.SCHEMA
+            self.queue = ReportWorkQueue(self.cursor, self.schema)
+            self.cache = TranscriptCache(self.cursor, self.MODEL_SIZE, self.schema)
+            # Shares this connection so transcript and keywords commit together
+            self.keyword_processor = Extract_keyword(conn=self.conn) if extract_keywords else None
             print(f"✓ Connected to database: {DBConfig.NAME}")
             print(f"✓ Using schema: {self.schema}")
         except Exception as e:
@@ -30,24 +42,74 @@ class transcribe_audio:
         """
         self.cursor.execute(sql, (transcript_text, report_id))
         self.conn.commit()
-        
+
+    # Description and Keywords in one UPDATE and one commit. Keywords is already set when
+    # the trigger runs, so notify_extract_keyword sends no second notification
+    def save_transcript_with_keywords(self, report_id, transcript_text, entities):
+        keywords = ", ".join(keyword_texts(entities))
+        self.cursor.execute(f"""
+            UPDATE "{self.schema}"."PatientReport"
+            SET "Description" = %s,
+                "Keywords" = %s
+            WHERE "PatientReportId" = %s
+        """, (transcript_text, keywords, report_id))
+        self.keyword_processor.insert_report_keywords([(report_id, entities)])
+        self.conn.commit()
+
     # Core transcription function
     def run_transcriber_system(self,audio_path,report_id):
         """Loads model, transcribes, and saves result to the database."""
-        
-        # Load model once if it hasn't been loaded yet (Optimized for multiple runs)
-        if self.MODEL is None:
-            print(f"Loading Whisper model '{self.MODEL_SIZE}'...")
-            self.MODEL = whisper.load_model(self.MODEL_SIZE)
-        
-        print(f"\n--- Transcribing: {os.path.basename(audio_path)} ---")
-        
-        # 1. Transcribe the audio file
-        result = self.MODEL.transcribe(audio_path, verbose=False)
-
-        full_transcript = result["text"]
-        # 3. Save the data to the database
-        self.save_transcript_to_patient_report(report_id,full_transcript)
+
+        # Claim the row first so a second listener never transcribes it too
+        with METRICS.time_stage("fetch"):
+            report = self.queue.claim_audio_report(report_id)
+        if not report:
+            self.conn.rollback()
+            print(f"[SKIP] Audio for report {report_id} already transcribed, claimed elsewhere or not found.")
+            return
+
+        # Identical audio (same path or same bytes) reuses the earlier transcript
+        with METRICS.time_stage("transcript_cache"):
+            full_transcript, content_hash = self.cache.lookup(audio_path)
+        if full_transcript is not None:
+            print(f"[CACHE] Reusing transcript for {os.path.basename(audio_path)}")
+        else:
+            print(f"\n--- Transcribing: {os.path.basename(audio_path)} ---")
+
+            # 1. Transcribe the audio file in chunks (models stay loaded across reports)
+            with METRICS.time_stage("whisper"):
+                full_transcript = self.engine.transcribe(audio_path)
+
+            # 2. Remember it for later uploads of the same audio
+            self.cache.store(audio_path, content_hash, full_transcript)
+
+        # 3. Extract keywords in-process and save both in one transaction
+        entities = None
+        if self.keyword_processor is not None:
+            # Extraction shares this transaction (keyword cache queries); a savepoint lets a
+            # failed query be undone without losing the claim or the transcript
+            self.cursor.execute("SAVEPOINT inline_keywords")
+            try:
+                with METRICS.time_stage("nlp"):
+                    entities = self.keyword_processor.extract_medical_entities(full_transcript)
+                self.cursor.execute("RELEASE SAVEPOINT inline_keywords")
+            except Exception as e:
+                self.cursor.execute("ROLLBACK TO SAVEPOINT inline_keywords")
+                entities = None
+                # Fall back to the trigger-driven extraction pass
+                print(f"[WARN] Inline keyword extraction failed for {report_id}: {e}")
+
+        with METRICS.time_stage("write"):
+            if entities is not None:
+                self.save_transcript_with_keywords(report_id, full_transcript, entities)
+            else:
+                self.save_transcript_to_patient_report(report_id,full_transcript)
+        METRICS.observe_lag(report['CreatedAt'])
 
         print("--- Process Complete ---")
-       
\ No newline at end of file
+
+    def close(self):
+        if self.keyword_processor is not None:
+            self.keyword_processor.close()
+        self.cursor.close()
+        self.conn.close()
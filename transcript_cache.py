@@ -0,0 +1,84 @@
+import hashlib
+import os
+
+from db_config import DBConfig
+
+# Reuse transcripts for audio that has been transcribed before with the same model
+TRANSCRIPT_CACHE_ENABLED = os.getenv('TRANSCRIPT_CACHE_ENABLED', 'true').lower() == 'true'
+
+
+def audio_hash(audio_path, block_size=1 << 20):
+    """SHA-256 of the raw audio bytes, read in blocks"""
+    digest = hashlib.sha256()
+    with open(audio_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TranscriptCache:
+    """
+    Transcript cache in the AudioTranscriptCache table, keyed by audio content
+    hash and Whisper model size. A file already seen at the same VoiceDirectory
+    with unchanged size and mtime is matched without re-reading its bytes.
+    Writes join the caller's transaction.
+    """
+    def __init__(self, cursor, model_size, schema=None, enabled=TRANSCRIPT_CACHE_ENABLED):
+        self.cursor = cursor
+        self.model_size = model_size
+        self.schema = schema or DBConfig.SCHEMA
+        self.enabled = enabled
+
+    def _lookup_by_path(self, audio_path, stat):
+        self.cursor.execute(f"""
+            SELECT "AudioHash", "Transcript"
+            FROM "{self.schema}"."AudioTranscriptCache"
+            WHERE "VoiceDirectory" = %s
+              AND "ModelSize" = %s
+              AND "FileSize" = %s
+              AND "FileMtime" = %s
+            LIMIT 1
+        """, (audio_path, self.model_size, stat.st_size, stat.st_mtime))
+        return self.cursor.fetchone()
+
+    def _lookup_by_hash(self, content_hash):
+        self.cursor.execute(f"""
+            SELECT "AudioHash", "Transcript"
+            FROM "{self.schema}"."AudioTranscriptCache"
+            WHERE "AudioHash" = %s
+              AND "ModelSize" = %s
+        """, (content_hash, self.model_size))
+        return self.cursor.fetchone()
+
+    def lookup(self, audio_path):
+        """Return (transcript or None, content hash or None)"""
+        if not self.enabled:
+            return None, None
+
+        stat = os.stat(audio_path)
+        row = self._lookup_by_path(audio_path, stat)
+        if row:
+            return row['Transcript'], row['AudioHash']
+
+        content_hash = audio_hash(audio_path)
+        row = self._lookup_by_hash(content_hash)
+        if row:
+            # Remember this path too, so the next upload of it skips hashing
+            self.store(audio_path, content_hash, row['Transcript'])
+            return row['Transcript'], content_hash
+        return None, content_hash
+
+    def store(self, audio_path, content_hash, transcript):
+        if not self.enabled:
+            return
+        content_hash = content_hash or audio_hash(audio_path)
+        stat = os.stat(audio_path)
+        self.cursor.execute(f"""
+            INSERT INTO "{self.schema}"."AudioTranscriptCache"
+                ("AudioHash", "ModelSize", "Transcript", "VoiceDirectory", "FileSize", "FileMtime")
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT ("AudioHash", "ModelSize") DO UPDATE
+            SET "VoiceDirectory" = EXCLUDED."VoiceDirectory",
+                "FileSize" = EXCLUDED."FileSize",
+                "FileMtime" = EXCLUDED."FileMtime"
+        """, (content_hash, self.model_size, transcript, audio_path, stat.st_size, stat.st_mtime))
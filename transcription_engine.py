@@ -0,0 +1,182 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from model_loader import LazyModel, timed_import
+
+WHISPER_MODEL_SIZE = os.getenv('WHISPER_MODEL_SIZE', 'base')
+# Worker processes for chunk transcription (1 = transcribe chunks in-process)
+WHISPER_WORKERS = int(os.getenv('WHISPER_WORKERS', '1'))
+WHISPER_CHUNK_SECONDS = float(os.getenv('WHISPER_CHUNK_SECONDS', '30'))
+# 'vad' cuts at the quietest point near each boundary, 'fixed' cuts every chunk_seconds
+WHISPER_CHUNK_MODE = os.getenv('WHISPER_CHUNK_MODE', 'vad')
+
+SAMPLE_RATE = 16000  # whisper.load_audio always resamples to 16 kHz mono
+
+_WHISPER_MODELS = {}
+_WHISPER_LOCK = threading.Lock()
+
+
+def _device():
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def whisper_model(model_size):
+    """Shared lazy handle per Whisper model size; whisper/torch are imported on first load"""
+    with _WHISPER_LOCK:
+        if model_size not in _WHISPER_MODELS:
+            def load():
+                whisper = timed_import("whisper")
+                return whisper.load_model(model_size, device=_device())
+            _WHISPER_MODELS[model_size] = LazyModel(f"Whisper '{model_size}'", load)
+        return _WHISPER_MODELS[model_size]
+
+
+def _transcribe_with(model, audio):
+    # fp16 is only supported on GPU; forcing it off avoids the CPU warning and fallback
+    result = model.transcribe(audio, verbose=False, fp16=(model.device.type == "cuda"))
+    return result["text"].strip()
+
+
+# --- Process pool workers: each process loads the model once and reuses it ---
+_worker_model = None
+
+
+def _init_worker(model_size, torch_threads):
+    global _worker_model
+    import torch
+    import whisper
+
+    torch.set_num_threads(torch_threads)
+    _worker_model = whisper.load_model(model_size, device=_device())
+
+
+def _transcribe_chunk(audio):
+    return _transcribe_with(_worker_model, audio)
+
+
+def _warm_worker():
+    return _worker_model is not None
+
+
+# --- Chunking ---
+def split_fixed(audio, chunk_seconds):
+    """Cut audio into consecutive chunks of chunk_seconds"""
+    step = max(1, int(chunk_seconds * SAMPLE_RATE))
+    return [audio[i:i + step] for i in range(0, len(audio), step)]
+
+
+def split_on_silence(audio, max_seconds, frame_ms=30, search_seconds=5.0):
+    """
+    Energy-based VAD: end each chunk at the quietest frame within the last
+    search_seconds before max_seconds, so words are not cut in half.
+    Falls back to a hard cut at max_seconds when the search window is empty.
+    """
+    import numpy as np
+
+    max_len = max(1, int(max_seconds * SAMPLE_RATE))
+    if len(audio) <= max_len:
+        return [audio]
+
+    frame = max(1, int(SAMPLE_RATE * frame_ms / 1000))
+    n_frames = len(audio) // frame
+    energy = np.sqrt(np.mean(audio[:n_frames * frame].reshape(n_frames, frame) ** 2, axis=1))
+
+    search_frames = max(1, int(search_seconds * SAMPLE_RATE / frame))
+    chunks = []
+    start = 0
+    while len(audio) - start > max_len:
+        limit_frame = (start + max_len) // frame
+        first_frame = max(start // frame + 1, limit_frame - search_frames)
+        window = energy[first_frame:limit_frame]
+        cut = (first_frame + int(np.argmin(window))) * frame if len(window) else start + max_len
+        chunks.append(audio[start:cut])
+        start = cut
+    chunks.append(audio[start:])
+    return chunks
+
+
+class ChunkedTranscriptionEngine:
+    """
+    Splits audio into chunks and transcribes them in a process pool where each
+    worker keeps one loaded Whisper model for its lifetime, then stitches the
+    chunk transcripts back together in order. Runs on CPU-only hosts.
+    """
+    def __init__(self, model_size=WHISPER_MODEL_SIZE, workers=WHISPER_WORKERS,
+                 chunk_seconds=WHISPER_CHUNK_SECONDS, chunk_mode=WHISPER_CHUNK_MODE):
+        self.model_size = model_size
+        self.workers = max(1, workers)
+        self.chunk_seconds = chunk_seconds
+        self.chunk_mode = chunk_mode
+        self.pool = None
+        self.lock = threading.Lock()
+        # The in-process model is not thread-safe: one transcription at a time
+        self.model_lock = threading.Lock()
+
+    def _get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                # Share the CPU between workers instead of every worker using all cores
+                torch_threads = max(1, (os.cpu_count() or 1) // self.workers)
+                self.pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.model_size, torch_threads)
+                )
+                print(f"✓ Whisper pool started: {self.workers} worker(s), model '{self.model_size}'")
+            return self.pool
+
+    def split(self, audio):
+        if self.chunk_mode == "fixed":
+            return split_fixed(audio, self.chunk_seconds)
+        return split_on_silence(audio, self.chunk_seconds)
+
+    def transcribe_array(self, audio):
+        chunks = [c for c in self.split(audio) if len(c)]
+        if not chunks:
+            return ""
+
+        if self.workers <= 1:
+            model = whisper_model(self.model_size).get()
+            with self.model_lock:
+                texts = [_transcribe_with(model, chunk) for chunk in chunks]
+        else:
+            texts = list(self._get_pool().map(_transcribe_chunk, chunks))
+
+        return " ".join(t for t in texts if t)
+
+    def transcribe(self, audio_path):
+        import whisper
+
+        audio = whisper.load_audio(audio_path)
+        return self.transcribe_array(audio)
+
+    def preload_async(self):
+        """Load the model (or start the worker pool) in the background"""
+        if self.workers <= 1:
+            return whisper_model(self.model_size).preload_async()
+        pool = self._get_pool()
+        for _ in range(self.workers):
+            pool.submit(_warm_worker)
+
+    def close(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+
+
+_ENGINE = None
+_ENGINE_LOCK = threading.Lock()
+
+
+def get_engine():
+    """Process-wide engine so every audio worker thread shares one process pool"""
+    global _ENGINE
+    with _ENGINE_LOCK:
+        if _ENGINE is None:
+            _ENGINE = ChunkedTranscriptionEngine()
+        return _ENGINE